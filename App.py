@@ -2,13 +2,41 @@
 
 
 import json
+import os
 
-from flask import Flask, request, jsonify
-from my_package.apiRoutes import ApiRoutes
+from flask import Flask, Response, request, jsonify, stream_with_context
+from flask.helpers import get_debug_flag
+from my_package import metrics
+from my_package.ApiRoutes import ApiRoutes
 
 app = Flask(__name__)
 
 
+def warm_up():
+    """
+    Hook di avvio: crea le risorse condivise del worker e avvia i worker dei lavori
+    in background prima della prima richiesta. Con gunicorn viene richiamato da
+    post_worker_init (gunicorn.conf.py), così ogni worker ha le proprie.
+    """
+    routes = ApiRoutes.get_instance()
+    routes.warm_up()
+    routes.start_jobs()
+
+
+def _warm_up_on_import() -> bool:
+    """
+    Il warm-up avviene all'import del modulo (flask run, gunicorn senza file di
+    configurazione) tranne che:
+    - quando APP_WARM_UP_ON_IMPORT è "false": gunicorn.conf.py lo imposta perché con
+      preload_app l'import avviene nel master, prima del fork, e il warm-up è
+      affidato a post_worker_init;
+    - nel processo padre del reloader di flask run --debug, che non serve richieste.
+    """
+    if os.getenv("APP_WARM_UP_ON_IMPORT", "true").lower() != "true":
+        return False
+    return os.environ.get("WERKZEUG_RUN_MAIN") == "true" or not get_debug_flag()
+
+
 @app.route("/")
 def info():
     result = {
@@ -19,7 +47,7 @@ def info():
 @app.route("/create/index", methods=['GET'])
 def createIndex():
     res = ""
-    routes = ApiRoutes()
+    routes = ApiRoutes.get_instance()
     res = routes.create_index()
     if res:
         res = {"state": 200, "message": "L'indice è stato creato"}
@@ -31,9 +59,9 @@ def createIndex():
 @app.route("/get/sources", methods=['GET'])
 def getSources():
     res = ""
-    routes = ApiRoutes()
+    routes = ApiRoutes.get_instance()
     res = routes.get_sources()
-    if len(res) == 0:
+    if not res:
         res = {
             "state": 200,
             "message": "Non sono presenti sorgenti di dati"
@@ -44,14 +72,9 @@ def getSources():
 @app.route("/delete/<source>", methods=['GET'])
 def deleteSource(source):
     res = ""
-    routes = ApiRoutes()
+    routes = ApiRoutes.get_instance()
     
-    success, not_found, error  = routes.delete_source([source])
-    res = {
-        "success": success,
-        "not_found": not_found,
-        "error": error
-    }
+    res = routes.delete_source([source]).to_dict()
 
     return jsonify(res)
 
@@ -64,33 +87,23 @@ def deleteSources():
 			"error": "missing parameters"
 		}
     else:
-        routes = ApiRoutes()
-        success, not_found, error = routes.delete_source(data['sources'])
-        res = {
-            "success": success,
-            "not_found": not_found,
-            "error": error
-        }
+        routes = ApiRoutes.get_instance()
+        res = routes.delete_source(data['sources']).to_dict()
 
     return jsonify(res)
 
 @app.route("/delete/all", methods=['GET'])
 def deleteAll():
     res = ""
-    routes = ApiRoutes()
-    success, not_found, error = routes.delete_all()
-    res = {
-        "success": success,
-        "not_found": not_found,
-        "error": error
-    }
+    routes = ApiRoutes.get_instance()
+    res = routes.delete_all().to_dict()
 
     return jsonify(res)
 
 @app.route("/delete/index", methods=['GET'])
 def deleteIndex():
     res = ""
-    routes = ApiRoutes()
+    routes = ApiRoutes.get_instance()
     res = routes.delete_index()
     if res:
         res = {"state": 200, "message": "L'indice è stato rimosso con successo"}
@@ -99,11 +112,41 @@ def deleteIndex():
 
     return jsonify(res)
 
+@app.route("/index/storage", methods=['GET'])
+def indexStorage():
+    '''
+    Riporta il tipo di indice, i byte in memoria per vettore e la compressione
+    rispetto ai vettori float32
+    '''
+    routes = ApiRoutes.get_instance()
+    report = routes.index_storage()
+    if report is not None:
+        res = {"state": 200, "storage": report}
+    else:
+        res = {"state": 410, "message": "Non sono riuscito a leggere lo spazio occupato dall'indice"}
+
+    return jsonify(res)
+
+@app.route("/manifest/reconcile", methods=['GET'])
+def reconcileManifest():
+    res = ""
+    routes = ApiRoutes.get_instance()
+    count = routes.reconcile_manifest()
+    if count >= 0:
+        res = {"state": 200, "message": "Il manifest è stato ricostruito", "vectors": count}
+    else:
+        res = {"state": 410, "message": "Non sono riuscito a ricostruire il manifest"}
+
+    return jsonify(res)
+
 @app.route("/chat", methods=['POST'])
 def chat():
     '''
     {
-        "query": "Path dei PDF che si vuole caricare. Devono essere path assolute"
+        "query": "Path dei PDF che si vuole caricare. Devono essere path assolute",
+        "session_id": "Opzionale: id della conversazione, per tenere separata la memoria di ogni utente",
+        "sources": ["Opzionale: sorgenti a cui limitare la ricerca"],
+        "timings": "Opzionale: se true la risposta riporta i millisecondi spesi in ogni fase e i token del contesto"
     }
     '''
     res = ""
@@ -113,9 +156,10 @@ def chat():
 			"error": "missing parameters"
 		}
     else:
-        routes = ApiRoutes()
+        routes = ApiRoutes.get_instance()
         if routes.init_ChatBot():
-            respone, sources, model = routes.chat(data['query'])
+            with metrics.request_timings() as timings, metrics.request_stats() as stats:
+                respone, sources, model = routes.chat(data['query'], data.get('session_id', 'default'), data.get('sources'))
             res = {
                 "state": 200,
                 "model": model,
@@ -123,6 +167,9 @@ def chat():
                 "message": respone,
                 "sources": " ,".join(sources)
             }
+            if data.get('timings'):
+                res["timings"] = metrics.format_timings(timings)
+                res["context"] = stats
             
         else:
             res = {
@@ -132,6 +179,63 @@ def chat():
 
     return jsonify(res)
 
+@app.route("/chat/stream", methods=['POST'])
+def chatStream():
+    '''
+    {
+        "query": "Domanda da porre al chatbot",
+        "session_id": "Opzionale: id della conversazione, per tenere separata la memoria di ogni utente",
+        "sources": ["Opzionale: sorgenti a cui limitare la ricerca"],
+        "timings": "Opzionale: se true l'evento finale riporta i millisecondi spesi in ogni fase e i token del contesto"
+    }
+
+    Risponde con Server-Sent Events: un evento "token" per ogni token generato e un
+    evento finale "sources" con risposta completa, sorgenti e modello
+    '''
+    data = request.get_json()
+    if data is None:
+        return jsonify({"error": "missing parameters"})
+
+    routes = ApiRoutes.get_instance()
+    if not routes.init_ChatBot():
+        return jsonify({
+            "state": 410,
+            "message": "Ci sono stati dei problemi nel collegamento con il chatbot"
+        })
+
+    def events():
+        # Il contesto resta attivo per tutto lo stream: raccoglie anche i tempi del thread del chatbot
+        with metrics.request_timings() as timings, metrics.request_stats() as stats:
+            for event in routes.stream_chat(data['query'], data.get('session_id', 'default'), data.get('sources')):
+                if event["type"] == "token":
+                    yield f"event: token\ndata: {json.dumps(event['data'])}\n\n"
+                elif event["type"] == "end":
+                    payload = {
+                        "state": 200,
+                        "model": event["data"]["model"],
+                        "query": data['query'],
+                        "message": event["data"]["message"],
+                        "sources": " ,".join(event["data"]["sources"])
+                    }
+                    if data.get('timings'):
+                        payload["timings"] = metrics.format_timings(timings)
+                        payload["context"] = stats
+                    yield f"event: sources\ndata: {json.dumps(payload)}\n\n"
+                else:
+                    yield f"event: error\ndata: {json.dumps(event['data'])}\n\n"
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(events()), mimetype="text/event-stream", headers=headers)
+
+
+@app.route("/metrics", methods=['GET'])
+def getMetrics():
+    '''
+    Metriche del processo nel formato testuale di Prometheus: durata delle fasi di
+    caricamento e chat, elementi elaborati, token, hit delle cache ed errori
+    '''
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 
 @app.route("/upload/pdf", methods=['POST'])
 def upload():
@@ -141,6 +245,9 @@ def upload():
             "Path dei PDF che si vuole caricare. Devono essere path assolute"
         ]
     }
+
+    Il caricamento avviene in background: la risposta contiene l'id del lavoro,
+    il cui avanzamento si consulta con /jobs/<job_id>
     '''
     res = ""
     data = request.get_json()
@@ -149,16 +256,66 @@ def upload():
 			"error": "missing parameters"
 		}
     else:
-        routes = ApiRoutes()
-        uploaded, not_uploaded, wrong_path = routes.upload_pdfs(data['path'])
+        routes = ApiRoutes.get_instance()
+        job_id = routes.enqueue_pdfs(data['path'])
         res = {
-            "uploaded": uploaded,
-            "not_uploaded": not_uploaded,
-            "wrong_path": wrong_path
+            "state": 202,
+            "job_id": job_id,
+            "message": "Il caricamento è stato messo in coda"
         }
 
     return jsonify(res)
 
+@app.route("/history", methods=['GET'])
+def getHistory():
+    '''
+    Parametri opzionali: path, state, since e until (timestamp), limit
+    '''
+    res = ""
+    routes = ApiRoutes.get_instance()
+    res = routes.get_history(
+        path=request.args.get("path"),
+        state=request.args.get("state"),
+        since=request.args.get("since", type=float),
+        until=request.args.get("until", type=float),
+        limit=request.args.get("limit", type=int)
+    )
+
+    return jsonify(res)
+
+@app.route("/history/compact", methods=['GET'])
+def compactHistory():
+    '''
+    Parametri opzionali: keep (record da mantenere per file, predefinito 1), older_than (timestamp)
+    '''
+    res = ""
+    routes = ApiRoutes.get_instance()
+    removed = routes.compact_history(
+        keep_per_path=request.args.get("keep", 1, type=int),
+        older_than=request.args.get("older_than", type=float)
+    )
+    res = {"state": 200, "message": "La cronologia è stata compattata", "removed": removed}
+
+    return jsonify(res)
+
+@app.route("/jobs/<job_id>", methods=['GET'])
+def getJob(job_id):
+    res = ""
+    routes = ApiRoutes.get_instance()
+    job = routes.get_job(job_id)
+    if job is None:
+        res = {"state": 404, "message": "Il lavoro richiesto non esiste"}
+    else:
+        res = job
+
+    return jsonify(res)
+
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    # Con debug=True il processo padre del reloader si limita a riavviare il figlio
+    # quando cambia il codice: solo il figlio (WERKZEUG_RUN_MAIN) serve le richieste
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        warm_up()
+    app.run(debug=True)
+elif _warm_up_on_import():
+    warm_up()
\ No newline at end of file
@@ -0,0 +1,203 @@
+import hashlib
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from langchain.llms.base import LLM
+
+from my_package.backends import VectorBackend, VectorBackendError
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Modello di embedding deterministico: lo stesso testo produce sempre lo stesso
+    vettore (normalizzato), generato a partire dal suo hash. Ogni chiamata attende
+    latency secondi più per_text_latency secondi per testo, come una richiesta remota.
+    """
+
+    def __init__(self, dimension: int, latency: float = 0.0, per_text_latency: float = 0.0) -> None:
+        self.dimension = dimension
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+        self.calls = 0
+        self.texts = 0
+        self._lock = threading.Lock()
+
+    def _embed(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def _wait(self, count: int) -> None:
+        with self._lock:
+            self.calls += 1
+            self.texts += count
+        delay = self.latency + self.per_text_latency * count
+        if delay > 0:
+            time.sleep(delay)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._wait(len(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self._wait(1)
+        return self._embed(text)
+
+
+class InMemoryBackend(VectorBackend):
+    """
+    Indice vettoriale in memoria con ricerca esatta, usato al posto di Pinecone.
+    Ogni chiamata attende latency secondi, come un salto di rete.
+    """
+
+    DELETE_BATCH_SIZE = 1000
+
+    def __init__(self, index_name: str, dimension: int, metric: str = "cosine", latency: float = 0.0) -> None:
+        super().__init__(index_name, dimension, metric)
+        self.latency = latency
+        self._lock = threading.RLock()
+        self._namespaces = None  # namespace -> {id: (vettore, metadata)}
+        self._matrices = {}  # namespace -> (id, matrice) calcolata alla prima query
+
+    def _wait(self) -> None:
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def _vectors(self, namespace: str) -> Dict[str, Tuple[np.ndarray, Dict[str, Any]]]:
+        if self._namespaces is None:
+            raise VectorBackendError(f"L'indice {self.index_name} non esiste")
+        return self._namespaces.setdefault(namespace, {})
+
+    def index_exists(self) -> bool:
+        return self._namespaces is not None
+
+    def create_index(self) -> bool:
+        self._wait()
+        with self._lock:
+            if self._namespaces is not None:
+                return False
+            self._namespaces = {}
+            self._matrices = {}
+            return True
+
+    def delete_index(self) -> bool:
+        self._wait()
+        with self._lock:
+            if self._namespaces is None:
+                return False
+            self._namespaces = None
+            self._matrices = {}
+            return True
+
+    def upsert(self, vectors: List[Tuple[str, List[float], Dict[str, Any]]], namespace: str = "") -> int:
+        self._wait()
+        with self._lock:
+            store = self._vectors(namespace)
+            for vec_id, values, metadata in vectors:
+                store[vec_id] = (np.asarray(values, dtype="float32"), metadata)
+            self._matrices.pop(namespace, None)
+        return len(vectors)
+
+    def query(self, vector: List[float], top_k: int, namespace: str = "") -> List[Dict[str, Any]]:
+        self._wait()
+        with self._lock:
+            store = self._vectors(namespace)
+            if not store:
+                return []
+            if namespace not in self._matrices:
+                ids = list(store)
+                self._matrices[namespace] = (ids, np.stack([store[vec_id][0] for vec_id in ids]))
+            ids, matrix = self._matrices[namespace]
+            query = np.asarray(vector, dtype="float32")
+            if self.metric == "euclidean":
+                scores = np.linalg.norm(matrix - query, axis=1)
+                order = np.argsort(scores)[:top_k]
+            else:
+                scores = matrix @ query
+                if self.metric == "cosine":
+                    scores = scores / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+                order = np.argsort(-scores)[:top_k]
+            return [
+                {"id": ids[i], "score": float(scores[i]), "metadata": store[ids[i]][1]} for i in order
+            ]
+
+    def delete(self, ids: List[str], namespace: str = "") -> None:
+        self._wait()
+        with self._lock:
+            store = self._vectors(namespace)
+            for vec_id in ids:
+                store.pop(vec_id, None)
+            self._matrices.pop(namespace, None)
+
+    def delete_namespace(self, namespace: str) -> None:
+        self._wait()
+        with self._lock:
+            self._vectors(namespace)
+            del self._namespaces[namespace]
+            self._matrices.pop(namespace, None)
+
+    def delete_all(self) -> None:
+        self._wait()
+        with self._lock:
+            if self._namespaces is None:
+                raise VectorBackendError(f"L'indice {self.index_name} non esiste")
+            self._namespaces = {}
+            self._matrices = {}
+
+    def list_namespaces(self) -> List[str]:
+        with self._lock:
+            return list(self._namespaces or {})
+
+    def list_ids_and_source(self) -> List[Dict[str, str]]:
+        self._wait()
+        with self._lock:
+            if self._namespaces is None:
+                raise VectorBackendError(f"L'indice {self.index_name} non esiste")
+            return [
+                {"id": vec_id, "source": metadata["source"]}
+                for store in self._namespaces.values()
+                for vec_id, (_, metadata) in store.items()
+            ]
+
+
+class CannedLLM(LLM):
+    """
+    LLM che restituisce sempre la stessa risposta, parola per parola: attende
+    latency secondi prima del primo token e token_latency secondi tra un token e l'altro.
+    """
+
+    answer: str = "Secondo i documenti caricati la risposta alla domanda si trova nei paragrafi indicati."
+    latency: float = 0.0
+    token_latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "canned"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None) -> str:
+        if self.latency > 0:
+            time.sleep(self.latency)
+        for word in self.answer.split(" "):
+            if self.token_latency > 0:
+                time.sleep(self.token_latency)
+            if run_manager is not None:
+                run_manager.on_llm_new_token(word + " ")
+        return self.answer
+
+
+class WhitespaceEncoding(object):
+    """
+    Sostituto di un encoding tiktoken (un token per parola), usato solo se tiktoken
+    non riesce a caricare i propri encoding, ad esempio senza rete.
+    """
+
+    name = "whitespace"
+
+    def encode(self, text: str, disallowed_special: Any = ()) -> List[str]:
+        return text.split()
+
+    def decode(self, tokens: List[str]) -> str:
+        return " ".join(tokens)
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Benchmark offline di caricamento e chat: nessuna chiamata a OpenAI o Pinecone.
+
+Embedding, indice vettoriale e LLM sono sostituiti dai finti di benchmarks/fakes.py,
+con latenze artificiali configurabili; i PDF sono generati sinteticamente. I risultati
+(throughput, latenza p50/p99 e picco di memoria per ogni scenario) sono scritti in
+JSON, così da poter confrontare commit diversi.
+
+Uso:
+    python benchmarks/run.py --pdfs 4 --pages 40 --output risultati.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic_pdf import make_pdf
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark offline di caricamento e chat")
+    parser.add_argument("--pdfs", type=int, default=4, help="PDF sintetici per ogni giro di caricamento")
+    parser.add_argument("--pages", type=int, default=40, help="Pagine di ogni PDF")
+    parser.add_argument("--lines-per-page", type=int, default=40, help="Righe di testo per pagina")
+    parser.add_argument("--upload-rounds", type=int, default=3, help="Giri di ApiRoutes.upload_pdfs, ognuno con PDF nuovi")
+    parser.add_argument("--sources", type=int, default=8, help="Sorgenti caricate con Vectorstore.upload_data")
+    parser.add_argument("--repeat", type=int, default=50, help="Ripetizioni di get_all_source")
+    parser.add_argument("--chat-requests", type=int, default=20, help="Richieste alla route /chat")
+    parser.add_argument("--splitter", choices=("character", "token"), default="character", help="Suddivisione dei PDF (PDF_SPLITTER)")
+    parser.add_argument("--dimension", type=int, default=256, help="Dimensione dei vettori")
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="Latenza di ogni chiamata di embedding (s)")
+    parser.add_argument("--embed-text-latency", type=float, default=0.0005, help="Latenza aggiuntiva per testo embeddato (s)")
+    parser.add_argument("--index-latency", type=float, default=0.01, help="Latenza di ogni chiamata all'indice (s)")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Latenza dell'LLM prima del primo token (s)")
+    parser.add_argument("--llm-token-latency", type=float, default=0.005, help="Latenza tra due token dell'LLM (s)")
+    parser.add_argument("--no-trace-memory", action="store_true", help="Non misura il picco di memoria (tracemalloc rallenta il codice Python)")
+    parser.add_argument("--output", help="File JSON dei risultati (predefinito: stdout)")
+    parser.add_argument("--keep", action="store_true", help="Non elimina la cartella di lavoro temporanea")
+    return parser.parse_args()
+
+
+def configure_env(args: argparse.Namespace, work_dir: str) -> None:
+    """
+    Imposta la configurazione dell'applicativo prima di importarlo: tutti i file
+    di stato finiscono nella cartella di lavoro temporanea.
+    """
+    os.environ.update({
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_MODEL_NAME": "benchmark",
+        "OPENAI_TEMPERATURE": "0",
+        "OPENAI_TOP_P": "1",
+        "OPENAI_PRESENCE_PENALTY": "0",
+        "OPENAI_FREQUENCY_PENALTY": "0",
+        "OPENAI_PROMPT_TEMPLATE": "{history}\n{context}\nDomanda: {question}\nRisposta:",
+        "PINECONE_INDEX_NAME": "benchmark",
+        "PINECONE_INDEX_DIMENSION": str(args.dimension),
+        "PINECONE_INDEX_METRIC": "cosine",
+        "PINECONE_TOP_K": "10",
+        "HISTORY_FILE": os.path.join(work_dir, "history.json"),
+        "HISTORY_DB": os.path.join(work_dir, "history.sqlite3"),
+        "MANIFEST_DB": os.path.join(work_dir, "manifest.sqlite3"),
+        "LEXICAL_INDEX_DB": os.path.join(work_dir, "lexical_index.sqlite3"),
+        "JOBS_DB": os.path.join(work_dir, "jobs.sqlite3"),
+        "EMBEDDING_CACHE_ENABLED": "false",
+        "ANSWER_CACHE_ENABLED": "false",
+        "PDF_SPLITTER": args.splitter,
+        # Le fasi vengono misurate dal benchmark: niente warm-up all'import di App.py
+        "APP_WARM_UP_ON_IMPORT": "false",
+    })
+
+
+def install_fakes(args: argparse.Namespace) -> Dict:
+    """
+    Sostituisce embedding, backend vettoriale e LLM con i finti.
+
+    Returns:
+    - Dict: Gli oggetti finti, per leggerne i contatori a fine esecuzione.
+    """
+    from benchmarks.fakes import CannedLLM, FakeEmbeddings, InMemoryBackend
+    import my_package.vectorstore as vectorstore_module
+    import my_package.Chatbot as chatbot_module
+
+    embeddings = FakeEmbeddings(args.dimension, args.embed_latency, args.embed_text_latency)
+    vectorstore_module._embeddings = embeddings
+    backends = {}
+
+    def get_backend(index_name):
+        return backends.setdefault(
+            index_name, InMemoryBackend(index_name, args.dimension, latency=args.index_latency)
+        )
+
+    vectorstore_module.get_backend = get_backend
+    chatbot_module.OpenAI = lambda **kwargs: CannedLLM(
+        latency=args.llm_latency, token_latency=args.llm_token_latency
+    )
+    return {"embeddings": embeddings, "backends": backends}
+
+
+def install_tokenizer() -> str:
+    """
+    Usa tiktoken se i suoi encoding sono disponibili (sono scaricati alla prima
+    richiesta), altrimenti un encoding per parole, così il benchmark resta offline.
+
+    Returns:
+    - str: Il tokenizer usato, riportato nei risultati.
+    """
+    import my_package.tokens as tokens_module
+    original = tokens_module.get_encoding
+    try:
+        original("cl100k_base")
+        return "tiktoken"
+    except Exception:
+        pass
+    from benchmarks.fakes import WhitespaceEncoding
+    encoding = WhitespaceEncoding()
+    # I moduli che hanno importato get_encoding direttamente vanno aggiornati uno per uno
+    for name, module in list(sys.modules.items()):
+        if name.startswith("my_package") and getattr(module, "get_encoding", None) is original:
+            module.get_encoding = lambda name: encoding
+    return encoding.name
+
+
+def run_scenario(name: str, operations: List[Callable[[], int]], unit: str, trace_memory: bool) -> Dict:
+    """
+    Esegue le operazioni in sequenza misurandone la latenza.
+
+    Parameters:
+    - name (str): Nome dello scenario, stampato a video.
+    - operations (List[Callable[[], int]]): Operazioni; ognuna restituisce quante unità ha elaborato.
+    - unit (str): Unità elaborate (chunk, file, richieste...), per il throughput.
+    - trace_memory (bool): Se True misura il picco di memoria allocata da Python.
+
+    Returns:
+    - Dict: Operazioni, unità, durata, throughput, latenze p50/p99/max e picco di memoria.
+    """
+    print(f"Scenario {name}: {len(operations)} operazioni", file=sys.stderr)
+    if trace_memory:
+        tracemalloc.start()
+    latencies = []
+    items = 0
+    start = time.perf_counter()
+    for operation in operations:
+        begin = time.perf_counter()
+        items += operation()
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+    p50, p99 = np.percentile(latencies, [50, 99]) if latencies else (0.0, 0.0)
+    return {
+        "operations": len(operations),
+        "unit": unit,
+        "items": items,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_per_s": round(items / elapsed, 2) if elapsed > 0 else None,
+        "latency_p50_ms": round(float(p50) * 1000, 2),
+        "latency_p99_ms": round(float(p99) * 1000, 2),
+        "latency_max_ms": round(max(latencies) * 1000, 2) if latencies else 0.0,
+        "peak_memory_mb": round(peak, 2) if peak is not None else None,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def max_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux riporta kilobyte, macOS byte
+    return round(rss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 2)
+
+
+def main() -> None:
+    args = parse_args()
+    # Le catene di langchain sono verbose: il loro output va su stderr, così su stdout resta solo il JSON
+    with redirect_stdout(sys.stderr):
+        results = benchmark(args)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+
+def benchmark(args: argparse.Namespace) -> Dict:
+    trace_memory = not args.no_trace_memory
+    work_dir = tempfile.mkdtemp(prefix="pdf-chatbot-bench-")
+    configure_env(args, work_dir)
+    fakes = install_fakes(args)
+    tokenizer = install_tokenizer()
+
+    from my_package.pdf2chunks import Pdf2Chunks
+    from my_package.ApiRoutes import ApiRoutes
+    from App import app
+
+    pdf_dir = os.path.join(work_dir, "pdf")
+    os.makedirs(pdf_dir)
+
+    def new_pdfs(prefix: str, count: int) -> List[str]:
+        paths = []
+        for number in range(count):
+            path = os.path.join(pdf_dir, f"{prefix}_{number}.pdf")
+            make_pdf(path, args.pages, lines_per_page=args.lines_per_page, seed=zlib.crc32(f"{prefix}_{number}".encode()))
+            paths.append(path)
+        return paths
+
+    scenarios = {}
+    try:
+        # Estrazione e suddivisione in chunk
+        chunk_pdfs = new_pdfs("chunks", args.pdfs)
+        texts = []
+
+        def chunk(path):
+            def operation():
+                docs = [doc.page_content for doc in Pdf2Chunks.iterChunks(path)]
+                texts.append(docs)
+                return len(docs)
+            return operation
+
+        scenarios["pdf2chunks.iterChunks"] = run_scenario(
+            "pdf2chunks.iterChunks", [chunk(path) for path in chunk_pdfs], "chunks", trace_memory
+        )
+
+        routes = ApiRoutes.get_instance()
+        vectorstore = routes.vectorstore
+
+        # Caricamento completo dei PDF (estrazione, embedding, indice, manifest, cronologia)
+        def upload(paths):
+            def operation():
+                uploaded, _, _ = routes.upload_pdfs(paths)
+                return len(uploaded)
+            return operation
+
+        rounds = [new_pdfs(f"upload{round_number}", args.pdfs) for round_number in range(args.upload_rounds)]
+        scenarios["ApiRoutes.upload_pdfs"] = run_scenario(
+            "ApiRoutes.upload_pdfs", [upload(paths) for paths in rounds], "files", trace_memory
+        )
+
+        # Caricamento di testi già suddivisi
+        sources = [f"bench_source_{number}.pdf" for number in range(args.sources)]
+
+        def upload_data(source, data):
+            def operation():
+                vectorstore.upload_data(data, source)
+                return len(data)
+            return operation
+
+        scenarios["Vectorstore.upload_data"] = run_scenario(
+            "Vectorstore.upload_data",
+            [upload_data(source, texts[number % len(texts)]) for number, source in enumerate(sources)],
+            "chunks",
+            trace_memory
+        )
+
+        def list_sources():
+            vectorstore.get_all_source()
+            return 1
+
+        scenarios["Vectorstore.get_all_source"] = run_scenario(
+            "Vectorstore.get_all_source", [list_sources] * args.repeat, "calls", trace_memory
+        )
+
+        # Chat attraverso la route Flask: la prima richiesta (creazione del chatbot) non è misurata
+        client = app.test_client()
+        client.post("/chat", json={"query": "Domanda di riscaldamento", "session_id": "warm-up"})
+
+        def ask(number):
+            def operation():
+                response = client.post("/chat", json={
+                    "query": f"Cosa prevede l'articolo {number * 7 + 1} sul contratto?",
+                    "session_id": f"bench-{number % 4}",
+                })
+                if response.get_json().get("state") != 200:
+                    raise RuntimeError(f"Risposta inattesa da /chat: {response.get_json()}")
+                return 1
+            return operation
+
+        scenarios["flask./chat"] = run_scenario(
+            "flask./chat", [ask(number) for number in range(args.chat_requests)], "requests", trace_memory
+        )
+
+        def delete(source):
+            def operation():
+                success, _, _ = vectorstore.delete_data([source])
+                return len(success)
+            return operation
+
+        scenarios["Vectorstore.delete_data"] = run_scenario(
+            "Vectorstore.delete_data", [delete(source) for source in sources], "sources", trace_memory
+        )
+
+        if routes._chatbot is not None:
+            routes._chatbot.memory_writer.close()
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    embeddings = fakes["embeddings"]
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "tokenizer": tokenizer,
+        "config": vars(args),
+        "scenarios": scenarios,
+        "fakes": {"embedding_calls": embeddings.calls, "embedded_texts": embeddings.texts},
+        "max_rss_mb": max_rss_mb(),
+    }
+    return results
+
+
+if __name__ == "__main__":
+    main()
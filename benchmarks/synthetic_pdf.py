@@ -0,0 +1,67 @@
+import random
+
+
+# Vocabolario dei testi generati: parole comuni dei documenti legali caricati
+WORDS = (
+    "articolo comma legge decreto contratto lavoratore datore obbligo diritto termine "
+    "società contributo previdenza retribuzione ferie malattia licenziamento preavviso "
+    "accordo clausola parte sede tribunale ricorso sentenza norma disposizione regolamento "
+    "pagamento importo fattura scadenza interesse sanzione responsabilità danno risarcimento"
+).split()
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _page_lines(rng: random.Random, page: int, lines_per_page: int, words_per_line: int) -> list:
+    lines = []
+    for line in range(lines_per_page):
+        words = " ".join(rng.choice(WORDS) for _ in range(words_per_line))
+        lines.append(f"Art. {page * lines_per_page + line + 1} {words}")
+    return lines
+
+
+def make_pdf(path: str, pages: int, lines_per_page: int = 40, words_per_line: int = 12, seed: int = 0) -> None:
+    """
+    Scrive un PDF sintetico di testo semplice, leggibile da PyPDF2, senza dipendenze
+    aggiuntive. Lo stesso seed produce sempre lo stesso documento.
+
+    Parameters:
+    - path (str): Percorso del file da creare.
+    - pages (int): Numero di pagine.
+    - lines_per_page (int): Righe di testo per pagina.
+    - words_per_line (int): Parole per riga (più il numero dell'articolo).
+    - seed (int): Seme del generatore casuale.
+    """
+    rng = random.Random(seed)
+    # Oggetti 1 e 2 (catalogo e albero delle pagine) vengono scritti alla fine
+    objects = [None, None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page in range(pages):
+        lines = _page_lines(rng, page, lines_per_page, words_per_line)
+        content = "BT /F1 9 Tf 30 810 Td 11 TL " + " ".join(f"({_escape(line)}) '" for line in lines) + " ET"
+        data = content.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(data) + data + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = (
+        b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % i for i in page_ids) + b"] /Count %d >>" % pages
+    )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as pdf_file:
+        pdf_file.write(out)
@@ -0,0 +1,17 @@
+import os
+
+# Il warm-up avviene in post_worker_init: con preload_app l'import di App.py
+# avverrebbe nel master, e thread e connessioni non sopravvivono al fork
+os.environ["APP_WARM_UP_ON_IMPORT"] = "false"
+
+bind = os.getenv("GUNICORN_BIND", "127.0.0.1:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", 2))
+
+
+def post_worker_init(worker):
+    """
+    Ogni worker crea le proprie risorse (indice, chatbot, worker dei lavori in
+    background) dopo il fork, prima di accettare richieste.
+    """
+    from App import warm_up
+    warm_up()
@@ -1,18 +1,58 @@
-import json
+import hashlib
 import os
-from typing import Optional, Tuple
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional
 from dotenv import load_dotenv
-import langchain
+import openai
+import requests
 
-from my_package.chatbot import Chatbot
+from my_package import metrics
+from my_package.Chatbot import Chatbot
+from my_package.ingestion import BatchResult
+from my_package.history import HistoryStore
+from my_package.jobs import JobQueue
 from my_package.pdf2chunks import Pdf2Chunks
-from my_package.vectorstore import Vectorstore
+from my_package.vectorstore import DeleteReport, UploadReport, Vectorstore
 
 class ApiRoutes(object):
+    _instance = None
+    _instance_lock = threading.Lock()
     
     def __init__(self):
         self._get_env()
         self.vectorstore = Vectorstore(self._pinecone_index_name)
+        self._chatbot = None
+        self._chatbot_lock = threading.Lock()
+        self.history = HistoryStore(legacy_json=self._history_file)
+        self.jobs = JobQueue(self._run_job_file, self._save_job_history)
+        self._file_locks = {}
+        self._file_locks_lock = threading.Lock()
+        self._configure_http_pool()
+
+    @classmethod
+    def get_instance(cls) -> "ApiRoutes":
+        """
+        Restituisce l'istanza di ApiRoutes condivisa dal processo (worker).
+        Viene creata alla prima richiesta e riutilizzata da tutte le successive,
+        insieme a Vectorstore, connessioni e catena del chatbot.
+        """
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def warm_up(self) -> bool:
+        """
+        Inizializza in anticipo client, indice e catena del chatbot, così che le
+        richieste successive paghino solo il retrieval e la chiamata all'LLM.
+
+        Returns:
+        - bool: True se il chatbot è pronto, altrimenti False.
+        """
+        self.vectorstore.warm_up()
+        return self.init_ChatBot()
     
     def _get_env(self):
         load_dotenv()
@@ -23,6 +63,23 @@ class ApiRoutes(object):
         self._pinecone_index_name_chat_memory = os.getenv("PINECONE_INDEX_NAME_CHAT_MEMORY")
         self._model_openai = os.getenv("MODEL_OPENAI")
         self._pinecone_index_name = os.getenv("PINECONE_INDEX_NAME")
+        self._openai_http_pool_size = int(os.getenv("OPENAI_HTTP_POOL_SIZE", 10))
+        self._ingest_file_workers = int(os.getenv("INGEST_FILE_WORKERS", 4))
+
+    def _configure_http_pool(self):
+        """
+        Di default il client OpenAI apre una sessione HTTP per ogni thread, quindi
+        ogni richiesta Flask ripaga handshake TCP/TLS. Una sessione condivisa dal
+        processo mantiene le connessioni aperte tra una richiesta e l'altra.
+        """
+        if openai.requestssession is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=self._openai_http_pool_size,
+                pool_maxsize=self._openai_http_pool_size
+            )
+            session.mount("https://", adapter)
+            openai.requestssession = session
     
     def create_index(self) -> bool:
         return self.vectorstore.create_index()
@@ -30,19 +87,43 @@ class ApiRoutes(object):
     def get_sources(self) -> []:
         return self.vectorstore.get_all_source()
 
-    def delete_source(self, source: [str]) -> ([str], [str], [str]):
-        return self.vectorstore.delete_data(source)
+    def delete_source(self, source: [str]) -> DeleteReport:
+        return self.vectorstore.delete_sources(source)
     
-    def delete_all(self) -> ([str], [str], [str]):
-        return self.delete_source(self.get_sources())
+    def delete_all(self) -> DeleteReport:
+        self._flush_chat_memory()
+        return self.vectorstore.delete_all()
     
+    def reconcile_manifest(self) -> int:
+        return self.vectorstore.reconcile_manifest()
+
+    def index_storage(self) -> Optional[Dict]:
+        return self.vectorstore.storage_report()
+
     def delete_index(self) -> bool:
-        return self.vectorstore.delete_index()
+        with self._chatbot_lock:
+            self._flush_chat_memory()
+            success = self.vectorstore.delete_index()
+            if success:
+                # Il retriever del chatbot fa riferimento all'indice eliminato
+                if self._chatbot is not None:
+                    self._chatbot.memory_writer.close()
+                self._chatbot = None
+        return success
+
+    def _flush_chat_memory(self) -> None:
+        """
+        Scrive subito le domande della chat ancora in coda: scritte dopo
+        un'eliminazione sopravviverebbero (o ricreerebbero l'indice).
+        """
+        chatbot = self._chatbot
+        if chatbot is not None:
+            chatbot.memory_writer.flush()
     
     def upload_pdfs(self, pdfs: [str]) -> ([str], [str], [str]):
         """
         Carica il testo da file PDF in un sistema di indicizzazione e restituisce una lista dei nomi dei file che non è riuscito a caricare con successo.
-        Infine salva i percorsi dei file che sono stati caricati con successo in un file JSON.
+        Infine registra l'esito di ogni file nella cronologia dei caricamenti.
 
         Parameters:
         - pdfs (List[str]): Una lista di percorsi dei file PDF da elaborare.
@@ -53,90 +134,231 @@ class ApiRoutes(object):
             - La seconda lista contiene i percorsi dei file PDF che non sono stati elaborati con successo.
             - La terza lista contiene i percorsi dei file PDF che non hanno percorsi assoluti.
         """
+        uploaded, not_uploaded, wrong_path, _ = self.ingest_pdfs(pdfs)
+        return uploaded, not_uploaded, wrong_path
+
+    def ingest_pdfs(self, pdfs: [str], workers: int = None) -> ([str], [str], [str], Dict[str, Dict]):
+        """
+        Come upload_pdfs, ma restituisce anche, per ogni file elaborato, quanti chunk
+        erano nuovi, quanti erano invariati e quanti sono stati rimossi.
+
+        I file vengono elaborati in parallelo da un pool di thread; le richieste di
+        embedding contemporanee restano comunque limitate da EMBEDDING_MAX_INFLIGHT.
+
+        Parameters:
+        - pdfs (List[str]): Una lista di percorsi dei file PDF da elaborare.
+        - workers (int, optional): Numero di file elaborati contemporaneamente (predefinito: INGEST_FILE_WORKERS).
+
+        Returns:
+        - Una tupla contenente le tre liste di upload_pdfs e un dizionario che associa
+          il percorso di ogni file al proprio report.
+        """
         uploaded = []
         not_uploaded = []
         wrong_path = []
+        reports = {}
         data2save = []
 
-        for file_path in pdfs:
-            if os.path.isabs(file_path) and os.path.exists(file_path):
-                file_name = os.path.basename(file_path)  # Estrae il nome del file
-
-                text_chunks = Pdf2Chunks.getChunks(file_path)  # Estrae il testo suddiviso in chunks
-
-                success = self.vecs_upload_data(text_chunks, file_name)  # Carica i dati in un sistema di indicizzazione
-                if success:
-                    uploaded.append(file_path)
-                    data2save.append({
-                        "path": file_path,
-                        "state": "success"
-                    })
-                else:
-                    not_uploaded.append(file_path)  # Aggiunge il nome del file alla lista dei risultati se l'operazione non ha avuto successo
-                    data2save.append({
-                        "path": file_path,
-                        "state": "error"
-                    })
-            else:
+        workers = workers or self._ingest_file_workers
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pdfs)))) as executor:
+            # map mantiene l'ordine dei file in ingresso
+            results = list(executor.map(self._ingest_pdf, pdfs))
+
+        for file_path, (state, report) in zip(pdfs, results):
+            data2save.append(ApiRoutes._history_record(file_path, state, report))
+            if state == "wrong":
                 wrong_path.append(file_path)
-                data2save.append({
-                        "path": file_path,
-                        "state": "wrong"
-                    })
+                continue
 
-        self.save_in_json_file(data2save, self._history_file)
+            reports[file_path] = report.to_dict()
+            if state == "success":
+                uploaded.append(file_path)
+            else:
+                not_uploaded.append(file_path)  # Aggiunge il nome del file alla lista dei risultati se l'operazione non ha avuto successo
 
-        return uploaded, not_uploaded, wrong_path
-    
-    def vecs_upload_data(self, data: [str], source: str) -> bool:
-        success = self.vectorstore.upload_data(data, source)
-        return success
+        self.history.append(data2save)
 
-    def get_vectorstore(self) -> Tuple[Optional[langchain.vectorstores], langchain.embeddings.openai.OpenAIEmbeddings]:
-        return self.vectorstore.get_index()
+        return uploaded, not_uploaded, wrong_path, reports
 
-    def init_ChatBot(self) -> bool:
-        vecs, _ = self.get_vectorstore()
-        settings = {
-            'data_retriever' : vecs.as_retriever()
+    @staticmethod
+    def _history_record(file_path: str, state: str, report: Optional[UploadReport]) -> Dict:
+        record = {
+            "path": file_path,
+            "state": state
         }
-        self._chatbot = Chatbot(**settings)
-        if self._chatbot:
-            return True
-        else:
-            return False
+        if state == "success":
+            record.update({
+                "new": report.new,
+                "unchanged": report.unchanged,
+                "removed": report.removed
+            })
+        return record
 
-    def chat(self, query: str) -> (str, [str], str):
-        return self._chatbot.chat(query)
-    
-    
-    
-    def save_in_json_file(self, data: [], file_path: str) -> bool:
+    def _ingest_pdf(
+        self,
+        file_path: str,
+        on_progress: Callable[[BatchResult], None] = None
+    ) -> (str, Optional[UploadReport]):
         """
-        Salva un array di stringhe in un file JSON, aggiungendo i dati a quelli esistenti se il file esiste.
-
-        Parameters:
-        - data (List[]): Un array di stringhe da salvare nel file JSON.
-        - file_path (str): Il percorso del file JSON in cui salvare i dati.
+        Estrae, suddivide e carica un singolo PDF.
 
         Returns:
-        - True se il salvataggio ha avuto successo, altrimenti False.
-        """
-        existing_data = []
-        # Verifica se il file esiste
-        if os.path.exists(file_path):
-            # Se il file esiste, leggi i dati esistenti
-            with open(file_path, "r") as json_file:
-                existing_data = json.load(json_file)
-        
-        existing_data.extend(data)
-        try:
-                
-            # Scrivi l'elenco aggiornato nel file JSON
-            with open(file_path, "w") as json_file:
-                json.dump(existing_data, json_file, indent=4)
-            
+        - Lo stato ("success", "error" o "wrong" se il percorso non è valido) e il report del caricamento.
+        """
+        if not (os.path.isabs(file_path) and os.path.exists(file_path)):
+            return "wrong", None
+
+        file_name = os.path.basename(file_path)  # Estrae il nome del file
+        # Il nome del file è la sorgente dei chunk: due file con lo stesso nome non
+        # possono essere caricati insieme, né uno al posto dell'altro
+        with self._file_lock(file_name):
+            return self._ingest_source(file_path, file_name, on_progress)
+
+    def _file_lock(self, file_name: str) -> threading.Lock:
+        with self._file_locks_lock:
+            return self._file_locks.setdefault(file_name, threading.Lock())
+
+    def _ingest_source(
+        self,
+        file_path: str,
+        file_name: str,
+        on_progress: Optional[Callable[[BatchResult], None]]
+    ) -> (str, UploadReport):
+        manifest = self.vectorstore.manifest
+        # Se la sorgente appartiene a un altro file ancora presente, caricarla
+        # sostituirebbe (ed eliminerebbe) i chunk di quel file
+        owners = [path for path in manifest.get_paths(file_name) if path != file_path]
+        if any(os.path.exists(path) for path in owners):
+            error = (
+                f"La sorgente {file_name} appartiene già al file {owners[0]}: "
+                f"eliminala oppure rinomina {file_path} prima di caricarlo"
+            )
+            print(error)
+            metrics.error("ingest_file")
+            return "error", UploadReport(file_name, success=False, error=error)
+
+        stat = os.stat(file_path)
+        previous = manifest.get_file(file_path)
+        indexed = len(manifest.get_ids(file_name)) if previous is not None else 0
+        sha256 = None
+        # Il file viene saltato solo se i suoi chunk sono ancora nell'indice
+        if previous is not None and previous["source"] == file_name and indexed:
+            # Dimensione e data di modifica invariate: il file non viene nemmeno letto
+            unchanged = previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime
+            if not unchanged:
+                sha256 = ApiRoutes._file_hash(file_path)
+                unchanged = previous["sha256"] == sha256
+                if unchanged:
+                    manifest.set_file(file_path, file_name, stat.st_size, stat.st_mtime, sha256)
+            if unchanged:
+                metrics.count("files_skipped")
+                report = UploadReport(file_name, unchanged=indexed, skipped=True)
+                return "success", report
+
+        # File nuovo o modificato: sync_data embedda solo i chunk nuovi ed elimina quelli spariti
+        with metrics.timed("ingest_file"):
+            text_chunks = Pdf2Chunks.iterChunks(file_path)  # Estrae il testo suddiviso in chunks, pagina per pagina
+            report = self.vectorstore.sync_data(text_chunks, file_name, on_progress=on_progress)  # Carica i dati in un sistema di indicizzazione
+        metrics.count("files_ingested")
+        if not report.success:
+            metrics.error("ingest_file")
+        if report.success:
+            manifest.set_file(
+                file_path, file_name, stat.st_size, stat.st_mtime, sha256 or ApiRoutes._file_hash(file_path)
+            )
+            # Il file è stato spostato: la sorgente ora appartiene al nuovo percorso
+            for path in owners:
+                manifest.remove_file(path)
+        return ("success" if report.success else "error"), report
+
+    @staticmethod
+    def _file_hash(file_path: str) -> str:
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as pdf_file:
+            for block in iter(lambda: pdf_file.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def start_jobs(self) -> None:
+        """
+        Avvia (una sola volta per processo) i worker dei lavori di caricamento in
+        background, riprendendo quelli interrotti da un riavvio.
+        """
+        self.jobs.start()
+
+    def enqueue_pdfs(self, pdfs: [str]) -> str:
+        """
+        Mette in coda il caricamento dei PDF e restituisce subito l'id del lavoro,
+        da consultare con get_job. I worker vengono avviati qui se nessun hook di
+        avvio lo ha già fatto, così il lavoro non resta in coda.
+        """
+        self.start_jobs()
+        return self.jobs.enqueue(pdfs)
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        return self.jobs.get(job_id)
+
+    def get_history(self, path: str = None, state: str = None, since: float = None,
+                    until: float = None, limit: int = None) -> [Dict]:
+        return self.history.query(path, state, since, until, limit)
+
+    def compact_history(self, keep_per_path: int = 1, older_than: float = None) -> int:
+        return self.history.compact(keep_per_path, older_than)
+
+    def _run_job_file(self, file_path: str, progress: Callable[[Dict], None]) -> Dict:
+        """
+        Elabora un file di un lavoro in coda, riportando l'avanzamento batch per batch.
+        """
+        def on_progress(batch: BatchResult) -> None:
+            progress({"chunks": batch.size if batch.success else 0})
+
+        state, report = self._ingest_pdf(file_path, on_progress)
+        result = {"state": state}
+        if report is not None:
+            result.update(report.to_dict())
+        if state == "wrong":
+            result["error"] = "Il percorso non è assoluto oppure il file non esiste"
+        elif state == "error":
+            result["error"] = report.error or "Non è stato possibile caricare tutti i chunk del file"
+        return result
+
+    def _save_job_history(self, files: [Dict]) -> None:
+        data2save = []
+        for item in files:
+            record = {
+                "path": item["path"],
+                "state": item["state"]
+            }
+            if item["state"] == "success":
+                record.update({
+                    "new": item["chunks_new"],
+                    "unchanged": item["chunks_unchanged"],
+                    "removed": item["chunks_removed"]
+                })
+            data2save.append(record)
+        self.history.append(data2save)
+    
+    def init_ChatBot(self) -> bool:
+        if self._chatbot is not None:
             return True
-        except Exception:
+        with self._chatbot_lock:
+            if self._chatbot is None:
+                retriever = self.vectorstore.get_retriever()
+                if retriever is None:
+                    return False
+                settings = {
+                    'data_retriever' : retriever,
+                    'chat_memory_vec': self.vectorstore
+                }
+                self._chatbot = Chatbot(**settings)
+        if self._chatbot:
+            return True
+        else:
             return False
 
+    def chat(self, query: str, session_id: str = "default", sources: List[str] = None) -> (str, [str], str):
+        return self._chatbot.chat(query, session_id, sources)
+
+    def stream_chat(self, query: str, session_id: str = "default", sources: List[str] = None) -> Iterator[Dict]:
+        return self._chatbot.stream_chat(query, session_id, sources)
+
@@ -1,24 +1,100 @@
+import contextvars
 import json
 import os
-from typing import List
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from langchain.callbacks.base import BaseCallbackHandler
 from langchain.llms import OpenAI
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
-from langchain.memory import ConversationBufferMemory
+from langchain.schema import LLMResult
+from my_package import metrics
+from my_package.tokens import count_tokens
+from my_package.answer_cache import SemanticAnswerCache
+from my_package.memory_writer import ChatMemoryWriter
+from my_package.retrieval_scope import current_sources
+from my_package.session_memory import SessionMemory, SessionStore, current_session
 from my_package.vectorstore import Vectorstore
 from dotenv import load_dotenv
 
 
+class _TokenQueueHandler(BaseCallbackHandler):
+    """
+    Callback che inoltra su una coda i token generati dall'LLM.
+    """
+
+    def __init__(self, tokens: queue.Queue) -> None:
+        self._tokens = tokens
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self._tokens.put(("token", token))
+
+
+class _MetricsHandler(BaseCallbackHandler):
+    """
+    Callback che misura la durata della chiamata all'LLM, il tempo al primo token
+    e i token inviati e generati.
+    """
+
+    def __init__(self, encoding: str) -> None:
+        self._encoding = encoding
+        self._start = None
+        self._streamed = 0
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+        self._start = time.perf_counter()
+        self._streamed = 0
+        try:
+            metrics.count_tokens("prompt", sum(count_tokens(prompt, self._encoding) for prompt in prompts))
+        except Exception as e:
+            # Il conteggio dei token non deve mai bloccare la risposta
+            print(f"Impossibile contare i token del prompt: {e}")
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if self._streamed == 0 and self._start is not None:
+            metrics.observe("llm_first_token", time.perf_counter() - self._start)
+        self._streamed += 1
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        if self._start is not None:
+            metrics.observe("llm", time.perf_counter() - self._start)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        # In streaming OpenAI non restituisce l'utilizzo: ogni token ricevuto è un token generato
+        metrics.count_tokens("completion", usage.get("completion_tokens", self._streamed))
+
+    def on_llm_error(self, error: BaseException, **kwargs: Any) -> None:
+        metrics.error("llm")
+
+
 class Chatbot:
-    def __init__(self, data_retriever):
+    def __init__(self, data_retriever, chat_memory_vec: Vectorstore = None):
         self._get_env()
-        self.chat_memory_vec = Vectorstore(self._pinecone_index_name)
+        if chat_memory_vec is None:
+            chat_memory_vec = Vectorstore(self._pinecone_index_name)
+        self.chat_memory_vec = chat_memory_vec
         self.chat_memory_vec.create_index()
+        self.memory_writer = ChatMemoryWriter(
+            self.chat_memory_vec,
+            batch_size=self._chat_memory_batch_size,
+            flush_interval=self._chat_memory_flush_interval
+        )
+        self.answer_cache = None
+        if self._answer_cache_enabled:
+            self.answer_cache = SemanticAnswerCache(
+                threshold=self._answer_cache_threshold,
+                ttl=self._answer_cache_ttl,
+                max_entries=self._answer_cache_max_entries
+            )
         settings_llm = {
             'temperature': self._openai_temperature, 
             'top_p': self._openai_top_p,
             'presence_penalty': self._openai_presence_penalty,
-            'frequency_penalty': self._openai_frequency_penalty
+            'frequency_penalty': self._openai_frequency_penalty,
+            # Con lo streaming attivo i token sono inoltrati ai callback man mano
+            # che arrivano; le chiamate non in streaming ricevono comunque la risposta completa
+            'streaming': True
         }
 
         PROMPT = PromptTemplate(
@@ -26,10 +102,24 @@ class Chatbot:
             input_variables=["context", "history", "question"]
         )
 
-        memory = ConversationBufferMemory(memory_key="history", input_key="question")
+        # Conversazione separata per ogni sessione, entro un budget di token
+        self.sessions = SessionStore(
+            token_budget=self._chat_history_token_budget,
+            summary_tokens=self._chat_history_summary_tokens,
+            ttl=self._chat_session_ttl,
+            max_sessions=self._chat_max_sessions,
+            encoding=self._openai_model_name or "cl100k_base",
+            summarizer=self._summarize
+        )
+        memory = SessionMemory(store=self.sessions, memory_key="history", input_key="question")
 
         chain_type_kwargs = {"verbose": True, "prompt": PROMPT, "memory": memory}
 
+        summary_settings = {'temperature': 0}
+        if self._model_openai:
+            summary_settings['model_name'] = self._model_openai
+        self._summary_llm = OpenAI(**summary_settings)
+
         self.qa = RetrievalQA.from_chain_type(
             llm=OpenAI(**settings_llm),
             chain_type="stuff",
@@ -44,12 +134,35 @@ class Chatbot:
         load_dotenv()
         self._openai_api_key = os.getenv("OPENAI_API_KEY")
         self._openai_model_name = os.getenv("OPENAI_MODEL_NAME")
+        self._model_openai = os.getenv("MODEL_OPENAI") or self._openai_model_name
         self._openai_temperature = float(os.getenv("OPENAI_TEMPERATURE"))
         self._openai_top_p = float(os.getenv("OPENAI_TOP_P"))
         self._openai_presence_penalty = float(os.getenv("OPENAI_PRESENCE_PENALTY"))
         self._openai_frequency_penalty = float(os.getenv("OPENAI_FREQUENCY_PENALTY"))
         self._openai_prompt_template = os.getenv("OPENAI_PROMPT_TEMPLATE")
         self._pinecone_index_name = os.getenv("PINECONE_INDEX_NAME")
+        self._chat_memory_batch_size = int(os.getenv("CHAT_MEMORY_BATCH_SIZE", 20))
+        self._chat_memory_flush_interval = float(os.getenv("CHAT_MEMORY_FLUSH_INTERVAL", 5))
+        self._answer_cache_enabled = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+        self._answer_cache_threshold = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.97))
+        self._answer_cache_ttl = float(os.getenv("ANSWER_CACHE_TTL", 3600))
+        self._answer_cache_max_entries = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 1000))
+        self._chat_history_token_budget = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", 1000))
+        self._chat_history_summary_tokens = int(os.getenv("CHAT_HISTORY_SUMMARY_TOKENS", 300))
+        self._chat_session_ttl = float(os.getenv("CHAT_SESSION_TTL", 1800))
+        self._chat_max_sessions = int(os.getenv("CHAT_MAX_SESSIONS", 1000))
+
+    def _summarize(self, summary: str, turns: List[Tuple[str, str]]) -> str:
+        """
+        Aggiorna il riassunto della conversazione con gli scambi usciti dalla finestra.
+        """
+        conversation = "\n".join(f"Human: {question}\nAI: {answer}" for question, answer in turns)
+        prompt = (
+            "Aggiorna il riassunto di una conversazione aggiungendo le nuove battute. "
+            "Mantieni solo le informazioni utili a proseguire la conversazione.\n\n"
+            f"Riassunto attuale:\n{summary}\n\nNuove battute:\n{conversation}\n\nNuovo riassunto:"
+        )
+        return self._summary_llm(prompt)
 
     @staticmethod
     def remove_duplicates(data: List[str]) -> List[str]:
@@ -68,11 +181,103 @@ class Chatbot:
                 result.append(item)
         return result
 
-    def chat(self, query: str) -> (str, [str], str):
+    def chat(self, query: str, session_id: str = "default", sources: List[str] = None) -> (str, [str], str):
+        current_session.set(session_id)
+        current_sources.set(sources or None)
+        with metrics.timed("chat"):
+            cached, cache_key = self._cached_answer(query, session_id, sources)
+            if cached is not None:
+                self.memory_writer.submit(query)
+                self.sessions.add_turn(session_id, query, cached[0])
+                return cached
+            result = self.qa({"query": query}, callbacks=[self._metrics_handler()])
+            self.memory_writer.submit(query)
+            return self._store_answer(cache_key, self._build_response(result))
+
+    def _metrics_handler(self) -> _MetricsHandler:
+        return _MetricsHandler(self._openai_model_name or "cl100k_base")
+
+    def _cached_answer(
+        self, query: str, session_id: str, sources: List[str] = None
+    ) -> (Optional[Tuple[str, List[str], str]], Any):
+        """
+        Cerca nella cache semantica la risposta a una domanda simile, posta sulla
+        stessa versione del corpus. Le domande limitate ad alcune sorgenti e quelle
+        di una sessione con una conversazione in corso non passano dalla cache: la
+        risposta a una domanda di seguito ("e l'articolo successivo?") dipende dalla
+        cronologia, che non fa parte della chiave.
+
+        Returns:
+        - La risposta salvata (o None) e la chiave con cui salvare la nuova risposta.
+        """
+        if self.answer_cache is None or sources or self.sessions.has_history(session_id):
+            return None, None
+        # L'embedding della domanda finisce nella cache degli embeddings, quindi il
+        # retriever non lo ricalcola in caso di miss
+        vector = Vectorstore.getEmbeddings().embed_query(query)
+        version = self.chat_memory_vec.corpus_version()
+        cached = self.answer_cache.lookup(vector, version)
+        metrics.cache_result("answer", cached is not None)
+        return cached, (vector, version)
+
+    def _store_answer(self, cache_key: Any, answer: Tuple[str, List[str], str]) -> Tuple[str, List[str], str]:
+        if self.answer_cache is not None and cache_key is not None:
+            vector, version = cache_key
+            self.answer_cache.store(vector, version, answer)
+        return answer
+
+    def stream_chat(self, query: str, session_id: str = "default", sources: List[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Come chat, ma restituisce i token della risposta man mano che l'LLM li genera.
+
+        Returns:
+        - Iterator[Dict]: Eventi {"type": "token", "data": token} e, alla fine, un evento
+          {"type": "end", "data": {"message", "sources", "model"}} con la risposta completa
+          (oppure {"type": "error", "data": messaggio}).
+        """
+        start = time.perf_counter()
+        cached, cache_key = self._cached_answer(query, session_id, sources)
+        if cached is not None:
+            metrics.observe("chat", time.perf_counter() - start)
+            self.memory_writer.submit(query)
+            self.sessions.add_turn(session_id, query, cached[0])
+            response, found, model = cached
+            yield {"type": "token", "data": response}
+            yield {"type": "end", "data": {"message": response, "sources": found, "model": model}}
+            return
+
+        events = queue.Queue()
+
+        def run():
+            current_session.set(session_id)
+            current_sources.set(sources or None)
+            try:
+                result = self.qa({"query": query}, callbacks=[_TokenQueueHandler(events), self._metrics_handler()])
+                self.memory_writer.submit(query)
+                events.put(("end", result))
+            except Exception as e:
+                metrics.error("chat")
+                events.put(("error", str(e)))
+
+        # Il thread eredita il contesto della richiesta (tempi per fase compresi)
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(run,), daemon=True).start()
+        while True:
+            kind, data = events.get()
+            if kind == "token":
+                yield {"type": "token", "data": data}
+            elif kind == "end":
+                metrics.observe("chat", time.perf_counter() - start)
+                response, found, model = self._store_answer(cache_key, self._build_response(data))
+                yield {"type": "end", "data": {"message": response, "sources": found, "model": model}}
+                return
+            else:
+                yield {"type": "error", "data": data}
+                return
+
+    def _build_response(self, result: Dict[str, Any]) -> (str, [str], str):
         response = ""
         sources = []
-        result = self.qa({"query": query})
-        self.chat_memory_vec.upload_data([query], "chat_memory")
         if "non ho dati a riguardo" not in str(result["result"]).lower():
             sources = Chatbot.remove_duplicates(result["source_documents"])
             response = result["result"]
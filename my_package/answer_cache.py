@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class SemanticAnswerCache(object):
+    """
+    Cache delle risposte del chatbot indicizzata sull'embedding della domanda.
+
+    Una domanda la cui similarità coseno con una già vista supera threshold, posta
+    sulla stessa versione del corpus, riceve la risposta salvata senza chiamare
+    l'LLM. Le voci scadono dopo ttl secondi e oltre max_entries vengono eliminate
+    quelle usate meno di recente. Quando il corpus cambia versione tutte le voci
+    vengono scartate.
+
+    La soglia va tenuta alta: con gli embedding di OpenAI due domande che differiscono
+    solo per un numero (ad esempio quello di un articolo) hanno similarità superiore a 0.9.
+    """
+
+    def __init__(self, threshold: float = 0.97, ttl: float = 3600, max_entries: int = 1000) -> None:
+        self._threshold = threshold
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries = OrderedDict()  # chiave -> (vettore normalizzato, risposta, creazione)
+        self._version = None
+        self._next_key = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype="float32")
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def _check_version(self, version: Any) -> None:
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def _expire(self, now: float) -> None:
+        expired = [key for key, (_, _, created) in self._entries.items() if now - created > self._ttl]
+        for key in expired:
+            del self._entries[key]
+
+    def lookup(self, vector: List[float], version: Any) -> Optional[Tuple[str, List[str], str]]:
+        """
+        Cerca una risposta per una domanda simile.
+
+        Parameters:
+        - vector (List[float]): Embedding della domanda.
+        - version: Versione del corpus su cui è posta la domanda.
+
+        Returns:
+        - La tupla (risposta, sorgenti, modello) salvata, oppure None.
+        """
+        query = SemanticAnswerCache._normalize(vector)
+        with self._lock:
+            self._check_version(version)
+            self._expire(time.time())
+            if self._entries:
+                keys = list(self._entries.keys())
+                matrix = np.stack([self._entries[key][0] for key in keys])
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self._threshold:
+                    self._entries.move_to_end(keys[best])
+                    self.hits += 1
+                    return self._entries[keys[best]][1]
+            self.misses += 1
+            return None
+
+    def store(self, vector: List[float], version: Any, answer: Tuple[str, List[str], str]) -> None:
+        """
+        Salva la risposta a una domanda.
+        """
+        with self._lock:
+            self._check_version(version)
+            self._entries[self._next_key] = (SemanticAnswerCache._normalize(vector), answer, time.time())
+            self._next_key += 1
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Restituisce hit, miss, hit rate e numero di voci della cache.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+            }
@@ -0,0 +1,65 @@
+import os
+from dotenv import load_dotenv
+
+from my_package.backends.base import VectorBackend, VectorBackendError
+
+
+def get_backend(index_name: str) -> VectorBackend:
+    """
+    Crea il backend vettoriale selezionato dalla variabile d'ambiente VECTOR_BACKEND
+    ("pinecone", predefinito, "faiss" oppure "mmap").
+
+    Per FAISS, FAISS_INDEX_TYPE sceglie la rappresentazione dei vettori (flat, fp16,
+    sq8 o ivfpq) e FAISS_IVF_NLIST, FAISS_NPROBE, FAISS_PQ_M, FAISS_PQ_BITS,
+    FAISS_RESCORE_FACTOR e FAISS_TRAIN_SIZE regolano il compromesso tra recall e memoria.
+    Il backend mmap salva l'indice in MMAP_INDEX_DIR come file in memory map
+    (MMAP_DTYPE float32 o float16) e unisce il log di scrittura ogni MMAP_WAL_MAX_OPS operazioni.
+
+    Parameters:
+    - index_name (str): Nome dell'indice da gestire.
+
+    Returns:
+    - VectorBackend: Il backend configurato.
+    """
+    load_dotenv()
+    backend = os.getenv("VECTOR_BACKEND", "pinecone").lower()
+    dimension = int(os.getenv("PINECONE_INDEX_DIMENSION"))
+    metric = os.getenv("PINECONE_INDEX_METRIC", "cosine")
+
+    if backend == "pinecone":
+        from my_package.backends.pinecone_backend import PineconeBackend
+        return PineconeBackend(
+            index_name,
+            dimension,
+            metric,
+            api_key=os.getenv("PINECONE_API_KEY"),
+            environment=os.getenv("PINECONE_API_ENV"),
+            top_k=int(os.getenv("PINECONE_TOP_K")),
+        )
+    if backend == "faiss":
+        from my_package.backends.faiss_backend import FaissBackend
+        return FaissBackend(
+            index_name,
+            dimension,
+            metric,
+            index_dir=os.getenv("FAISS_INDEX_DIR", "faiss_index"),
+            index_type=os.getenv("FAISS_INDEX_TYPE", "flat").lower(),
+            nlist=int(os.getenv("FAISS_IVF_NLIST", 64)),
+            nprobe=int(os.getenv("FAISS_NPROBE", 8)),
+            pq_m=int(os.getenv("FAISS_PQ_M", 0)) or None,
+            pq_bits=int(os.getenv("FAISS_PQ_BITS", 8)),
+            rescore_factor=int(os.getenv("FAISS_RESCORE_FACTOR", 4)),
+            train_size=int(os.getenv("FAISS_TRAIN_SIZE", 0)) or None,
+            save_interval=float(os.getenv("FAISS_SAVE_INTERVAL", 30)),
+        )
+    if backend == "mmap":
+        from my_package.backends.mmap_backend import MmapBackend
+        return MmapBackend(
+            index_name,
+            dimension,
+            metric,
+            index_dir=os.getenv("MMAP_INDEX_DIR", "mmap_index"),
+            dtype=os.getenv("MMAP_DTYPE", "float32").lower(),
+            wal_max_ops=int(os.getenv("MMAP_WAL_MAX_OPS", 10000)),
+        )
+    raise ValueError(f"Backend vettoriale non supportato: {backend}")
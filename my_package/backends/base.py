@@ -0,0 +1,176 @@
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+
+class VectorBackendError(Exception):
+    """
+    Errore sollevato da un backend vettoriale, indipendentemente dal servizio sottostante.
+    """
+
+
+class VectorBackend(ABC):
+    """
+    Interfaccia comune dei backend che memorizzano i vettori per Vectorstore.
+
+    Ogni vettore è una tupla (id, valori, metadata); i metadata contengono almeno
+    "source" (il file di provenienza) e "text" (il contenuto del chunk).
+
+    I vettori possono essere divisi in namespace (partizioni) indipendenti: "" è il
+    namespace predefinito. Le query cercano in un solo namespace alla volta
+    (query_namespaces ne interroga più d'uno) e un namespace si elimina per intero
+    con delete_namespace.
+    """
+
+    # Query contemporanee di query_namespaces
+    QUERY_WORKERS = 8
+    # Numero massimo di id per chiamata a delete (None = nessun limite)
+    DELETE_BATCH_SIZE = None
+
+    def __init__(self, index_name: str, dimension: int, metric: str) -> None:
+        self.index_name = index_name
+        self.dimension = dimension
+        self.metric = metric
+
+    @abstractmethod
+    def index_exists(self) -> bool:
+        """
+        Restituisce True se l'indice esiste.
+        """
+
+    @abstractmethod
+    def create_index(self) -> bool:
+        """
+        Crea l'indice.
+
+        Returns:
+        - bool: True se l'indice è stato creato, False se esisteva già.
+        """
+
+    @abstractmethod
+    def delete_index(self) -> bool:
+        """
+        Elimina l'indice.
+
+        Returns:
+        - bool: True se l'indice è stato eliminato, False se non esisteva.
+        """
+
+    @abstractmethod
+    def upsert(self, vectors: List[Tuple[str, List[float], Dict[str, Any]]], namespace: str = "") -> int:
+        """
+        Inserisce o sovrascrive dei vettori.
+
+        Parameters:
+        - vectors (List[Tuple[str, List[float], Dict]]): Tuple (id, valori, metadata).
+        - namespace (str): Namespace in cui scrivere i vettori.
+
+        Returns:
+        - int: Numero di vettori scritti.
+        """
+
+    @abstractmethod
+    def query(self, vector: List[float], top_k: int, namespace: str = "") -> List[Dict[str, Any]]:
+        """
+        Restituisce i vettori più simili a quello dato all'interno di un namespace.
+
+        Returns:
+        - List[Dict]: Dizionari con i campi 'id', 'score' e 'metadata', ordinati per similarità.
+        """
+
+    @abstractmethod
+    def delete(self, ids: List[str], namespace: str = "") -> None:
+        """
+        Elimina i vettori con gli id indicati.
+        """
+
+    @abstractmethod
+    def delete_namespace(self, namespace: str) -> None:
+        """
+        Elimina tutti i vettori di un namespace con una sola operazione.
+        """
+
+    @abstractmethod
+    def delete_all(self) -> None:
+        """
+        Elimina tutti i vettori di tutti i namespace, lasciando l'indice vuoto ma esistente.
+        """
+
+    @abstractmethod
+    def list_namespaces(self) -> List[str]:
+        """
+        Restituisce i namespace presenti nell'indice.
+        """
+
+    def query_namespaces(self, vector: List[float], top_k: int, namespaces: List[str]) -> List[Dict[str, Any]]:
+        """
+        Interroga in parallelo più namespace e unisce i risultati.
+
+        Returns:
+        - List[Dict]: I top_k risultati migliori tra tutti i namespace.
+        """
+        if len(namespaces) == 1:
+            return self.query(vector, top_k, namespaces[0])
+        if not namespaces:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.QUERY_WORKERS, len(namespaces))) as executor:
+            partials = executor.map(lambda namespace: self.query(vector, top_k, namespace), namespaces)
+            results = [item for partial in partials for item in partial]
+        # Con la metrica euclidea il punteggio è una distanza: più basso è migliore
+        results.sort(key=lambda item: item["score"], reverse=self.metric != "euclidean")
+        return results[:top_k]
+
+    @abstractmethod
+    def list_ids_and_source(self) -> List[Dict[str, str]]:
+        """
+        Restituisce tutti i vettori presenti come dizionari con i campi 'id' e 'source'.
+        """
+
+    def storage_report(self) -> Dict[str, Any]:
+        """
+        Descrive come sono memorizzati i vettori. I backend remoti non espongono
+        la propria rappresentazione interna: si riporta quella non compressa.
+
+        Returns:
+        - Dict: Almeno 'backend', 'dimension' e 'bytes_per_vector'.
+        """
+        return {
+            "backend": type(self).__name__,
+            "dimension": self.dimension,
+            "bytes_per_vector": self.dimension * 4,
+        }
+
+    def delete_by_source(self, source: str) -> int:
+        """
+        Elimina tutti i vettori associati a una sorgente.
+
+        Returns:
+        - int: Numero di vettori eliminati.
+        """
+        ids = [
+            item["id"] for item in self.list_ids_and_source() if str(item["source"]) == source
+        ]
+        if ids:
+            self.delete(ids)
+        return len(ids)
+
+    def list_sources(self) -> List[str]:
+        """
+        Restituisce le sorgenti distinte presenti nell'indice.
+        """
+        unique_sources = []
+        for item in self.list_ids_and_source():
+            if str(item["source"]) not in unique_sources:
+                unique_sources.append(str(item["source"]))
+        return unique_sources
+
+    def flush(self) -> None:
+        """
+        Rende persistenti le scritture che il backend ha rimandato (ad esempio il
+        salvataggio su file di un indice locale). Di default non fa nulla.
+        """
+
+    def warm_up(self) -> None:
+        """
+        Apre in anticipo le risorse del backend (connessioni, file). Di default non fa nulla.
+        """
@@ -0,0 +1,595 @@
+import atexit
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from my_package.backends.base import VectorBackend, VectorBackendError
+
+
+class _FaissPartition(object):
+    """
+    Un indice FAISS con i relativi id e metadata, salvato in una cartella con i
+    file index.faiss (i vettori) e meta.json (id, metadata e nome della partizione).
+
+    Con un indice compresso e il rescoring attivo, i vettori originali in float32
+    sono scritti anche in vectors.f32 (una riga per id numerico) e letti tramite
+    memory map: in RAM restano solo i codici compressi.
+
+    Le modifiche restano in memoria (dirty) finché la partizione non viene salvata:
+    riscrivere indice e meta.json ad ogni batch renderebbe quadratico il costo di
+    un caricamento.
+
+    Più processi possono usare la stessa partizione: letture e salvataggi sono
+    serializzati da un lock sul file "lock". Le operazioni non ancora salvate sono
+    conservate in pending; se nel frattempo un altro processo ha salvato la
+    partizione, questa viene riletta dal disco e le operazioni vengono riapplicate
+    prima di salvare, così nessun processo sovrascrive i vettori degli altri.
+    """
+
+    def __init__(self, backend: "FaissBackend", namespace: str, path: str) -> None:
+        self._backend = backend
+        self.namespace = namespace
+        self.path = path
+        self._reset()
+        self._saved_at = time.monotonic()
+
+    def _reset(self) -> None:
+        self.index = None
+        self.index_type = "flat"  # Tipo dell'indice costruito (flat finché non è addestrato)
+        self.ids = {}  # id -> id numerico usato da FAISS
+        self.labels = {}  # id numerico -> id
+        self.metadata = {}  # id numerico -> metadata
+        self.next_label = 0
+        self._vectors = None  # memory map di vectors.f32
+        self._loaded_stat = None  # (inode, mtime) di meta.json letto o scritto da questo processo
+        self._unsaved_vectors = []  # (primo id numerico, matrice) da scrivere in vectors.f32
+        self.pending = []  # Operazioni non ancora salvate: ("upsert", vettori) o ("delete", id)
+        self.dirty = False
+
+    @property
+    def index_file(self) -> str:
+        return os.path.join(self.path, "index.faiss")
+
+    @property
+    def meta_file(self) -> str:
+        return os.path.join(self.path, "meta.json")
+
+    @property
+    def vectors_file(self) -> str:
+        return os.path.join(self.path, "vectors.f32")
+
+    def exists(self) -> bool:
+        return os.path.exists(self.index_file)
+
+    @contextmanager
+    def _file_lock(self, shared: bool = False) -> Iterator[None]:
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, "lock"), "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _disk_stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.meta_file)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def create(self) -> None:
+        """
+        Crea (o svuota) la partizione, scartando anche le modifiche degli altri processi.
+        """
+        with self._file_lock():
+            self._reset()
+            self.index_type = self._backend._initial_type()
+            self.index = self._backend._new_index(self.index_type)
+            if os.path.exists(self.vectors_file):
+                os.remove(self.vectors_file)
+            self._write()
+
+    def load(self) -> faiss.Index:
+        """
+        Carica l'indice dal disco alla prima richiesta.
+        """
+        if self.index is None:
+            with self._file_lock(shared=True):
+                self._read()
+        return self.index
+
+    def refresh(self) -> None:
+        """
+        Rilegge la partizione se un altro processo l'ha salvata dopo l'ultima lettura,
+        riapplicando le operazioni di questo processo non ancora salvate. Se la
+        partizione è stata eliminata, le operazioni in sospeso vengono scartate.
+        """
+        if self.index is None or self._disk_stat() == self._loaded_stat:
+            return
+        with self._file_lock(shared=True):
+            if self._disk_stat() is None:
+                self._reset()
+                return
+            self._read()
+            self._replay()
+
+    def _read(self) -> None:
+        pending = self.pending
+        self._reset()
+        self.pending = pending
+        self._loaded_stat = self._disk_stat()
+        self.index = faiss.read_index(self.index_file)
+        with open(self.meta_file, "r") as meta_file:
+            meta = json.load(meta_file)
+        self.labels = {int(label): vec_id for label, vec_id in meta["labels"].items()}
+        self.ids = {vec_id: label for label, vec_id in self.labels.items()}
+        self.metadata = {int(label): data for label, data in meta["metadata"].items()}
+        self.next_label = meta["next_label"]
+        self.index_type = meta.get("index_type", "flat")
+        self._backend._configure(self.index)
+
+    def _replay(self) -> None:
+        for operation, data in self.pending:
+            if operation == "upsert":
+                self._add(data)
+            else:
+                self.remove(data)
+        self.dirty = bool(self.pending)
+
+    def save(self) -> None:
+        """
+        Salva la partizione; se un altro processo l'ha salvata dopo l'ultima lettura,
+        prima la rilegge e riapplica le operazioni in sospeso.
+        """
+        with self._file_lock():
+            stat = self._disk_stat()
+            if stat is None and self._loaded_stat is not None:
+                # Partizione eliminata da un altro processo
+                self._reset()
+                return
+            if stat != self._loaded_stat:
+                self._read()
+                self._replay()
+            self._write()
+
+    def _write(self) -> None:
+        """
+        Scrive indice e metadata su file temporanei e li sostituisce atomicamente.
+        Va chiamata con il lock dei file.
+        """
+        for first_label, matrix in self._unsaved_vectors:
+            self._write_vectors(first_label, matrix)
+        faiss.write_index(self.index, self.index_file + ".tmp")
+        meta = {
+            "namespace": self.namespace,
+            "labels": self.labels,
+            "metadata": self.metadata,
+            "next_label": self.next_label,
+            "index_type": self.index_type,
+        }
+        with open(self.meta_file + ".tmp", "w") as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(self.index_file + ".tmp", self.index_file)
+        os.replace(self.meta_file + ".tmp", self.meta_file)
+        self._loaded_stat = self._disk_stat()
+        self._unsaved_vectors = []
+        self.pending = []
+        self.dirty = False
+        self._saved_at = time.monotonic()
+
+    def changed(self) -> None:
+        """
+        Segna la partizione come modificata; viene salvata da FaissBackend.flush oppure
+        qui, se dall'ultimo salvataggio sono passati più di save_interval secondi.
+        """
+        self.dirty = True
+        if time.monotonic() - self._saved_at >= self._backend.save_interval:
+            self.save()
+
+    def upsert(self, vectors: List[Tuple[str, List[float], Dict[str, Any]]]) -> None:
+        self.load()
+        self._add(vectors)
+        self.pending.append(("upsert", vectors))
+        self.changed()
+
+    def delete(self, ids: List[str]) -> None:
+        self.load()
+        self.remove(ids)
+        self.pending.append(("delete", ids))
+        self.changed()
+
+    def _add(self, vectors: List[Tuple[str, List[float], Dict[str, Any]]]) -> None:
+        # Gli id già presenti vengono sovrascritti
+        self.remove([vec_id for vec_id, _, _ in vectors if vec_id in self.ids])
+        labels = []
+        for vec_id, _, metadata in vectors:
+            label = self.next_label
+            self.next_label += 1
+            self.ids[vec_id] = label
+            self.labels[label] = vec_id
+            self.metadata[label] = metadata
+            labels.append(label)
+        matrix = self._backend._prepare([values for _, values, _ in vectors])
+        if self._backend.rescoring:
+            # Scritti in vectors.f32 al salvataggio, quando gli id numerici sono definitivi
+            self._unsaved_vectors.append((labels[0], matrix))
+        self.index.add_with_ids(matrix, np.asarray(labels, dtype="int64"))
+        if self._backend._needs_training(self.index_type, self.index.ntotal):
+            self._train()
+
+    def _write_vectors(self, first_label: int, matrix: np.ndarray) -> None:
+        """
+        Scrive i vettori originali nelle righe first_label, first_label + 1, ...
+        di vectors.f32 (gli id numerici crescono sempre, quindi si scrive in coda).
+        """
+        os.makedirs(self.path, exist_ok=True)
+        mode = "r+b" if os.path.exists(self.vectors_file) else "wb"
+        with open(self.vectors_file, mode) as vectors_file:
+            vectors_file.seek(first_label * matrix.shape[1] * 4)
+            vectors_file.write(np.ascontiguousarray(matrix, dtype="float32").tobytes())
+
+    def _read_vectors(self, labels: np.ndarray) -> Optional[np.ndarray]:
+        rows = os.path.getsize(self.vectors_file) // (self._backend.dimension * 4) if os.path.exists(self.vectors_file) else 0
+        if rows <= int(labels.max()):
+            return None
+        if self._vectors is None or self._vectors.shape[0] < rows:
+            self._vectors = np.memmap(self.vectors_file, dtype="float32", mode="r", shape=(rows, self._backend.dimension))
+        return np.asarray(self._vectors[labels])
+
+    def _train(self) -> None:
+        """
+        Sostituisce l'indice flat con quello compresso configurato, addestrato sui
+        vettori presenti, mantenendo gli stessi id numerici.
+        """
+        index_type = self._backend.index_type
+        labels = faiss.vector_to_array(self.index.id_map).astype("int64")
+        matrix = self.index.index.reconstruct_n(0, self.index.ntotal)
+        index = self._backend._new_index(index_type)
+        index.train(matrix)
+        index.add_with_ids(matrix, labels)
+        self._backend._configure(index)
+        self.index = index
+        self.index_type = index_type
+        if self._backend.rescoring and not os.path.exists(self.vectors_file):
+            # Vettori caricati prima di attivare il rescoring
+            self._unsaved_vectors.extend((int(label), row.reshape(1, -1)) for label, row in zip(labels, matrix))
+
+    def query(self, matrix: np.ndarray, top_k: int) -> List[Dict[str, Any]]:
+        index = self.load()
+        if index.ntotal == 0:
+            return []
+        rescore = self.index_type != "flat" and self._backend.rescoring
+        fetch = top_k * self._backend.rescore_factor if rescore else top_k
+        scores, labels = index.search(matrix, min(fetch, index.ntotal))
+        scores, labels = scores[0], labels[0]
+        if rescore:
+            found = labels >= 0
+            original = self._read_vectors(labels[found]) if found.any() else None
+            if original is not None:
+                # Punteggi esatti sui vettori originali dei soli candidati
+                labels = labels[found]
+                if self._backend.metric == "euclidean":
+                    scores = ((original - matrix[0]) ** 2).sum(axis=1)
+                    order = np.argsort(scores)
+                else:
+                    scores = original @ matrix[0]
+                    order = np.argsort(-scores)
+                scores, labels = scores[order], labels[order]
+        results = []
+        for score, label in zip(scores[:top_k], labels[:top_k]):
+            if label < 0:
+                continue
+            results.append({
+                "id": self.labels[int(label)],
+                "score": float(score),
+                "metadata": self.metadata[int(label)],
+            })
+        return results
+
+    def remove(self, ids: List[str]) -> None:
+        labels = [self.ids.pop(vec_id) for vec_id in ids if vec_id in self.ids]
+        if labels:
+            self.index.remove_ids(np.asarray(labels, dtype="int64"))
+            for label in labels:
+                del self.labels[label]
+                del self.metadata[label]
+
+    def storage(self) -> Dict[str, Any]:
+        """
+        Restituisce tipo dell'indice, numero di vettori e byte in memoria per vettore
+        (codici più id), oltre ai byte su disco usati per il rescoring.
+        """
+        self.load()
+        self.refresh()
+        index = self.index
+        disk = os.path.getsize(self.vectors_file) if os.path.exists(self.vectors_file) else 0
+        return {
+            "namespace": self.namespace,
+            "index_type": self.index_type,
+            "vectors": index.ntotal,
+            "bytes_per_vector": self._backend._bytes_per_vector(index),
+            "rescore_disk_bytes": disk,
+        }
+
+
+class FaissBackend(VectorBackend):
+    """
+    Backend locale in-process basato su FAISS: nessun salto di rete, adatto a corpus
+    piccoli e medi, ai benchmark e all'esecuzione offline.
+
+    L'indice viene salvato nella cartella <index_dir>/<index_name>, con il file
+    index.faiss (i vettori) e meta.json (id e metadata). Ogni namespace diverso da
+    quello predefinito è un indice FAISS separato, nella sottocartella
+    partitions/<hash del namespace>: eliminarlo significa rimuovere la cartella.
+
+    index_type sceglie la rappresentazione dei vettori in memoria:
+    - "flat": float32, ricerca esatta (4 byte per dimensione);
+    - "fp16": float16 (2 byte per dimensione);
+    - "sq8": quantizzazione scalare a 8 bit (1 byte per dimensione);
+    - "ivfpq": IVF con product quantization (pq_m codici da pq_bits bit), la più
+      compatta; nprobe regola il compromesso tra recall e velocità.
+    sq8 e ivfpq vanno addestrati: finché una partizione ha meno di train_size
+    vettori resta flat, poi viene convertita. Se rescore_factor è maggiore di 1 gli
+    indici compressi restituiscono top_k * rescore_factor candidati, riordinati con
+    i vettori originali letti dal disco.
+
+    upsert e delete non salvano subito l'indice: le partizioni modificate vengono
+    scritte da flush (richiamato da Vectorstore al termine di ogni caricamento ed
+    eliminazione), comunque almeno ogni save_interval secondi e all'uscita del processo.
+    Più processi (ad esempio i worker di gunicorn) possono usare la stessa cartella:
+    ogni operazione rilegge le partizioni salvate nel frattempo dagli altri processi
+    e il salvataggio unisce le proprie modifiche a quelle già su disco.
+    """
+
+    PARTITIONS_DIR = "partitions"
+    INDEX_TYPES = ("flat", "fp16", "sq8", "ivfpq")
+
+    def __init__(
+        self,
+        index_name: str,
+        dimension: int,
+        metric: str,
+        index_dir: str,
+        index_type: str = "flat",
+        nlist: int = 64,
+        nprobe: int = 8,
+        pq_m: int = None,
+        pq_bits: int = 8,
+        rescore_factor: int = 4,
+        train_size: int = None,
+        save_interval: float = 30.0,
+    ) -> None:
+        super().__init__(index_name, dimension, metric)
+        if index_type not in self.INDEX_TYPES:
+            raise ValueError(f"Tipo di indice FAISS non supportato: {index_type}")
+        self.index_type = index_type
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = FaissBackend._pq_subquantizers(dimension, pq_m or max(1, dimension // 16))
+        self.pq_bits = pq_bits
+        self.rescore_factor = max(1, rescore_factor)
+        if train_size is None:
+            # Numero di punti consigliato da FAISS per addestrare centroidi e codebook
+            train_size = max(nlist, 2 ** pq_bits) * 39 if index_type == "ivfpq" else 1000
+        self.train_size = train_size
+        self.save_interval = save_interval
+        self._path = os.path.join(index_dir, index_name)
+        self._lock = threading.RLock()
+        self._partitions = {}  # namespace -> _FaissPartition
+        self._default = self._partition("")
+        atexit.register(self.flush)
+
+    @property
+    def rescoring(self) -> bool:
+        return self.index_type != "flat" and self.rescore_factor > 1
+
+    @staticmethod
+    def _pq_subquantizers(dimension: int, pq_m: int) -> int:
+        # Il numero di sottoquantizzatori deve dividere la dimensione
+        while dimension % pq_m:
+            pq_m -= 1
+        return pq_m
+
+    def _initial_type(self) -> str:
+        return self.index_type if self.index_type in ("flat", "fp16") else "flat"
+
+    def _needs_training(self, built_type: str, vectors: int) -> bool:
+        return built_type == "flat" and self.index_type in ("sq8", "ivfpq") and vectors >= self.train_size
+
+    def _new_index(self, index_type: str = "flat") -> faiss.Index:
+        metric = faiss.METRIC_L2 if self.metric == "euclidean" else faiss.METRIC_INNER_PRODUCT
+        if index_type == "ivfpq":
+            quantizer = faiss.IndexFlatL2(self.dimension) if self.metric == "euclidean" else faiss.IndexFlatIP(self.dimension)
+            index = faiss.IndexIVFPQ(quantizer, self.dimension, self.nlist, self.pq_m, self.pq_bits, metric)
+            self._configure(index)
+            return index
+        if index_type == "fp16":
+            base = faiss.IndexScalarQuantizer(self.dimension, faiss.ScalarQuantizer.QT_fp16, metric)
+        elif index_type == "sq8":
+            base = faiss.IndexScalarQuantizer(self.dimension, faiss.ScalarQuantizer.QT_8bit, metric)
+        elif self.metric == "euclidean":
+            base = faiss.IndexFlatL2(self.dimension)
+        else:
+            base = faiss.IndexFlatIP(self.dimension)
+        return faiss.IndexIDMap2(base)
+
+    def _configure(self, index: faiss.Index) -> None:
+        # nprobe è un parametro di ricerca: si imposta anche sugli indici letti dal disco
+        if isinstance(index, faiss.IndexIVF):
+            index.nprobe = self.nprobe
+
+    def _bytes_per_vector(self, index: faiss.Index) -> int:
+        if isinstance(index, faiss.IndexIVF):
+            return index.code_size + 8  # codice più id nelle liste invertite
+        return faiss.downcast_index(index.index).sa_code_size() + 8  # codice più id di IndexIDMap2
+
+    def _prepare(self, vectors: List[List[float]]) -> np.ndarray:
+        matrix = np.asarray(vectors, dtype="float32").reshape(-1, self.dimension)
+        if self.metric == "cosine":
+            faiss.normalize_L2(matrix)
+        return matrix
+
+    def _partitions_path(self) -> str:
+        return os.path.join(self._path, self.PARTITIONS_DIR)
+
+    def _partition(self, namespace: str) -> _FaissPartition:
+        with self._lock:
+            partition = self._partitions.get(namespace)
+            if partition is None:
+                if namespace:
+                    digest = hashlib.sha1(namespace.encode("utf-8")).hexdigest()
+                    path = os.path.join(self._partitions_path(), digest)
+                else:
+                    path = self._path
+                partition = _FaissPartition(self, namespace, path)
+                self._partitions[namespace] = partition
+            return partition
+
+    def _existing_partition(self, namespace: str) -> _FaissPartition:
+        """
+        Restituisce la partizione se esiste; il namespace predefinito deve sempre
+        esistere (è l'indice vero e proprio).
+        """
+        if not self._default.exists():
+            raise VectorBackendError(f"L'indice {self.index_name} non esiste")
+        partition = self._partition(namespace)
+        if not partition.exists():
+            return None
+        partition.refresh()
+        return partition
+
+    def index_exists(self) -> bool:
+        return self._default.exists()
+
+    def create_index(self) -> bool:
+        with self._lock:
+            if self.index_exists():
+                return False
+            self._default.create()
+            return True
+
+    def delete_index(self) -> bool:
+        with self._lock:
+            if not self.index_exists():
+                return False
+            shutil.rmtree(self._path, ignore_errors=True)
+            self._partitions = {}
+            self._default = self._partition("")
+            return True
+
+    def upsert(self, vectors: List[Tuple[str, List[float], Dict[str, Any]]], namespace: str = "") -> int:
+        if not vectors:
+            return 0
+        with self._lock:
+            partition = self._existing_partition(namespace)
+            if partition is None:
+                partition = self._partition(namespace)
+                partition.create()
+            partition.upsert(vectors)
+        return len(vectors)
+
+    def query(self, vector: List[float], top_k: int, namespace: str = "") -> List[Dict[str, Any]]:
+        with self._lock:
+            partition = self._existing_partition(namespace)
+            if partition is None:
+                return []
+            return partition.query(self._prepare([vector]), top_k)
+
+    def delete(self, ids: List[str], namespace: str = "") -> None:
+        if not ids:
+            return
+        with self._lock:
+            partition = self._existing_partition(namespace)
+            if partition is None:
+                return
+            partition.delete(ids)
+
+    def delete_namespace(self, namespace: str) -> None:
+        with self._lock:
+            if not namespace:
+                raise VectorBackendError("Il namespace predefinito non può essere eliminato")
+            partition = self._existing_partition(namespace)
+            if partition is not None:
+                shutil.rmtree(partition.path, ignore_errors=True)
+            self._partitions.pop(namespace, None)
+
+    def delete_all(self) -> None:
+        with self._lock:
+            if not self.index_exists():
+                raise VectorBackendError(f"L'indice {self.index_name} non esiste")
+            shutil.rmtree(self._partitions_path(), ignore_errors=True)
+            self._partitions = {"": self._default}
+            self._default.create()
+
+    def list_namespaces(self) -> List[str]:
+        with self._lock:
+            if not self.index_exists():
+                return []
+            namespaces = [""]
+            if os.path.isdir(self._partitions_path()):
+                for name in sorted(os.listdir(self._partitions_path())):
+                    meta_file = os.path.join(self._partitions_path(), name, "meta.json")
+                    if os.path.exists(meta_file):
+                        with open(meta_file, "r") as f:
+                            namespaces.append(json.load(f)["namespace"])
+            return namespaces
+
+    def list_ids_and_source(self) -> List[Dict[str, str]]:
+        with self._lock:
+            results = []
+            for namespace in self.list_namespaces():
+                partition = self._partition(namespace)
+                partition.load()
+                partition.refresh()
+                results.extend(
+                    {"id": partition.labels[label], "source": metadata["source"]}
+                    for label, metadata in partition.metadata.items()
+                )
+            return results
+
+    def storage_report(self) -> Dict[str, Any]:
+        with self._lock:
+            if not self.index_exists():
+                raise VectorBackendError(f"L'indice {self.index_name} non esiste")
+            partitions = [self._partition(namespace).storage() for namespace in self.list_namespaces()]
+        vectors = sum(partition["vectors"] for partition in partitions)
+        memory = sum(partition["vectors"] * partition["bytes_per_vector"] for partition in partitions)
+        float32_bytes = self.dimension * 4 + 8
+        bytes_per_vector = memory / vectors if vectors else self._bytes_per_vector(self._new_index(self.index_type))
+        return {
+            "backend": "faiss",
+            "index_type": self.index_type,
+            "dimension": self.dimension,
+            "vectors": vectors,
+            "bytes_per_vector": round(bytes_per_vector, 1),
+            "float32_bytes_per_vector": float32_bytes,
+            "compression": round(float32_bytes / bytes_per_vector, 2),
+            "memory_bytes": memory,
+            "rescore_factor": self.rescore_factor if self.rescoring else 1,
+            "rescore_disk_bytes": sum(partition["rescore_disk_bytes"] for partition in partitions),
+            "partitions": partitions,
+        }
+
+    def flush(self) -> None:
+        with self._lock:
+            for partition in self._partitions.values():
+                if not partition.dirty:
+                    continue
+                try:
+                    partition.save()
+                except (OSError, RuntimeError) as e:
+                    raise VectorBackendError(f"Impossibile salvare l'indice {self.index_name}: {e}") from e
+
+    def warm_up(self) -> None:
+        if self.index_exists():
+            self._default.load()
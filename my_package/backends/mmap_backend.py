@@ -0,0 +1,557 @@
+import base64
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from my_package.backends.base import VectorBackend, VectorBackendError
+
+
+# Righe della matrice elaborate insieme durante la ricerca e l'unione
+_BLOCK_ROWS = 65536
+
+
+class _Segment(object):
+    """
+    Segmento base di una generazione: file immutabili aperti in memory map, quindi
+    condivisi tra i processi tramite la page cache invece di essere copiati in RAM.
+
+    - vectors.npy: la matrice dei vettori (una riga per vettore);
+    - ids.npy: la tabella degli id, riga per riga;
+    - ids_sorted.npy e rows_sorted.npy: gli id ordinati con la riga corrispondente,
+      per cercare un id con una ricerca binaria;
+    - meta.bin e meta_offsets.npy: i metadata in JSON, uno dopo l'altro, e la tabella
+      degli offset (la riga i occupa i byte da offsets[i] a offsets[i + 1]).
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+        self.sorted_ids = np.load(os.path.join(path, "ids_sorted.npy"), mmap_mode="r")
+        self.sorted_rows = np.load(os.path.join(path, "rows_sorted.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "meta_offsets.npy"), mmap_mode="r")
+        self._meta = b""
+        with open(os.path.join(path, "meta.bin"), "rb") as meta_file:
+            if os.fstat(meta_file.fileno()).st_size:
+                self._meta = mmap.mmap(meta_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    def row(self, vec_id: str) -> Optional[int]:
+        if not len(self):
+            return None
+        key = vec_id.encode("utf-8")
+        position = int(np.searchsorted(self.sorted_ids, key))
+        if position < len(self) and self.sorted_ids[position] == key:
+            return int(self.sorted_rows[position])
+        return None
+
+    def id(self, row: int) -> str:
+        return self.ids[row].decode("utf-8")
+
+    def raw_metadata(self, row: int) -> bytes:
+        return bytes(self._meta[int(self.offsets[row]):int(self.offsets[row + 1])])
+
+    def metadata(self, row: int) -> Dict[str, Any]:
+        return json.loads(self.raw_metadata(row))
+
+    @staticmethod
+    def write_tables(path: str, ids: List[str], metadata: List[bytes]) -> None:
+        """
+        Scrive nella cartella path la tabella degli id e quella dei metadata di un
+        segmento; la matrice dei vettori (vectors.npy) viene scritta a parte.
+        """
+        width = max([len(vec_id.encode("utf-8")) for vec_id in ids] or [1])
+        id_table = np.array([vec_id.encode("utf-8") for vec_id in ids], dtype=f"S{width}")
+        order = np.argsort(id_table, kind="stable").astype("int64")
+        np.save(os.path.join(path, "ids.npy"), id_table)
+        np.save(os.path.join(path, "ids_sorted.npy"), id_table[order])
+        np.save(os.path.join(path, "rows_sorted.npy"), order)
+        offsets = np.zeros(len(metadata) + 1, dtype="int64")
+        with open(os.path.join(path, "meta.bin"), "wb") as meta_file:
+            for position, data in enumerate(metadata):
+                meta_file.write(data)
+                offsets[position + 1] = offsets[position] + len(data)
+        np.save(os.path.join(path, "meta_offsets.npy"), offsets)
+
+
+class _MmapPartition(object):
+    """
+    Una partizione dell'indice: un segmento base immutabile e un segmento di
+    scrittura (write-ahead log) con inserimenti ed eliminazioni successivi.
+
+    La cartella contiene il file CURRENT con il numero della generazione attiva, la
+    cartella gen-<n> con il segmento base e il log wal-<n>.log. Quando il log supera
+    wal_max_ops operazioni viene unito al segmento base in una nuova generazione,
+    attivata sostituendo atomicamente CURRENT.
+
+    Più processi possono usare la stessa partizione: le scritture sono serializzate
+    da un lock sul file "lock" e ogni operazione legge prima la parte del log scritta
+    dagli altri processi, o riapre il segmento se la generazione è cambiata.
+    """
+
+    def __init__(self, backend: "MmapBackend", namespace: str, path: str) -> None:
+        self._backend = backend
+        self.namespace = namespace
+        self.path = path
+        self._reset()
+
+    def _reset(self) -> None:
+        self.generation = None
+        self.base = None
+        self.wal = {}  # id -> (vettore, metadata) scritti dopo il segmento base
+        self.masked = set()  # Righe del segmento base eliminate o sovrascritte
+        self.wal_ops = 0
+        self._wal_offset = 0
+        self._current_stat = None
+        self._masked_rows = None
+        self._wal_matrix = None
+
+    @property
+    def current_file(self) -> str:
+        return os.path.join(self.path, "CURRENT")
+
+    def _generation_path(self, generation: int) -> str:
+        return os.path.join(self.path, f"gen-{generation:06d}")
+
+    def _wal_path(self, generation: int) -> str:
+        return os.path.join(self.path, f"wal-{generation:06d}.log")
+
+    def exists(self) -> bool:
+        return os.path.exists(self.current_file)
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, "lock"), "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _activate(self, generation: int) -> None:
+        """
+        Rende attiva una generazione già scritta e rimuove le precedenti. I processi
+        che hanno ancora in memory map i file rimossi continuano a leggerli finché
+        non passano alla nuova generazione.
+        """
+        open(self._wal_path(generation), "ab").close()
+        with open(self.current_file + ".tmp", "w") as current_file:
+            current_file.write(str(generation))
+        os.replace(self.current_file + ".tmp", self.current_file)
+        for name in os.listdir(self.path):
+            if name.startswith("gen-") and name != os.path.basename(self._generation_path(generation)):
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+            elif name.startswith("wal-") and name != os.path.basename(self._wal_path(generation)):
+                os.remove(os.path.join(self.path, name))
+
+    def create(self) -> None:
+        """
+        Crea (o svuota) la partizione con una nuova generazione vuota.
+        """
+        with self._file_lock():
+            generation = self._read_generation() + 1 if self.exists() else 1
+            path = self._generation_path(generation)
+            os.makedirs(path, exist_ok=True)
+            np.save(os.path.join(path, "vectors.npy"), np.empty((0, self._backend.dimension), dtype=self._backend.dtype))
+            _Segment.write_tables(path, [], [])
+            with open(os.path.join(self.path, "namespace"), "w") as namespace_file:
+                namespace_file.write(self.namespace)
+            self._activate(generation)
+            self.refresh()
+
+    def _read_generation(self) -> int:
+        with open(self.current_file, "r") as current_file:
+            return int(current_file.read().strip())
+
+    def refresh(self) -> None:
+        """
+        Allinea lo stato in memoria ai file: riapre il segmento base se la generazione
+        è cambiata e applica le operazioni del log non ancora lette.
+        """
+        for _ in range(3):
+            try:
+                stat = os.stat(self.current_file)
+            except FileNotFoundError:
+                raise VectorBackendError(f"La partizione {self.namespace!r} non esiste")
+            key = (stat.st_ino, stat.st_mtime_ns)
+            if key == self._current_stat:
+                break
+            # CURRENT cambia solo con una nuova generazione (anche se la partizione è
+            # stata eliminata e ricreata con lo stesso numero di generazione)
+            try:
+                generation = self._read_generation()
+                base = _Segment(self._generation_path(generation))
+            except FileNotFoundError:
+                # Un altro processo ha appena attivato una generazione successiva
+                continue
+            self._reset()
+            self.base = base
+            self.generation = generation
+            self._current_stat = key
+            break
+        if self.base is None:
+            raise VectorBackendError(f"Impossibile aprire la partizione {self.namespace!r}")
+
+        try:
+            with open(self._wal_path(self.generation), "rb") as wal_file:
+                wal_file.seek(self._wal_offset)
+                data = wal_file.read()
+        except FileNotFoundError:
+            # Il log è stato unito da un altro processo: la nuova generazione verrà
+            # aperta alla prossima operazione
+            return
+        if not data:
+            return
+        # Un record viene applicato solo quando è stato scritto per intero
+        complete = data.rfind(b"\n") + 1
+        for line in data[:complete].splitlines():
+            if line:
+                self._apply(json.loads(line))
+        self._wal_offset += complete
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        vec_id = record["id"]
+        row = self.base.row(vec_id)
+        if row is not None:
+            self.masked.add(row)
+            self._masked_rows = None
+        self.wal.pop(vec_id, None)
+        if record["op"] == "upsert":
+            vector = np.frombuffer(base64.b64decode(record["vector"]), dtype="float32")
+            self.wal[vec_id] = (vector, record["metadata"])
+        self.wal_ops += 1
+        self._wal_matrix = None
+
+    def _append(self, records: List[Dict[str, Any]]) -> None:
+        """
+        Scrive le operazioni nel log e le applica; se il log è diventato troppo
+        lungo lo unisce al segmento base.
+        """
+        data = "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+        with self._file_lock():
+            self.refresh()
+            with open(self._wal_path(self.generation), "ab") as wal_file:
+                wal_file.write(data)
+                wal_file.flush()
+                os.fsync(wal_file.fileno())
+            self.refresh()
+            if self.wal_ops >= self._backend.wal_max_ops:
+                self._merge()
+
+    def upsert(self, vectors: List[Tuple[str, List[float], Dict[str, Any]]]) -> None:
+        matrix = self._backend._prepare([values for _, values, _ in vectors])
+        self._append([
+            {
+                "op": "upsert",
+                "id": vec_id,
+                "vector": base64.b64encode(row.tobytes()).decode("ascii"),
+                "metadata": metadata,
+            }
+            for (vec_id, _, metadata), row in zip(vectors, matrix)
+        ])
+
+    def remove(self, ids: List[str]) -> None:
+        self._append([{"op": "delete", "id": vec_id} for vec_id in ids])
+
+    def merge(self) -> None:
+        with self._file_lock():
+            self.refresh()
+            if self.wal_ops:
+                self._merge()
+
+    def _merge(self) -> None:
+        """
+        Scrive una nuova generazione con le righe ancora valide del segmento base
+        seguite da quelle del log, copiando la matrice a blocchi e i metadata così
+        come sono, senza decodificarli. Va chiamata con il lock dei file.
+        """
+        base = self.base
+        live = np.ones(len(base), dtype=bool)
+        live[list(self.masked)] = False
+        live_rows = np.flatnonzero(live)
+        wal_items = list(self.wal.items())
+        generation = self.generation + 1
+        path = self._generation_path(generation)
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+        count = len(live_rows) + len(wal_items)
+        vectors = np.lib.format.open_memmap(
+            os.path.join(path, "vectors.npy"), mode="w+",
+            dtype=self._backend.dtype, shape=(count, self._backend.dimension)
+        )
+        for start in range(0, len(live_rows), _BLOCK_ROWS):
+            rows = live_rows[start:start + _BLOCK_ROWS]
+            vectors[start:start + len(rows)] = base.vectors[rows]
+        if wal_items:
+            vectors[len(live_rows):] = np.stack([vector for _, (vector, _) in wal_items])
+        vectors.flush()
+        del vectors
+
+        ids = [base.id(row) for row in live_rows] + [vec_id for vec_id, _ in wal_items]
+        metadata = [base.raw_metadata(row) for row in live_rows]
+        metadata.extend(json.dumps(data).encode("utf-8") for _, (_, data) in wal_items)
+        _Segment.write_tables(path, ids, metadata)
+        # La nuova generazione diventa visibile solo ora, quando tutti i file sono completi
+        self._activate(generation)
+        self.refresh()
+
+    def _masked_array(self) -> np.ndarray:
+        if self._masked_rows is None:
+            self._masked_rows = np.fromiter(sorted(self.masked), dtype="int64", count=len(self.masked))
+        return self._masked_rows
+
+    def _scores(self, matrix: np.ndarray, query: np.ndarray) -> np.ndarray:
+        matrix = matrix.astype("float32", copy=False)
+        if self._backend.metric == "euclidean":
+            # Distanza euclidea al quadrato, come FAISS
+            return (matrix * matrix).sum(axis=1) - 2 * (matrix @ query) + float(query @ query)
+        return matrix @ query
+
+    def _best(self, scores: np.ndarray, top_k: int) -> np.ndarray:
+        keys = scores if self._backend.metric == "euclidean" else -scores
+        if len(keys) > top_k:
+            candidates = np.argpartition(keys, top_k)[:top_k]
+        else:
+            candidates = np.arange(len(keys))
+        return candidates[np.argsort(keys[candidates], kind="stable")]
+
+    def query(self, query: np.ndarray, top_k: int) -> List[Dict[str, Any]]:
+        """
+        Ricerca esatta: il segmento base viene letto a blocchi dalla memory map, il
+        log è già in memoria. Le righe eliminate o sovrascritte sono escluse.
+        """
+        self.refresh()
+        worst = np.inf if self._backend.metric == "euclidean" else -np.inf
+        masked = self._masked_array()
+        found = []  # (punteggio, riga del segmento base oppure id del log)
+        for start in range(0, len(self.base), _BLOCK_ROWS):
+            scores = self._scores(self.base.vectors[start:start + _BLOCK_ROWS], query)
+            block_masked = masked[(masked >= start) & (masked < start + len(scores))] - start
+            scores[block_masked] = worst
+            for position in self._best(scores, top_k):
+                if scores[position] != worst:
+                    found.append((float(scores[position]), start + int(position)))
+        if self.wal:
+            if self._wal_matrix is None:
+                self._wal_matrix = (list(self.wal), np.stack([vector for vector, _ in self.wal.values()]))
+            wal_ids, wal_matrix = self._wal_matrix
+            scores = self._scores(wal_matrix, query)
+            found.extend((float(scores[position]), wal_ids[position]) for position in self._best(scores, top_k))
+
+        found.sort(key=lambda item: item[0], reverse=self._backend.metric != "euclidean")
+        results = []
+        for score, item in found[:top_k]:
+            if isinstance(item, str):
+                results.append({"id": item, "score": score, "metadata": self.wal[item][1]})
+            else:
+                results.append({"id": self.base.id(item), "score": score, "metadata": self.base.metadata(item)})
+        return results
+
+    def ids_and_source(self) -> List[Dict[str, str]]:
+        self.refresh()
+        results = [
+            {"id": self.base.id(row), "source": self.base.metadata(row)["source"]}
+            for row in range(len(self.base)) if row not in self.masked
+        ]
+        results.extend({"id": vec_id, "source": metadata["source"]} for vec_id, (_, metadata) in self.wal.items())
+        return results
+
+    def storage(self) -> Dict[str, Any]:
+        self.refresh()
+        return {
+            "namespace": self.namespace,
+            "generation": self.generation,
+            "vectors": len(self.base) - len(self.masked) + len(self.wal),
+            "base_vectors": len(self.base),
+            "wal_operations": self.wal_ops,
+        }
+
+
+class MmapBackend(VectorBackend):
+    """
+    Backend locale con ricerca esatta su file in memory map: l'avvio non carica
+    l'indice in RAM (vengono solo aperti i file) e i worker di gunicorn che usano la
+    stessa cartella condividono la page cache invece di avere ciascuno una copia.
+
+    L'indice viene salvato nella cartella <index_dir>/<index_name>; ogni namespace
+    diverso da quello predefinito è una partizione separata nella sottocartella
+    partitions/<hash del namespace>. dtype ("float32" o "float16") è il formato della
+    matrice su disco; wal_max_ops è il numero di operazioni dopo cui il log di
+    scrittura viene unito al segmento base.
+    """
+
+    PARTITIONS_DIR = "partitions"
+    DTYPES = ("float32", "float16")
+
+    def __init__(
+        self,
+        index_name: str,
+        dimension: int,
+        metric: str,
+        index_dir: str,
+        dtype: str = "float32",
+        wal_max_ops: int = 10000,
+    ) -> None:
+        super().__init__(index_name, dimension, metric)
+        if dtype not in self.DTYPES:
+            raise ValueError(f"Formato dei vettori non supportato: {dtype}")
+        self.dtype = dtype
+        self.wal_max_ops = wal_max_ops
+        self._path = os.path.join(index_dir, index_name)
+        self._lock = threading.RLock()
+        self._partitions = {}  # namespace -> _MmapPartition
+        self._default = self._partition("")
+
+    def _prepare(self, vectors: List[List[float]]) -> np.ndarray:
+        matrix = np.asarray(vectors, dtype="float32").reshape(-1, self.dimension)
+        if self.metric == "cosine":
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix = matrix / np.maximum(norms, 1e-12)
+        return matrix
+
+    def _partitions_path(self) -> str:
+        return os.path.join(self._path, self.PARTITIONS_DIR)
+
+    def _partition(self, namespace: str) -> _MmapPartition:
+        with self._lock:
+            partition = self._partitions.get(namespace)
+            if partition is None:
+                if namespace:
+                    digest = hashlib.sha1(namespace.encode("utf-8")).hexdigest()
+                    path = os.path.join(self._partitions_path(), digest)
+                else:
+                    path = self._path
+                partition = _MmapPartition(self, namespace, path)
+                self._partitions[namespace] = partition
+            return partition
+
+    def _existing_partition(self, namespace: str) -> Optional[_MmapPartition]:
+        if not self._default.exists():
+            raise VectorBackendError(f"L'indice {self.index_name} non esiste")
+        partition = self._partition(namespace)
+        return partition if partition.exists() else None
+
+    def index_exists(self) -> bool:
+        return self._default.exists()
+
+    def create_index(self) -> bool:
+        with self._lock:
+            if self.index_exists():
+                return False
+            self._default.create()
+            return True
+
+    def delete_index(self) -> bool:
+        with self._lock:
+            if not self.index_exists():
+                return False
+            shutil.rmtree(self._path, ignore_errors=True)
+            self._partitions = {}
+            self._default = self._partition("")
+            return True
+
+    def upsert(self, vectors: List[Tuple[str, List[float], Dict[str, Any]]], namespace: str = "") -> int:
+        if not vectors:
+            return 0
+        with self._lock:
+            partition = self._existing_partition(namespace)
+            if partition is None:
+                partition = self._partition(namespace)
+                partition.create()
+            partition.upsert(vectors)
+        return len(vectors)
+
+    def query(self, vector: List[float], top_k: int, namespace: str = "") -> List[Dict[str, Any]]:
+        with self._lock:
+            partition = self._existing_partition(namespace)
+            if partition is None:
+                return []
+            return partition.query(self._prepare([vector])[0], top_k)
+
+    def delete(self, ids: List[str], namespace: str = "") -> None:
+        if not ids:
+            return
+        with self._lock:
+            partition = self._existing_partition(namespace)
+            if partition is not None:
+                partition.remove(ids)
+
+    def delete_namespace(self, namespace: str) -> None:
+        with self._lock:
+            if not namespace:
+                raise VectorBackendError("Il namespace predefinito non può essere eliminato")
+            partition = self._existing_partition(namespace)
+            if partition is not None:
+                shutil.rmtree(partition.path, ignore_errors=True)
+            self._partitions.pop(namespace, None)
+
+    def delete_all(self) -> None:
+        with self._lock:
+            if not self.index_exists():
+                raise VectorBackendError(f"L'indice {self.index_name} non esiste")
+            shutil.rmtree(self._partitions_path(), ignore_errors=True)
+            self._partitions = {"": self._default}
+            self._default.create()
+
+    def list_namespaces(self) -> List[str]:
+        with self._lock:
+            if not self.index_exists():
+                return []
+            namespaces = [""]
+            if os.path.isdir(self._partitions_path()):
+                for name in sorted(os.listdir(self._partitions_path())):
+                    namespace_file = os.path.join(self._partitions_path(), name, "namespace")
+                    if os.path.exists(os.path.join(self._partitions_path(), name, "CURRENT")):
+                        with open(namespace_file, "r") as f:
+                            namespaces.append(f.read())
+            return namespaces
+
+    def list_ids_and_source(self) -> List[Dict[str, str]]:
+        with self._lock:
+            results = []
+            for namespace in self.list_namespaces():
+                results.extend(self._partition(namespace).ids_and_source())
+            return results
+
+    def merge(self) -> None:
+        """
+        Unisce subito il log di scrittura di ogni partizione al rispettivo segmento base.
+        """
+        with self._lock:
+            for namespace in self.list_namespaces():
+                self._partition(namespace).merge()
+
+    def storage_report(self) -> Dict[str, Any]:
+        with self._lock:
+            if not self.index_exists():
+                raise VectorBackendError(f"L'indice {self.index_name} non esiste")
+            partitions = [self._partition(namespace).storage() for namespace in self.list_namespaces()]
+        bytes_per_vector = self.dimension * np.dtype(self.dtype).itemsize
+        return {
+            "backend": "mmap",
+            "dtype": self.dtype,
+            "dimension": self.dimension,
+            "vectors": sum(partition["vectors"] for partition in partitions),
+            "bytes_per_vector": bytes_per_vector,
+            "float32_bytes_per_vector": self.dimension * 4,
+            "compression": round(self.dimension * 4 / bytes_per_vector, 2),
+            "wal_max_operations": self.wal_max_ops,
+            "partitions": partitions,
+        }
+
+    def warm_up(self) -> None:
+        with self._lock:
+            if self.index_exists():
+                self._default.refresh()
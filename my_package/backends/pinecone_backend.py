@@ -0,0 +1,193 @@
+import threading
+from typing import Any, Dict, List, Tuple, Union
+
+import numpy as np
+import pinecone
+
+from my_package.backends.base import VectorBackend, VectorBackendError
+
+
+# pinecone.init è globale al processo: viene eseguito una sola volta
+_pinecone_lock = threading.Lock()
+_pinecone_initialized = False
+
+
+class PineconeBackend(VectorBackend):
+    """
+    Backend che salva i vettori su un indice Pinecone.
+    """
+
+    UPSERT_BATCH_SIZE = 100
+    DELETE_BATCH_SIZE = 1000
+    MAX_STALE_QUERIES = 20
+
+    def __init__(self, index_name: str, dimension: int, metric: str, api_key: str, environment: str, top_k: int) -> None:
+        super().__init__(index_name, dimension, metric)
+        self._api_key = api_key
+        self._environment = environment
+        self._top_k = top_k
+        self._lock = threading.RLock()
+        self._index = None
+        self._pineconeConfig()
+
+    def _pineconeConfig(self) -> Union[pinecone.Index, None]:
+        """
+        Configura Pinecone con la chiave API e l'ambiente specificati.
+
+        Returns:
+        - pinecone.Index or None: Oggetto Pinecone configurato o None in caso di errore.
+        """
+        global _pinecone_initialized
+        try:
+            with _pinecone_lock:
+                if _pinecone_initialized:
+                    return None
+                # Inizializza Pinecone
+                result = pinecone.init(
+                    api_key=self._api_key,  # Trovato su app.pinecone.io
+                    environment=self._environment,  # Trovato accanto all'API key nella console
+                )
+                _pinecone_initialized = True
+                return result
+        except pinecone.exceptions.PineconeAPIException as e:
+            print(f"Errore Pinecone API durante l'inizializzazione: {e}")
+            return None
+        except pinecone.exceptions.PineconeConnectionException as e:
+            print(f"Errore di connessione a Pinecone durante l'inizializzazione: {e}")
+            return None
+
+    def _get_index(self) -> pinecone.Index:
+        """
+        Restituisce l'handle dell'indice, creandolo solo alla prima richiesta.
+        L'handle mantiene il proprio pool di connessioni HTTP, che resta caldo
+        per tutta la vita del processo.
+        """
+        with self._lock:
+            if self._index is None:
+                self._index = pinecone.Index(self.index_name)
+            return self._index
+
+    def index_exists(self) -> bool:
+        # Una volta ottenuto l'handle non viene più interrogato Pinecone
+        # (list_indexes è una chiamata di rete)
+        if self._index is not None:
+            return True
+        try:
+            return self.index_name in pinecone.list_indexes()
+        except pinecone.exceptions.PineconeException as e:
+            raise VectorBackendError(e) from e
+
+    def create_index(self) -> bool:
+        if self.index_exists():
+            return False
+        settings = {
+            "name": self.index_name,
+            "metric": self.metric,
+            "dimension": self.dimension,
+        }
+        try:
+            pinecone.create_index(**settings)
+        except pinecone.exceptions.PineconeException as e:
+            raise VectorBackendError(e) from e
+        return True
+
+    def delete_index(self) -> bool:
+        if not self.index_exists():
+            return False
+        try:
+            pinecone.delete_index(self.index_name)
+        except pinecone.exceptions.PineconeException as e:
+            raise VectorBackendError(e) from e
+        with self._lock:
+            self._index = None
+        return True
+
+    def upsert(self, vectors: List[Tuple[str, List[float], Dict[str, Any]]], namespace: str = "") -> int:
+        if not vectors:
+            return 0
+        try:
+            self._get_index().upsert(vectors=vectors, namespace=namespace, batch_size=self.UPSERT_BATCH_SIZE)
+        except pinecone.exceptions.PineconeException as e:
+            raise VectorBackendError(e) from e
+        return len(vectors)
+
+    def query(self, vector: List[float], top_k: int, namespace: str = "") -> List[Dict[str, Any]]:
+        try:
+            query_results = self._get_index().query(
+                vector=vector,
+                top_k=top_k,
+                include_values=False,
+                include_metadata=True,
+                namespace=namespace,
+            )
+        except pinecone.exceptions.PineconeException as e:
+            raise VectorBackendError(e) from e
+        return [
+            {"id": item["id"], "score": item["score"], "metadata": item["metadata"]}
+            for item in query_results["matches"]
+        ]
+
+    def delete(self, ids: List[str], namespace: str = "") -> None:
+        if not ids:
+            return
+        try:
+            self._get_index().delete(ids=ids, namespace=namespace)
+        except pinecone.exceptions.PineconeException as e:
+            raise VectorBackendError(e) from e
+
+    def delete_namespace(self, namespace: str) -> None:
+        try:
+            self._get_index().delete(delete_all=True, namespace=namespace)
+        except pinecone.exceptions.PineconeException as e:
+            raise VectorBackendError(e) from e
+
+    def delete_all(self) -> None:
+        try:
+            for namespace in self._namespace_counts():
+                self._get_index().delete(delete_all=True, namespace=namespace)
+        except pinecone.exceptions.PineconeException as e:
+            raise VectorBackendError(e) from e
+
+    def _namespace_counts(self) -> Dict[str, int]:
+        stats = self._get_index().describe_index_stats()
+        return {
+            namespace: data["vector_count"] for namespace, data in stats.get("namespaces", {}).items()
+        }
+
+    def list_namespaces(self) -> List[str]:
+        try:
+            return list(self._namespace_counts())
+        except pinecone.exceptions.PineconeException as e:
+            raise VectorBackendError(e) from e
+
+    def list_ids_and_source(self) -> List[Dict[str, str]]:
+        """
+        Ottiene oggetti con campi 'id' e 'source' dall'indice Pinecone utilizzando vettori casuali,
+        dato che Pinecone non permette di elencare il contenuto di un indice.
+        Gli id già visti vengono scartati e la ricerca si ferma dopo MAX_STALE_QUERIES
+        query consecutive che non trovano nulla di nuovo. Ogni namespace viene esplorato
+        separatamente.
+        """
+        try:
+            results = []
+            for namespace, num_vectors in self._namespace_counts().items():
+                ids_and_source = {}
+                stale_queries = 0
+                while len(ids_and_source) < num_vectors and stale_queries < self.MAX_STALE_QUERIES:
+                    # Creazione di un vettore casuale
+                    input_vector = np.random.rand(self.dimension).tolist()
+                    found = len(ids_and_source)
+                    for item in self.query(input_vector, self._top_k, namespace):
+                        ids_and_source[item["id"]] = item["metadata"]["source"]
+                    stale_queries = stale_queries + 1 if len(ids_and_source) == found else 0
+                results.extend({"id": vec_id, "source": source} for vec_id, source in ids_and_source.items())
+            return results
+        except pinecone.exceptions.PineconeException as e:
+            raise VectorBackendError(e) from e
+
+    def warm_up(self) -> None:
+        if self.index_exists():
+            try:
+                self._get_index().describe_index_stats()
+            except pinecone.exceptions.PineconeException as e:
+                raise VectorBackendError(e) from e
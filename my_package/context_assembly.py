@@ -0,0 +1,223 @@
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+from langchain.schema import BaseRetriever, Document
+
+from my_package import metrics
+from my_package.tokens import get_encoding
+
+
+_WORD = re.compile(r"\w+")
+
+
+@dataclass
+class ContextReport:
+    """
+    Esito dell'assemblaggio del contesto di una domanda.
+    """
+    candidates: int
+    retrieved_tokens: int  # token dei primi k candidati, cioè del contesto senza assemblaggio
+    assembled_tokens: int
+    duplicates: int = 0
+    merged: int = 0
+    trimmed: int = 0
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.retrieved_tokens - self.assembled_tokens
+
+
+class ContextAssembler(BaseRetriever):
+    """
+    Retriever che prepara il contesto passato alla catena "stuff" a partire dai
+    candidati di un altro retriever:
+
+    1. sceglie k chunk con la maximal marginal relevance, bilanciando la posizione
+       nel ranking con la somiglianza (Jaccard sulle parole) ai chunk già scelti, e
+       scarta i quasi duplicati;
+    2. unisce i chunk adiacenti della stessa sorgente che si sovrappongono, così il
+       testo in comune compare una volta sola;
+    3. tiene i chunk in ordine di rilevanza finché entrano nel budget di token,
+       troncando ai confini dei token l'ultimo che entra solo in parte.
+
+    I token risparmiati rispetto ai primi k candidati sono registrati nelle metriche.
+    """
+
+    def __init__(
+        self,
+        retriever: BaseRetriever,
+        k: int = 4,
+        token_budget: int = 1500,
+        mmr_lambda: float = 0.7,
+        duplicate_threshold: float = 0.9,
+        encoding: str = "cl100k_base",
+        min_overlap: int = 20,
+        min_tail_tokens: int = 32,
+    ) -> None:
+        self._retriever = retriever
+        self._k = k
+        self._token_budget = token_budget
+        self._mmr_lambda = mmr_lambda
+        self._duplicate_threshold = duplicate_threshold
+        self._encoding = encoding
+        self._min_overlap = min_overlap
+        self._min_tail_tokens = min_tail_tokens
+
+    def get_relevant_documents(self, query: str) -> List[Document]:
+        candidates = self._retriever.get_relevant_documents(query)
+        try:
+            with metrics.timed("context_assembly"):
+                docs, report = self.assemble(candidates)
+        except Exception as e:
+            # Senza assemblaggio la catena riceve i primi k candidati, come senza questa fase
+            print(f"Errore durante l'assemblaggio del contesto: {e}")
+            return candidates[:self._k]
+        metrics.count_tokens("context_retrieved", report.retrieved_tokens)
+        metrics.count_tokens("context_assembled", report.assembled_tokens)
+        metrics.CONTEXT_TOKENS_SAVED.observe(max(report.saved_tokens, 0))
+        metrics.record("context_tokens_retrieved", report.retrieved_tokens)
+        metrics.record("context_tokens_assembled", report.assembled_tokens)
+        metrics.record("context_tokens_saved", report.saved_tokens)
+        return docs
+
+    async def aget_relevant_documents(self, query: str) -> List[Document]:
+        return self.get_relevant_documents(query)
+
+    def assemble(self, candidates: List[Document]) -> Tuple[List[Document], ContextReport]:
+        """
+        Applica deduplicazione, unione e taglio ai candidati, in ordine di rilevanza.
+
+        Returns:
+        - Una tupla con i chunk del contesto e il report dell'assemblaggio.
+        """
+        encoding = get_encoding(self._encoding)
+        counts: Dict[str, int] = {}
+
+        def tokens(text: str) -> int:
+            if text not in counts:
+                counts[text] = len(encoding.encode(text, disallowed_special=()))
+            return counts[text]
+
+        report = ContextReport(
+            candidates=len(candidates),
+            retrieved_tokens=sum(tokens(doc.page_content) for doc in candidates[:self._k]),
+            assembled_tokens=0
+        )
+        selected = self._mmr(candidates, report)
+        merged = self._merge_adjacent(selected, report)
+
+        docs = []
+        remaining = self._token_budget
+        for doc in merged:
+            length = tokens(doc.page_content)
+            if self._token_budget <= 0 or length <= remaining:
+                docs.append(doc)
+                remaining -= length
+                continue
+            report.trimmed += 1
+            # Il chunk non entra per intero: ne entra l'inizio se resta spazio sufficiente,
+            # altrimenti si prova con i successivi, che possono essere più corti
+            if remaining >= self._min_tail_tokens:
+                head = encoding.decode(encoding.encode(doc.page_content, disallowed_special=())[:remaining])
+                docs.append(Document(page_content=head, metadata=dict(doc.metadata)))
+                remaining -= tokens(head)
+
+        report.assembled_tokens = sum(tokens(doc.page_content) for doc in docs)
+        return docs, report
+
+    @staticmethod
+    def _words(doc: Document) -> Set[str]:
+        return set(_WORD.findall(doc.page_content.lower()))
+
+    @staticmethod
+    def _similarity(a: Set[str], b: Set[str]) -> float:
+        if not a or not b:
+            return 0.0
+        return len(a & b) / len(a | b)
+
+    def _mmr(self, candidates: List[Document], report: ContextReport) -> List[Document]:
+        """
+        Maximal marginal relevance: la rilevanza di un candidato dipende dalla sua
+        posizione nel ranking del retriever, la ridondanza dalla massima somiglianza
+        con i chunk già scelti. Non richiede di ricalcolare gli embedding dei chunk.
+        """
+        words = [ContextAssembler._words(doc) for doc in candidates]
+        redundancy = [0.0] * len(candidates)
+        pending = list(range(len(candidates)))
+        selected = []
+        while pending and len(selected) < self._k:
+            best = max(
+                pending,
+                key=lambda i: self._mmr_lambda * (1 - i / len(candidates)) - (1 - self._mmr_lambda) * redundancy[i]
+            )
+            pending.remove(best)
+            selected.append(best)
+            for i in list(pending):
+                redundancy[i] = max(redundancy[i], ContextAssembler._similarity(words[i], words[best]))
+                if redundancy[i] >= self._duplicate_threshold:
+                    pending.remove(i)
+                    report.duplicates += 1
+        return [candidates[i] for i in selected]
+
+    def _overlap(self, first: str, second: str) -> int:
+        """
+        Restituisce la lunghezza del suffisso di first che coincide con un prefisso di
+        second (0 se è più corto di min_overlap caratteri).
+        """
+        if len(second) < self._min_overlap:
+            return 0
+        probe = second[:self._min_overlap]
+        start = first.find(probe)
+        while start != -1:
+            if second.startswith(first[start:]):
+                return len(first) - start
+            start = first.find(probe, start + 1)
+        return 0
+
+    def _merge(self, first: Document, second: Document) -> Optional[Document]:
+        """
+        Unisce due chunk della stessa sorgente se uno contiene l'altro o se si
+        sovrappongono; il chunk unito prende il posto di first.
+        """
+        if first.metadata.get("source") != second.metadata.get("source"):
+            return None
+        a, b = first.page_content, second.page_content
+        if b in a:
+            text = a
+        elif a in b:
+            text = b
+        else:
+            overlap = self._overlap(a, b)
+            if overlap:
+                text = a + b[overlap:]
+            else:
+                overlap = self._overlap(b, a)
+                if not overlap:
+                    return None
+                text = b + a[overlap:]
+        metadata = dict(first.metadata)
+        for key, pick in (("page_start", min), ("page_end", max)):
+            values = [doc.metadata[key] for doc in (first, second) if key in doc.metadata]
+            if values:
+                metadata[key] = pick(values)
+        return Document(page_content=text, metadata=metadata)
+
+    def _merge_adjacent(self, docs: List[Document], report: ContextReport) -> List[Document]:
+        docs = list(docs)
+        merged = True
+        # Le unioni possono concatenarsi (a+b poi con c): si ripete finché ne avvengono
+        while merged:
+            merged = False
+            for i in range(len(docs)):
+                for j in range(i + 1, len(docs)):
+                    doc = self._merge(docs[i], docs[j])
+                    if doc is not None:
+                        docs[i] = doc
+                        del docs[j]
+                        report.merged += 1
+                        merged = True
+                        break
+                if merged:
+                    break
+        return docs
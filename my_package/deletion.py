@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from my_package.backends import VectorBackend
+
+
+@dataclass
+class DeletionResult:
+    """
+    Esito di una cancellazione massiva: per ogni sorgente gli id eliminati davvero
+    e l'eventuale errore dei batch non riusciti.
+    """
+    deleted_ids: Dict[str, List[str]] = field(default_factory=dict)
+    errors: Dict[str, str] = field(default_factory=dict)
+    batches: int = 0
+
+
+class BulkDeleter(object):
+    """
+    Elimina grandi quantità di vettori dividendo gli id in batch della dimensione
+    accettata dal backend ed eseguendoli in parallelo, con tentativi ripetuti per
+    ogni batch. Gli id di più sorgenti possono finire nello stesso batch: un batch
+    fallito segna come non riuscite tutte le sorgenti che contiene.
+    """
+
+    def __init__(
+        self,
+        backend: VectorBackend,
+        batch_size: int = None,
+        workers: int = None,
+        max_retries: int = None,
+        retry_backoff: float = None,
+    ) -> None:
+        load_dotenv()
+        self._backend = backend
+        # Senza un limite del backend (ad esempio FAISS, che riscrive l'indice ad ogni
+        # cancellazione) tutti gli id di un namespace vengono eliminati in una sola chiamata
+        self._batch_size = batch_size or int(os.getenv("DELETE_BATCH_SIZE", 0)) or backend.DELETE_BATCH_SIZE
+        self._workers = workers or int(os.getenv("DELETE_WORKERS", 8))
+        self._max_retries = max_retries if max_retries is not None else int(os.getenv("DELETE_MAX_RETRIES", 3))
+        self._retry_backoff = retry_backoff if retry_backoff is not None else float(os.getenv("DELETE_RETRY_BACKOFF", 0.5))
+
+    def _with_retries(self, operation: Callable[[], None]) -> Optional[str]:
+        """
+        Esegue l'operazione ritentando con attesa crescente.
+
+        Returns:
+        - str: Messaggio dell'ultimo errore, None se l'operazione è riuscita.
+        """
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                operation()
+                return None
+            except Exception as e:
+                if attempts > self._max_retries:
+                    return str(e)
+                time.sleep(self._retry_backoff * 2 ** (attempts - 1))
+
+    def _batches(
+        self, ids_by_source: Dict[str, List[str]], namespace: Callable[[str], str]
+    ) -> List[Tuple[str, List[Tuple[str, str]]]]:
+        by_namespace = {}
+        for source, ids in ids_by_source.items():
+            by_namespace.setdefault(namespace(source), []).extend((source, vec_id) for vec_id in ids)
+        batches = []
+        for name, items in by_namespace.items():
+            size = self._batch_size or len(items)
+            for offset in range(0, len(items), size):
+                batches.append((name, items[offset:offset + size]))
+        return batches
+
+    def delete_ids(
+        self, ids_by_source: Dict[str, List[str]], namespace: Callable[[str], str] = lambda source: ""
+    ) -> DeletionResult:
+        """
+        Elimina gli id indicati, raggruppati per sorgente.
+
+        Parameters:
+        - ids_by_source (Dict[str, List[str]]): Id da eliminare per ogni sorgente.
+        - namespace (Callable[[str], str]): Namespace in cui si trovano i vettori di una sorgente.
+
+        Returns:
+        - DeletionResult: Id eliminati ed errori per sorgente.
+        """
+        result = DeletionResult(deleted_ids={source: [] for source in ids_by_source})
+        batches = self._batches(ids_by_source, namespace)
+        result.batches = len(batches)
+        lock = threading.Lock()
+
+        def task(batch):
+            name, items = batch
+            error = self._with_retries(lambda: self._backend.delete([vec_id for _, vec_id in items], name))
+            with lock:
+                for source, vec_id in items:
+                    if error is None:
+                        result.deleted_ids[source].append(vec_id)
+                    else:
+                        result.errors[source] = error
+
+        self._run(task, batches)
+        return result
+
+    def delete_namespaces(self, ids_by_source: Dict[str, List[str]], namespace: Callable[[str], str]) -> DeletionResult:
+        """
+        Elimina le sorgenti indicate eliminando per intero i loro namespace.
+        """
+        result = DeletionResult(deleted_ids={source: [] for source in ids_by_source})
+        result.batches = len(ids_by_source)
+        lock = threading.Lock()
+
+        def task(source):
+            error = self._with_retries(lambda: self._backend.delete_namespace(namespace(source)))
+            with lock:
+                if error is None:
+                    result.deleted_ids[source] = list(ids_by_source[source])
+                else:
+                    result.errors[source] = error
+
+        self._run(task, list(ids_by_source))
+        return result
+
+    def _run(self, task: Callable, items: List) -> None:
+        if len(items) <= 1:
+            for item in items:
+                task(item)
+            return
+        with ThreadPoolExecutor(max_workers=min(self._workers, len(items))) as executor:
+            list(executor.map(task, items))
@@ -0,0 +1,206 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from langchain.embeddings.base import Embeddings
+
+from my_package import metrics
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings con cache a due livelli davanti a un modello reale:
+    - una LRU in memoria, per i testi richiesti più spesso dal processo;
+    - un database SQLite su disco, condiviso tra processi (modalità WAL).
+
+    La chiave è l'hash del nome del modello e del testo, quindi cambiare modello
+    non restituisce mai vettori calcolati con un altro. Il database viene tenuto
+    entro max_entries eliminando le voci usate meno di recente.
+    """
+
+    EVICTION_INTERVAL = 1000
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        db_path: str,
+        memory_size: int = 1024,
+        max_entries: int = 100000,
+    ) -> None:
+        self._embeddings = embeddings
+        self._document_model = getattr(embeddings, "document_model_name", None) or getattr(embeddings, "model", type(embeddings).__name__)
+        self._query_model = getattr(embeddings, "query_model_name", None) or self._document_model
+        self._db_path = db_path
+        self._memory_size = memory_size
+        self._max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._inserts = 0
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self._create_tables()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _create_tables(self) -> None:
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)"
+            )
+
+    @staticmethod
+    def _key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _memory_get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+            return vector
+
+    def _memory_put(self, key: str, vector: List[float]) -> None:
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self._memory_size:
+                self._memory.popitem(last=False)
+
+    def _disk_get(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        conn = self._connection()
+        # SQLite limita il numero di parametri per query
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                batch
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = array("f", blob).tolist()
+        if found:
+            with conn:
+                conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(time.time(), key) for key in found]
+                )
+        return found
+
+    def _disk_put(self, items: Dict[str, List[float]]) -> None:
+        conn = self._connection()
+        now = time.time()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), now) for key, vector in items.items()]
+            )
+        with self._lock:
+            self._inserts += len(items)
+            evict = self._inserts >= self.EVICTION_INTERVAL
+            if evict:
+                self._inserts = 0
+        if evict:
+            self._evict()
+
+    def _evict(self) -> None:
+        """
+        Elimina le voci usate meno di recente oltre il limite max_entries.
+        """
+        conn = self._connection()
+        with conn:
+            count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count > self._max_entries:
+                conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_access LIMIT ?)",
+                    (count - self._max_entries,)
+                )
+
+    def _lookup(self, model: str, texts: List[str]) -> (List[str], Dict[str, List[float]]):
+        """
+        Cerca i testi prima in memoria e poi su disco.
+
+        Returns:
+        - Le chiavi dei testi e un dizionario chiave -> vettore con quelli trovati.
+        """
+        keys = [CachedEmbeddings._key(model, text) for text in texts]
+        found = {}
+        for key in keys:
+            vector = self._memory_get(key)
+            if vector is not None:
+                found[key] = vector
+        memory_hits = len(found)
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing:
+            from_disk = self._disk_get(missing)
+            for key, vector in from_disk.items():
+                self._memory_put(key, vector)
+            found.update(from_disk)
+        with self._lock:
+            self.hits_memory += memory_hits
+            self.hits_disk += len(found) - memory_hits
+        metrics.cache_result("embedding", True, len(found))
+        return keys, found
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found = self._lookup(self._document_model, texts)
+        to_embed = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                to_embed.setdefault(key, text)
+        if to_embed:
+            vectors = self._embeddings.embed_documents(list(to_embed.values()))
+            computed = dict(zip(to_embed.keys(), vectors))
+            with self._lock:
+                self.misses += len(computed)
+            metrics.cache_result("embedding", False, len(computed))
+            self._disk_put(computed)
+            for key, vector in computed.items():
+                self._memory_put(key, vector)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        keys, found = self._lookup(self._query_model, [text])
+        if keys[0] in found:
+            return found[keys[0]]
+        vector = self._embeddings.embed_query(text)
+        with self._lock:
+            self.misses += 1
+        metrics.cache_result("embedding", False)
+        self._disk_put({keys[0]: vector})
+        self._memory_put(keys[0], vector)
+        return vector
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Restituisce i contatori di hit e miss della cache.
+        """
+        with self._lock:
+            hits = self.hits_memory + self.hits_disk
+            total = hits + self.misses
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+            }
@@ -0,0 +1,185 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+
+class HistoryStore(object):
+    """
+    Cronologia dei caricamenti in un database SQLite a sola aggiunta.
+
+    Ogni caricamento aggiunge righe senza rileggere quelle esistenti, quindi il costo
+    di scrittura non cresce con la cronologia; le scritture di più thread o processi
+    sono serializzate da SQLite. Le ricerche per percorso, stato e data usano indici.
+    """
+
+    def __init__(self, db_path: str = None, legacy_json: str = None) -> None:
+        """
+        Parameters:
+        - db_path (str, optional): Percorso del database (predefinito: HISTORY_DB).
+        - legacy_json (str, optional): Vecchio file JSON della cronologia (HISTORY_FILE);
+          se esiste viene importato una sola volta.
+        """
+        load_dotenv()
+        self._db_path = db_path or os.getenv("HISTORY_DB", "history.sqlite3")
+        self._local = threading.local()
+        self._create_tables()
+        if legacy_json:
+            self._import_json(legacy_json)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _create_tables(self) -> None:
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS history ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT NOT NULL, state TEXT NOT NULL, "
+                "created REAL NOT NULL, data TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS history_path ON history (path, created)")
+            conn.execute("CREATE INDEX IF NOT EXISTS history_state ON history (state, created)")
+            conn.execute("CREATE INDEX IF NOT EXISTS history_created ON history (created)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS history_imports (file TEXT PRIMARY KEY, imported REAL NOT NULL)"
+            )
+
+    def _import_json(self, file_path: str) -> None:
+        """
+        Importa il vecchio file JSON della cronologia, se non è già stato importato.
+        """
+        if not os.path.exists(file_path):
+            return
+        file_path = os.path.abspath(file_path)
+        conn = self._connection()
+        if conn.execute("SELECT 1 FROM history_imports WHERE file = ?", (file_path,)).fetchone():
+            return
+        try:
+            with open(file_path, "r") as json_file:
+                records = json.load(json_file)
+        except (OSError, ValueError) as e:
+            print(f"Non è stato possibile importare la cronologia da {file_path}: {e}")
+            return
+        modified = os.path.getmtime(file_path)
+        with conn:
+            self._insert(conn, records, modified)
+            conn.execute(
+                "INSERT INTO history_imports (file, imported) VALUES (?, ?)", (file_path, time.time())
+            )
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, records: List[Dict[str, Any]], created: float) -> None:
+        conn.executemany(
+            "INSERT INTO history (path, state, created, data) VALUES (?, ?, ?, ?)",
+            [
+                (record["path"], record["state"], record.get("created", created), json.dumps(record))
+                for record in records
+            ]
+        )
+
+    def append(self, records: List[Dict[str, Any]]) -> bool:
+        """
+        Aggiunge dei record alla cronologia in un'unica transazione.
+
+        Parameters:
+        - records (List[Dict]): Record con almeno i campi 'path' e 'state'.
+
+        Returns:
+        - True se il salvataggio ha avuto successo, altrimenti False.
+        """
+        if not records:
+            return True
+        try:
+            conn = self._connection()
+            with conn:
+                HistoryStore._insert(conn, records, time.time())
+            return True
+        except sqlite3.Error as e:
+            print(f"Errore durante il salvataggio della cronologia: {e}")
+            return False
+
+    def query(
+        self,
+        path: str = None,
+        state: str = None,
+        since: float = None,
+        until: float = None,
+        limit: int = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Cerca nella cronologia, dal record più recente.
+
+        Parameters:
+        - path (str, optional): Percorso del file.
+        - state (str, optional): Stato del caricamento ("success", "error" o "wrong").
+        - since (float, optional): Timestamp minimo.
+        - until (float, optional): Timestamp massimo.
+        - limit (int, optional): Numero massimo di record.
+
+        Returns:
+        - List[Dict]: I record trovati, con il campo 'created'.
+        """
+        conditions, params = [], []
+        if path is not None:
+            conditions.append("path = ?")
+            params.append(path)
+        if state is not None:
+            conditions.append("state = ?")
+            params.append(state)
+        if since is not None:
+            conditions.append("created >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("created <= ?")
+            params.append(until)
+        sql = "SELECT created, data FROM history"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY created DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        results = []
+        for row in self._connection().execute(sql, params):
+            record = json.loads(row["data"])
+            record["created"] = row["created"]
+            results.append(record)
+        return results
+
+    def compact(self, keep_per_path: int = 1, older_than: float = None) -> int:
+        """
+        Compatta la cronologia mantenendo solo gli ultimi keep_per_path record di ogni
+        file; se older_than è indicato vengono toccati solo i record precedenti.
+
+        Returns:
+        - int: Numero di record eliminati.
+        """
+        conn = self._connection()
+        params = [keep_per_path]
+        sql = (
+            "DELETE FROM history WHERE id IN ("
+            "SELECT id FROM (SELECT id, created, ROW_NUMBER() OVER "
+            "(PARTITION BY path ORDER BY created DESC, id DESC) AS position FROM history) "
+            "WHERE position > ?"
+        )
+        if older_than is not None:
+            sql += " AND created < ?"
+            params.append(older_than)
+        sql += ")"
+        with conn:
+            removed = conn.execute(sql, params).rowcount
+        conn.execute("VACUUM")
+        return removed
@@ -0,0 +1,66 @@
+from typing import Dict, List
+
+from langchain.schema import BaseRetriever, Document
+from langchain.vectorstores.base import VectorStore
+
+from my_package import metrics
+from my_package.lexical_index import LexicalIndex
+from my_package.retrieval_scope import current_sources
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever che unisce la ricerca densa sull'indice vettoriale e la ricerca
+    lessicale BM25 sull'indice invertito locale.
+
+    I due elenchi di candidati vengono fusi con la Reciprocal Rank Fusion pesata:
+    ogni chunk riceve alpha / (rrf_k + posizione) dalla ricerca densa e
+    (1 - alpha) / (rrf_k + posizione) da quella lessicale. La fusione per posizione
+    non richiede di rendere confrontabili similarità coseno e punteggi BM25.
+
+    Entrambe le ricerche rispettano le sorgenti impostate in current_sources.
+    """
+
+    def __init__(
+        self,
+        vectorstore: VectorStore,
+        lexical: LexicalIndex,
+        k: int = 4,
+        candidates: int = 20,
+        alpha: float = 0.5,
+        rrf_k: int = 60,
+    ) -> None:
+        self._vectorstore = vectorstore
+        self._lexical = lexical
+        self._k = k
+        self._candidates = max(candidates, k)
+        self._alpha = alpha
+        self._rrf_k = rrf_k
+
+    @staticmethod
+    def _key(doc: Document) -> tuple:
+        # Lo stesso chunk arriva dalle due ricerche con la stessa sorgente e lo stesso testo
+        return doc.metadata.get("source"), doc.page_content
+
+    def get_relevant_documents(self, query: str) -> List[Document]:
+        with metrics.timed("retrieval"):
+            return self._get_relevant_documents(query)
+
+    def _get_relevant_documents(self, query: str) -> List[Document]:
+        sources = current_sources.get()
+        dense = self._vectorstore.similarity_search(query, k=self._candidates)
+        lexical = [doc for doc, _ in self._lexical.search(query, k=self._candidates, sources=sources)]
+
+        scores: Dict[tuple, float] = {}
+        docs: Dict[tuple, Document] = {}
+        for weight, ranking in ((self._alpha, dense), (1 - self._alpha, lexical)):
+            for position, doc in enumerate(ranking):
+                key = HybridRetriever._key(doc)
+                scores[key] = scores.get(key, 0.0) + weight / (self._rrf_k + position + 1)
+                docs.setdefault(key, doc)
+
+        best = sorted(scores, key=scores.get, reverse=True)[:self._k]
+        return [docs[key] for key in best]
+
+    async def aget_relevant_documents(self, query: str) -> List[Document]:
+        return self.get_relevant_documents(query)
@@ -0,0 +1,184 @@
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from langchain.embeddings.base import Embeddings
+
+from my_package import metrics
+from my_package.backends import VectorBackend
+
+
+# Limite globale (per processo) alle richieste di embedding contemporanee, condiviso
+# da tutte le pipeline: più file caricati in parallelo non superano EMBEDDING_MAX_INFLIGHT
+_embedding_slots = None
+_embedding_slots_lock = threading.Lock()
+
+
+def _get_embedding_slots() -> threading.BoundedSemaphore:
+    global _embedding_slots
+    with _embedding_slots_lock:
+        if _embedding_slots is None:
+            load_dotenv()
+            _embedding_slots = threading.BoundedSemaphore(int(os.getenv("EMBEDDING_MAX_INFLIGHT", 8)))
+        return _embedding_slots
+
+
+@dataclass
+class BatchResult:
+    """
+    Esito di un singolo batch della pipeline di caricamento.
+    """
+    batch: int
+    size: int
+    success: bool = False
+    attempts: int = 0
+    elapsed: float = 0.0
+    error: Optional[str] = None
+
+
+@dataclass
+class IngestionResult:
+    """
+    Esito complessivo della pipeline: id caricati, id falliti e report dei batch.
+    """
+    uploaded_ids: List[str] = field(default_factory=list)
+    failed_ids: List[str] = field(default_factory=list)
+    batches: List[BatchResult] = field(default_factory=list)
+
+
+class IngestionPipeline(object):
+    """
+    Pipeline di caricamento che raggruppa i chunk in batch di embedding di dimensione
+    fissa e li elabora con un pool di thread limitato: mentre un batch viene caricato
+    sull'indice, i successivi sono già in fase di embedding.
+
+    Ogni batch viene ritentato singolarmente in caso di errore, quindi un fallimento
+    non fa perdere l'intero file. Ogni batch viene scritto in tutti i namespace indicati.
+    """
+
+    def __init__(
+        self,
+        backend: VectorBackend,
+        embeddings: Embeddings,
+        embed_batch_size: int = None,
+        upsert_batch_size: int = None,
+        workers: int = None,
+        max_retries: int = None,
+        retry_backoff: float = None,
+        text_key: str = "text",
+        namespaces: List[str] = None,
+    ) -> None:
+        load_dotenv()
+        self._backend = backend
+        self._embeddings = embeddings
+        self._embed_batch_size = embed_batch_size or int(os.getenv("INGEST_EMBED_BATCH_SIZE", 64))
+        self._upsert_batch_size = upsert_batch_size or int(os.getenv("INGEST_UPSERT_BATCH_SIZE", 100))
+        self._workers = workers or int(os.getenv("INGEST_WORKERS", 4))
+        self._max_retries = max_retries if max_retries is not None else int(os.getenv("INGEST_MAX_RETRIES", 3))
+        self._retry_backoff = retry_backoff if retry_backoff is not None else float(os.getenv("INGEST_RETRY_BACKOFF", 1.0))
+        self._text_key = text_key
+        self._namespaces = namespaces or [""]
+
+    def _batches(self, items: Iterable[Tuple[str, str, Dict[str, Any]]]) -> Iterable[List[Tuple[str, str, Dict[str, Any]]]]:
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= self._embed_batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _process(self, number: int, batch: List[Tuple[str, str, Dict[str, Any]]]) -> BatchResult:
+        """
+        Esegue embedding e upsert di un batch, ritentando fino a max_retries volte
+        con attesa crescente.
+        """
+        result = BatchResult(number, len(batch))
+        start = time.perf_counter()
+        while True:
+            result.attempts += 1
+            try:
+                with _get_embedding_slots(), metrics.timed("embed"):
+                    values = self._embeddings.embed_documents([text for _, text, _ in batch])
+                metrics.count("vectors_embedded", len(batch))
+                vectors = []
+                for (vec_id, text, metadata), embedding in zip(batch, values):
+                    metadata = dict(metadata)
+                    metadata[self._text_key] = text
+                    vectors.append((vec_id, embedding, metadata))
+                with metrics.timed("upsert"):
+                    for namespace in self._namespaces:
+                        for offset in range(0, len(vectors), self._upsert_batch_size):
+                            self._backend.upsert(vectors[offset:offset + self._upsert_batch_size], namespace)
+                metrics.count("vectors_upserted", len(vectors))
+                result.success = True
+                result.error = None
+                break
+            except Exception as e:
+                result.error = str(e)
+                if result.attempts > self._max_retries:
+                    metrics.error("ingest_batch")
+                    break
+                time.sleep(self._retry_backoff * 2 ** (result.attempts - 1))
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    def run(
+        self,
+        items: Iterable[Tuple[str, str, Dict[str, Any]]],
+        on_progress: Callable[[BatchResult], None] = None,
+    ) -> IngestionResult:
+        """
+        Esegue embedding e upsert dei chunk.
+
+        Parameters:
+        - items (Iterable[Tuple[str, str, Dict]]): Tuple (id, testo, metadata); può essere
+          un generatore, i chunk vengono consumati man mano che si formano i batch.
+        - on_progress (Callable[[BatchResult], None], optional): Richiamata al termine di ogni batch.
+
+        Returns:
+        - IngestionResult: id caricati, id falliti e report dei batch.
+        """
+        result = IngestionResult()
+        lock = threading.Lock()
+        # Limita i batch in coda, così un documento enorme non viene tenuto tutto in memoria
+        slots = threading.BoundedSemaphore(self._workers * 2)
+
+        def task(number, batch):
+            try:
+                batch_result = self._process(number, batch)
+                with lock:
+                    ids = [vec_id for vec_id, _, _ in batch]
+                    if batch_result.success:
+                        result.uploaded_ids.extend(ids)
+                    else:
+                        result.failed_ids.extend(ids)
+                    result.batches.append(batch_result)
+                if on_progress is not None:
+                    on_progress(batch_result)
+            finally:
+                slots.release()
+
+        batches = self._batches(items)
+        first = next(batches, None)
+        second = next(batches, None) if first is not None else None
+        if second is None:
+            # Un solo batch (ad esempio la memoria della chat) viene elaborato nel thread
+            # chiamante: niente costo del pool, e funziona anche durante la chiusura del processo
+            if first is not None:
+                slots.acquire()
+                task(0, first)
+        else:
+            with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                for number, batch in enumerate(itertools.chain([first, second], batches)):
+                    slots.acquire()
+                    executor.submit(task, number, batch)
+
+        result.batches.sort(key=lambda batch_result: batch_result.batch)
+        return result
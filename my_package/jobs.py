@@ -0,0 +1,274 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+
+class JobQueue(object):
+    """
+    Coda persistente (SQLite) dei lavori di caricamento dei PDF, elaborata da un
+    pool di thread in background.
+
+    Ogni lavoro contiene una lista di file; per ciascun file vengono registrati
+    stato, numero di chunk, tempi ed eventuali errori. Più processi possono
+    condividere lo stesso database: un lavoro viene assegnato a un solo worker con
+    una transazione esclusiva e resta suo finché ne rinnova il lease (heartbeat).
+    I lavori il cui lease è scaduto, perché il processo che li eseguiva è stato
+    terminato, vengono rimessi in coda e ripresi da un altro worker.
+    """
+
+    POLL_INTERVAL = 2.0
+
+    def __init__(
+        self,
+        handler: Callable[[str, Callable[[Dict[str, Any]], None]], Dict[str, Any]],
+        on_job_done: Callable[[List[Dict[str, Any]]], None] = None,
+        db_path: str = None,
+        workers: int = None,
+        lease: float = None,
+    ) -> None:
+        """
+        Parameters:
+        - handler: Elabora un file; riceve il percorso e una funzione per aggiornare
+          l'avanzamento, restituisce un dizionario con 'state' ed eventuali contatori.
+        - on_job_done (optional): Richiamata con i file di un lavoro quando è terminato.
+        - db_path (str, optional): Percorso del database (predefinito: JOBS_DB).
+        - workers (int, optional): Numero di thread di elaborazione (predefinito: JOBS_WORKERS).
+        - lease (float, optional): Secondi dopo i quali un lavoro senza heartbeat viene
+          rimesso in coda (predefinito: JOBS_LEASE_SECONDS).
+        """
+        load_dotenv()
+        self._handler = handler
+        self._on_job_done = on_job_done
+        self._db_path = db_path or os.getenv("JOBS_DB", "jobs.sqlite3")
+        self._workers = workers or int(os.getenv("JOBS_WORKERS", 2))
+        self._lease = lease or float(os.getenv("JOBS_LEASE_SECONDS", 60))
+        self._owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._create_tables()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _create_tables(self) -> None:
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, state TEXT NOT NULL, created REAL NOT NULL, "
+            "started REAL, finished REAL, error TEXT, owner TEXT, lease_until REAL)"
+        )
+        # Database creati prima dell'introduzione dei lease
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("owner", "TEXT"), ("lease_until", "REAL")):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_files ("
+            "job_id TEXT NOT NULL, position INTEGER NOT NULL, path TEXT NOT NULL, "
+            "state TEXT NOT NULL, chunks_new INTEGER, chunks_unchanged INTEGER, "
+            "chunks_removed INTEGER, chunks_failed INTEGER, chunks_uploaded INTEGER NOT NULL DEFAULT 0, "
+            "batches INTEGER NOT NULL DEFAULT 0, started REAL, finished REAL, error TEXT, "
+            "PRIMARY KEY (job_id, position))"
+        )
+
+    def start(self) -> None:
+        """
+        Avvia (una sola volta) i thread di elaborazione e quello che rinnova i lease
+        dei lavori in corso. I lavori interrotti da un riavvio vengono ripresi quando
+        il loro lease scade.
+        """
+        with self._start_lock:
+            if self._threads:
+                return
+            targets = [(self._heartbeat, "job-heartbeat")]
+            targets += [(self._worker, f"job-worker-{number}") for number in range(self._workers)]
+            for target, name in targets:
+                thread = threading.Thread(target=target, name=name, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wakeup.set()
+
+    def enqueue(self, paths: List[str]) -> str:
+        """
+        Mette in coda un lavoro di caricamento. Il lavoro viene eseguito dai worker
+        avviati con start() da questo o da un altro processo.
+
+        Returns:
+        - str: L'id del lavoro.
+        """
+        job_id = uuid.uuid4().hex
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "INSERT INTO jobs (id, state, created) VALUES (?, 'queued', ?)", (job_id, time.time())
+        )
+        conn.executemany(
+            "INSERT INTO job_files (job_id, position, path, state) VALUES (?, ?, ?, 'queued')",
+            [(job_id, position, path) for position, path in enumerate(paths)]
+        )
+        conn.execute("COMMIT")
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Restituisce stato, tempi e avanzamento di ogni file di un lavoro, None se non esiste.
+        """
+        conn = self._connection()
+        job = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if job is None:
+            return None
+        files = conn.execute(
+            "SELECT * FROM job_files WHERE job_id = ? ORDER BY position", (job_id,)
+        ).fetchall()
+        result = dict(job)
+        result["elapsed"] = JobQueue._elapsed(job["started"], job["finished"])
+        result["files"] = []
+        for row in files:
+            item = dict(row)
+            del item["job_id"]
+            item["elapsed"] = JobQueue._elapsed(row["started"], row["finished"])
+            result["files"].append(item)
+        return result
+
+    @staticmethod
+    def _elapsed(started: Optional[float], finished: Optional[float]) -> Optional[float]:
+        if started is None:
+            return None
+        return (finished or time.time()) - started
+
+    def _claim(self) -> Optional[str]:
+        """
+        Rimette in coda i lavori con il lease scaduto e assegna al worker corrente
+        il lavoro in coda più vecchio.
+        """
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        expired = conn.execute(
+            "SELECT id FROM jobs WHERE state = 'running' AND (lease_until IS NULL OR lease_until < ?)", (now,)
+        ).fetchall()
+        for job in expired:
+            conn.execute("UPDATE jobs SET state = 'queued', owner = NULL WHERE id = ?", (job["id"],))
+            conn.execute(
+                "UPDATE job_files SET state = 'queued' WHERE job_id = ? AND state = 'running'", (job["id"],)
+            )
+        row = conn.execute(
+            "SELECT id FROM jobs WHERE state = 'queued' ORDER BY created LIMIT 1"
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE jobs SET state = 'running', started = COALESCE(started, ?), owner = ?, lease_until = ? "
+            "WHERE id = ?",
+            (now, self._owner, now + self._lease, row["id"])
+        )
+        conn.execute("COMMIT")
+        return row["id"]
+
+    def _owns(self, job_id: str) -> bool:
+        row = self._connection().execute(
+            "SELECT owner FROM jobs WHERE id = ? AND state = 'running'", (job_id,)
+        ).fetchone()
+        return row is not None and row["owner"] == self._owner
+
+    def _heartbeat(self) -> None:
+        """
+        Rinnova periodicamente il lease dei lavori eseguiti da questa coda.
+        """
+        while not self._stop.wait(self._lease / 3):
+            try:
+                self._connection().execute(
+                    "UPDATE jobs SET lease_until = ? WHERE owner = ? AND state = 'running'",
+                    (time.time() + self._lease, self._owner)
+                )
+            except sqlite3.Error as e:
+                print(f"Errore durante il rinnovo dei lavori in corso: {e}")
+
+    def _worker(self) -> None:
+        while not self._stop.is_set():
+            try:
+                job_id = self._claim()
+            except sqlite3.Error as e:
+                print(f"Errore durante la lettura della coda dei lavori: {e}")
+                job_id = None
+            if job_id is None:
+                self._wakeup.wait(self.POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            self._run(job_id)
+
+    def _run(self, job_id: str) -> None:
+        conn = self._connection()
+        files = conn.execute(
+            "SELECT position, path FROM job_files WHERE job_id = ? AND state = 'queued' ORDER BY position",
+            (job_id,)
+        ).fetchall()
+        job_error = None
+        for row in files:
+            # Il lease è scaduto e il lavoro è passato a un altro worker
+            if not self._owns(job_id):
+                print(f"Il lavoro {job_id} è stato assegnato a un altro worker")
+                return
+            position = row["position"]
+            conn.execute(
+                "UPDATE job_files SET state = 'running', started = ?, chunks_uploaded = 0, batches = 0 "
+                "WHERE job_id = ? AND position = ?",
+                (time.time(), job_id, position)
+            )
+
+            def progress(update: Dict[str, Any], position=position) -> None:
+                self._connection().execute(
+                    "UPDATE job_files SET chunks_uploaded = chunks_uploaded + ?, batches = batches + 1 "
+                    "WHERE job_id = ? AND position = ?",
+                    (update.get("chunks", 0), job_id, position)
+                )
+
+            try:
+                result = self._handler(row["path"], progress)
+            except Exception as e:
+                result = {"state": "error", "error": str(e)}
+            if result.get("state") == "error":
+                job_error = result.get("error") or job_error
+            conn.execute(
+                "UPDATE job_files SET state = ?, chunks_new = ?, chunks_unchanged = ?, chunks_removed = ?, "
+                "chunks_failed = ?, finished = ?, error = ? WHERE job_id = ? AND position = ?",
+                (
+                    result.get("state"), result.get("new"), result.get("unchanged"), result.get("removed"),
+                    result.get("failed"), time.time(), result.get("error"), job_id, position
+                )
+            )
+
+        done = conn.execute(
+            "UPDATE jobs SET state = 'done', finished = ?, error = ?, lease_until = NULL "
+            "WHERE id = ? AND owner = ? AND state = 'running'",
+            (time.time(), job_error, job_id, self._owner)
+        ).rowcount
+        if not done:
+            print(f"Il lavoro {job_id} è stato assegnato a un altro worker")
+            return
+        if self._on_job_done is not None:
+            try:
+                self._on_job_done(self.get(job_id)["files"])
+            except Exception as e:
+                print(f"Errore al termine del lavoro {job_id}: {e}")
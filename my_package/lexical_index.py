@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from langchain.schema import Document
+
+from my_package import metrics
+
+
+# Parole del testo: lettere, cifre e underscore (numeri di articolo compresi)
+_TERM_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+class LexicalIndex(object):
+    """
+    Indice invertito locale (SQLite FTS5) sui testi dei chunk caricati, interrogato
+    con ranking BM25. Viene aggiornato insieme all'indice vettoriale e permette di
+    trovare i chunk che contengono termini esatti (ad esempio numeri di articolo)
+    che la ricerca densa tende a perdere.
+
+    Come il Manifest, lo stesso file può ospitare più indici: ognuno ha le proprie
+    tabelle (chunks_<hash del nome>), perché le statistiche di BM25 (numero di
+    documenti e frequenza dei termini) vanno calcolate sul solo corpus dell'indice.
+    """
+
+    def __init__(self, index_name: str, db_path: str = None) -> None:
+        load_dotenv()
+        self._index_name = index_name
+        self._db_path = db_path or os.getenv("LEXICAL_INDEX_DB", "lexical_index.sqlite3")
+        self._table = "chunks_" + hashlib.sha1(index_name.encode("utf-8")).hexdigest()[:16]
+        self._fts = self._table + "_fts"
+        self._local = threading.local()
+        self._create_tables()
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Restituisce la connessione del thread corrente (le connessioni SQLite
+        non vanno condivise tra thread).
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _create_tables(self) -> None:
+        table, fts = self._table, self._fts
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "rowid INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, "
+                "source TEXT NOT NULL, metadata TEXT NOT NULL, text TEXT NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_source ON {table} (source)")
+            # Tabella FTS5 a contenuto esterno: i testi sono salvati una sola volta
+            # nella tabella dei chunk e i trigger tengono allineato l'indice invertito
+            conn.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                f"text, content='{table}', content_rowid='rowid', "
+                "tokenize='unicode61 remove_diacritics 2')"
+            )
+            conn.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON {table} BEGIN "
+                f"INSERT INTO {fts} (rowid, text) VALUES (new.rowid, new.text); END"
+            )
+            conn.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON {table} BEGIN "
+                f"INSERT INTO {fts} ({fts}, rowid, text) VALUES ('delete', old.rowid, old.text); END"
+            )
+            # Database creati quando tutti gli indici condividevano la tabella chunks
+            legacy = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chunks'"
+            ).fetchone()
+            if legacy:
+                conn.execute(
+                    f"INSERT OR IGNORE INTO {table} (id, source, metadata, text) "
+                    "SELECT id, source, metadata, text FROM chunks WHERE index_name = ? ORDER BY rowid",
+                    (self._index_name,)
+                )
+                conn.execute("DELETE FROM chunks WHERE index_name = ?", (self._index_name,))
+
+    def add(self, items: Iterable[Tuple[str, str, Dict[str, Any]]], source: str) -> None:
+        """
+        Indicizza dei chunk. I chunk già presenti (stesso id) vengono ignorati.
+
+        Parameters:
+        - items (Iterable[Tuple[str, str, Dict]]): Tuple (id, testo, metadata).
+        - source (str): Sorgente dei chunk.
+        """
+        rows = [
+            (vec_id, source, json.dumps(metadata), text)
+            for vec_id, text, metadata in items
+        ]
+        if not rows:
+            return
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                f"INSERT OR IGNORE INTO {self._table} (id, source, metadata, text) VALUES (?, ?, ?, ?)",
+                rows
+            )
+
+    def remove(self, ids: List[str]) -> None:
+        conn = self._connection()
+        with conn:
+            conn.executemany(f"DELETE FROM {self._table} WHERE id = ?", [(vec_id,) for vec_id in ids])
+
+    def remove_sources(self, sources: List[str]) -> None:
+        conn = self._connection()
+        with conn:
+            conn.executemany(f"DELETE FROM {self._table} WHERE source = ?", [(source,) for source in sources])
+
+    def clear(self) -> None:
+        conn = self._connection()
+        with conn:
+            conn.execute(f"DELETE FROM {self._table}")
+
+    def count(self) -> int:
+        return self._connection().execute(f"SELECT COUNT(*) FROM {self._table}").fetchone()[0]
+
+    @staticmethod
+    def _match_query(query: str) -> str:
+        """
+        Trasforma la domanda in una query FTS5: ogni parola è quotata (così la
+        punteggiatura non viene interpretata come sintassi) e basta che ne compaia una.
+        """
+        terms = dict.fromkeys(term.lower() for term in _TERM_PATTERN.findall(query))
+        return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+    def search(self, query: str, k: int = 4, sources: Optional[List[str]] = None) -> List[Tuple[Document, float]]:
+        """
+        Cerca i chunk più rilevanti per la domanda secondo BM25.
+
+        Parameters:
+        - query (str): Domanda in linguaggio naturale.
+        - k (int): Numero massimo di risultati.
+        - sources (List[str], optional): Se indicato, cerca solo tra i chunk di queste sorgenti.
+
+        Returns:
+        - List[Tuple[Document, float]]: Documenti e punteggio BM25 (più alto è migliore).
+        """
+        match = LexicalIndex._match_query(query)
+        if not match:
+            return []
+        table, fts = self._table, self._fts
+        params = [match]
+        source_filter = ""
+        if sources is not None:
+            source_filter = f" AND {table}.source IN ({', '.join('?' for _ in sources)})"
+            params.extend(sources)
+        params.append(k)
+        # FTS5 restituisce bm25() negativo: valori più bassi indicano chunk più rilevanti
+        with metrics.timed("lexical_query"):
+            rows = self._connection().execute(
+                f"SELECT {table}.id, {table}.source, {table}.metadata, {table}.text, bm25({fts}) AS rank "
+                f"FROM {fts} JOIN {table} ON {table}.rowid = {fts}.rowid "
+                f"WHERE {fts} MATCH ?{source_filter} ORDER BY rank LIMIT ?",
+                params
+            ).fetchall()
+        docs = []
+        for vec_id, source, metadata, text, rank in rows:
+            metadata = json.loads(metadata)
+            metadata["source"] = source
+            docs.append((Document(page_content=text, metadata=metadata), -rank))
+        return docs
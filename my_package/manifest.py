@@ -0,0 +1,286 @@
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+
+class Manifest(object):
+    """
+    Registro locale persistente (SQLite) che associa ogni vettore caricato alla
+    propria sorgente. Permette di elencare le sorgenti e di risolvere gli id di
+    una sorgente con una ricerca indicizzata, senza interrogare l'indice remoto.
+
+    Lo stesso file può ospitare più indici: ogni riga è legata al nome dell'indice.
+    """
+
+    def __init__(self, index_name: str, db_path: str = None) -> None:
+        load_dotenv()
+        self._index_name = index_name
+        self._db_path = db_path or os.getenv("MANIFEST_DB", "manifest.sqlite3")
+        self._local = threading.local()
+        self._create_tables()
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Restituisce la connessione del thread corrente (le connessioni SQLite
+        non vanno condivise tra thread).
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _create_tables(self) -> None:
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS vectors ("
+                "index_name TEXT NOT NULL, id TEXT NOT NULL, source TEXT NOT NULL, "
+                "PRIMARY KEY (index_name, id))"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS vectors_source ON vectors (index_name, source)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "index_name TEXT NOT NULL, path TEXT NOT NULL, source TEXT NOT NULL, "
+                "size INTEGER NOT NULL, mtime REAL NOT NULL, sha256 TEXT NOT NULL, "
+                "PRIMARY KEY (index_name, path))"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS files_source ON files (index_name, source)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS corpus_versions ("
+                "index_name TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS indexes ("
+                "index_name TEXT PRIMARY KEY, reconciled INTEGER NOT NULL DEFAULT 0)"
+            )
+
+    def is_initialized(self) -> bool:
+        """
+        Restituisce True se il manifest è già stato allineato con l'indice remoto
+        almeno una volta (o se l'indice è stato creato da questa applicazione).
+        """
+        row = self._connection().execute(
+            "SELECT reconciled FROM indexes WHERE index_name = ?", (self._index_name,)
+        ).fetchone()
+        return bool(row and row[0])
+
+    def _mark_initialized(self, conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "INSERT OR REPLACE INTO indexes (index_name, reconciled) VALUES (?, 1)",
+            (self._index_name,)
+        )
+
+    def get_version(self) -> int:
+        """
+        Restituisce la versione del corpus, incrementata ad ogni modifica dei dati
+        caricati; permette alle cache di accorgersi dei cambiamenti, anche se fatti
+        da un altro processo.
+        """
+        row = self._connection().execute(
+            "SELECT version FROM corpus_versions WHERE index_name = ?", (self._index_name,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def bump_version(self) -> None:
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO corpus_versions (index_name, version) VALUES (?, 1) "
+                "ON CONFLICT (index_name) DO UPDATE SET version = version + 1",
+                (self._index_name,)
+            )
+
+    def add(self, ids: List[str], source: str) -> None:
+        """
+        Registra gli id caricati per una sorgente.
+        """
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO vectors (index_name, id, source) VALUES (?, ?, ?)",
+                [(self._index_name, vec_id, source) for vec_id in ids]
+            )
+
+    def remove(self, ids: List[str]) -> None:
+        """
+        Rimuove dal manifest gli id indicati.
+        """
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "DELETE FROM vectors WHERE index_name = ? AND id = ?",
+                [(self._index_name, vec_id) for vec_id in ids]
+            )
+
+    def get_ids(self, source: str) -> List[str]:
+        """
+        Restituisce gli id dei vettori di una sorgente.
+        """
+        rows = self._connection().execute(
+            "SELECT id FROM vectors WHERE index_name = ? AND source = ?",
+            (self._index_name, source)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    # Parametri per singola query con IN (...), entro i limiti di SQLite
+    _IN_CHUNK = 500
+
+    def get_ids_by_source(self, sources: List[str]) -> Dict[str, List[str]]:
+        """
+        Restituisce in un solo passaggio gli id dei vettori di più sorgenti.
+
+        Returns:
+        - Dict[str, List[str]]: Id per ogni sorgente richiesta (lista vuota se la sorgente non è registrata).
+        """
+        sources = list(dict.fromkeys(sources))
+        ids_by_source = {source: [] for source in sources}
+        conn = self._connection()
+        for offset in range(0, len(sources), self._IN_CHUNK):
+            chunk = sources[offset:offset + self._IN_CHUNK]
+            rows = conn.execute(
+                f"SELECT source, id FROM vectors WHERE index_name = ? AND source IN ({', '.join('?' for _ in chunk)})",
+                [self._index_name, *chunk]
+            )
+            for source, vec_id in rows:
+                ids_by_source[source].append(vec_id)
+        return ids_by_source
+
+    def count_by_source(self) -> Dict[str, int]:
+        rows = self._connection().execute(
+            "SELECT source, COUNT(*) FROM vectors WHERE index_name = ? GROUP BY source",
+            (self._index_name,)
+        ).fetchall()
+        return dict(rows)
+
+    def remove_sources(self, sources: List[str]) -> None:
+        """
+        Rimuove dal manifest tutti i vettori e le impronte dei file delle sorgenti indicate.
+        """
+        sources = list(sources)
+        conn = self._connection()
+        with conn:
+            for offset in range(0, len(sources), self._IN_CHUNK):
+                chunk = sources[offset:offset + self._IN_CHUNK]
+                placeholders = ", ".join("?" for _ in chunk)
+                conn.execute(
+                    f"DELETE FROM vectors WHERE index_name = ? AND source IN ({placeholders})",
+                    [self._index_name, *chunk]
+                )
+                conn.execute(
+                    f"DELETE FROM files WHERE index_name = ? AND source IN ({placeholders})",
+                    [self._index_name, *chunk]
+                )
+
+    def list_sources(self) -> List[str]:
+        """
+        Restituisce le sorgenti distinte registrate.
+        """
+        rows = self._connection().execute(
+            "SELECT DISTINCT source FROM vectors WHERE index_name = ? ORDER BY source",
+            (self._index_name,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self) -> int:
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM vectors WHERE index_name = ?", (self._index_name,)
+        ).fetchone()[0]
+
+    def get_file(self, path: str) -> Optional[Dict[str, Any]]:
+        """
+        Restituisce l'impronta (sorgente, dimensione, data di modifica e hash) registrata
+        per un file al suo ultimo caricamento, None se il file non è mai stato caricato.
+        """
+        row = self._connection().execute(
+            "SELECT source, size, mtime, sha256 FROM files WHERE index_name = ? AND path = ?",
+            (self._index_name, path)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"source": row[0], "size": row[1], "mtime": row[2], "sha256": row[3]}
+
+    def set_file(self, path: str, source: str, size: int, mtime: float, sha256: str) -> None:
+        """
+        Registra l'impronta di un file caricato con successo.
+        """
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO files (index_name, path, source, size, mtime, sha256) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (self._index_name, path, source, size, mtime, sha256)
+            )
+
+    def get_paths(self, source: str) -> List[str]:
+        """
+        Restituisce i percorsi dei file registrati con la sorgente indicata.
+        """
+        rows = self._connection().execute(
+            "SELECT path FROM files WHERE index_name = ? AND source = ? ORDER BY path",
+            (self._index_name, source)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def remove_file(self, path: str) -> None:
+        """
+        Dimentica l'impronta di un singolo file.
+        """
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "DELETE FROM files WHERE index_name = ? AND path = ?", (self._index_name, path)
+            )
+
+    def remove_files(self, source: str) -> None:
+        """
+        Dimentica le impronte dei file di una sorgente, così che vengano ricaricati.
+        """
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "DELETE FROM files WHERE index_name = ? AND source = ?", (self._index_name, source)
+            )
+
+    def clear(self) -> None:
+        """
+        Svuota il manifest dell'indice, ad esempio quando l'indice viene creato o eliminato.
+        """
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM vectors WHERE index_name = ?", (self._index_name,))
+            conn.execute("DELETE FROM files WHERE index_name = ?", (self._index_name,))
+            self._mark_initialized(conn)
+        self.bump_version()
+
+    def replace_all(self, ids_and_source: List[Dict[str, str]]) -> int:
+        """
+        Ricostruisce il manifest a partire dal contenuto dell'indice remoto.
+
+        Parameters:
+        - ids_and_source (List[Dict[str, str]]): Dizionari con i campi 'id' e 'source'.
+
+        Returns:
+        - int: Numero di vettori registrati.
+        """
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM vectors WHERE index_name = ?", (self._index_name,))
+            # Le impronte dei file non sono più affidabili: al prossimo caricamento vengono ricalcolate
+            conn.execute("DELETE FROM files WHERE index_name = ?", (self._index_name,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO vectors (index_name, id, source) VALUES (?, ?, ?)",
+                [(self._index_name, item["id"], str(item["source"])) for item in ids_and_source]
+            )
+            self._mark_initialized(conn)
+        self.bump_version()
+        return self.count()
@@ -0,0 +1,96 @@
+import atexit
+import queue
+import threading
+import time
+from typing import List
+
+from my_package.vectorstore import Vectorstore
+
+
+class ChatMemoryWriter(object):
+    """
+    Scrive in background le domande della chat sul Vectorstore, così che la
+    risposta all'utente non attenda embedding e caricamento.
+
+    Le domande vengono accumulate e caricate insieme quando sono almeno batch_size
+    oppure quando la più vecchia attende da flush_interval secondi; alla chiusura
+    del processo viene caricato quanto rimasto in coda.
+    """
+
+    def __init__(self, vectorstore: Vectorstore, source: str = "chat_memory", batch_size: int = 20, flush_interval: float = 5.0) -> None:
+        self._vectorstore = vectorstore
+        self._source = source
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()  # Nessun elemento entra in coda dopo la chiusura
+        self._thread = threading.Thread(target=self._run, name="chat-memory-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, text: str) -> None:
+        """
+        Mette in coda un testo da memorizzare; ritorna subito.
+        """
+        with self._lock:
+            if not self._closed:
+                self._queue.put(text)
+
+    def flush(self) -> None:
+        """
+        Attende che tutti i testi in coda siano stati scritti. Dopo close ritorna
+        subito: quanto era in coda è già stato scritto.
+        """
+        done = threading.Event()
+        with self._lock:
+            if self._closed:
+                return
+            self._queue.put(done)
+        done.wait()
+
+    def close(self) -> None:
+        """
+        Scrive quanto rimasto in coda e ferma il thread.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+    def _write(self, batch: List[str]) -> None:
+        if not batch:
+            return
+        try:
+            if not self._vectorstore.upload_data(batch, self._source, prune=False, bump_version=False):
+                print(f"Non è stato possibile salvare {len(batch)} messaggi nella memoria della chat")
+        except Exception as e:
+            print(f"Errore durante il salvataggio della memoria della chat: {e}")
+
+    def _run(self) -> None:
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False  # Scaduto l'intervallo di flush
+
+            if item is None or item is False or isinstance(item, threading.Event):
+                self._write(batch)
+                batch, deadline = [], None
+                if isinstance(item, threading.Event):
+                    item.set()
+                if item is None:
+                    return
+                continue
+
+            batch.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + self._flush_interval
+            if len(batch) >= self._batch_size:
+                self._write(batch)
+                batch, deadline = [], None
@@ -0,0 +1,267 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+# Prefisso di tutte le metriche esposte
+PREFIX = "pdf_chatbot_"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Tempi per fase e altre statistiche della richiesta in corso (None se non vengono raccolti)
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+_request_stats = contextvars.ContextVar("request_stats", default=None)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    """
+    Contatore monotono, eventualmente suddiviso per etichette.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> None:
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Histogram(object):
+    """
+    Istogramma cumulativo in stile Prometheus (bucket, somma e conteggio), eventualmente
+    suddiviso per etichette.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}  # etichette -> [conteggi per bucket, somma, conteggio]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [[0] * len(self.buckets), 0.0, 0]
+                self._series[key] = series
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][position] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        lines = []
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry(object):
+    """
+    Insieme delle metriche del processo, esportabile nel formato testuale di Prometheus.
+    Ogni processo (ad esempio ogni worker di gunicorn) ha il proprio registro.
+    """
+
+    def __init__(self) -> None:
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "stage_duration_seconds",
+    "Durata delle fasi di caricamento e chat.",
+    ("stage",)
+))
+ITEMS = REGISTRY.register(Counter(
+    "items_total",
+    "Elementi elaborati: pagine, chunk, vettori embeddati e caricati.",
+    ("kind",)
+))
+TOKENS = REGISTRY.register(Counter(
+    "llm_tokens_total",
+    "Token inviati all'LLM (prompt) e generati (completion).",
+    ("type",)
+))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "cache_requests_total",
+    "Richieste alle cache, per cache ed esito (hit o miss).",
+    ("cache", "result")
+))
+ERRORS = REGISTRY.register(Counter(
+    "errors_total",
+    "Errori per fase.",
+    ("stage",)
+))
+CONTEXT_TOKENS_SAVED = REGISTRY.register(Histogram(
+    "context_tokens_saved",
+    "Token del contesto risparmiati per domanda dall'assemblaggio (deduplicazione, unione e taglio).",
+    buckets=(0, 50, 100, 250, 500, 1000, 2000, 4000, 8000)
+))
+
+
+def observe(stage: str, seconds: float) -> None:
+    """
+    Registra la durata di una fase nell'istogramma e, se attivo, nel dettaglio
+    dei tempi della richiesta corrente.
+    """
+    STAGE_DURATION.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """
+    Misura la durata del blocco come fase stage; un'eccezione incrementa anche
+    il contatore degli errori della fase.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(stage=stage)
+        raise
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def count(kind: str, amount: float = 1) -> None:
+    ITEMS.inc(amount, kind=kind)
+
+
+def count_tokens(token_type: str, amount: float) -> None:
+    TOKENS.inc(amount, type=token_type)
+
+
+def cache_result(cache: str, hit: bool, amount: int = 1) -> None:
+    if amount:
+        CACHE_REQUESTS.inc(amount, cache=cache, result="hit" if hit else "miss")
+
+
+def error(stage: str) -> None:
+    ERRORS.inc(stage=stage)
+
+
+@contextmanager
+def request_timings() -> Iterator[Dict[str, float]]:
+    """
+    Raccoglie i tempi di tutte le fasi eseguite nel blocco (anche nei thread avviati
+    con il contesto corrente). Il dizionario restituito contiene i secondi per fase.
+    """
+    timings = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def record(name: str, value: float) -> None:
+    """
+    Somma value alla statistica name della richiesta corrente, se vengono raccolte.
+    """
+    stats = _request_stats.get()
+    if stats is not None:
+        stats[name] = stats.get(name, 0) + value
+
+
+@contextmanager
+def request_stats() -> Iterator[Dict[str, float]]:
+    """
+    Come request_timings, per le statistiche registrate con record.
+    """
+    stats = {}
+    token = _request_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _request_stats.reset(token)
+
+
+def format_timings(timings: Optional[Dict[str, float]]) -> Dict[str, float]:
+    """
+    Converte i tempi in millisecondi arrotondati, per allegarli alle risposte.
+    """
+    return {stage: round(seconds * 1000, 2) for stage, seconds in (timings or {}).items()}
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -1,69 +1,400 @@
+import multiprocessing
 import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Iterator, List, Optional, Tuple
 import PyPDF2
-from langchain.text_splitter import CharacterTextSplitter
+from langchain.schema import Document
 from dotenv import load_dotenv
 
+from my_package import metrics
+from my_package.tokens import get_encoding
+
+
+# Pool di processi condivisi, uno per numero di worker: più file elaborati in
+# parallelo non moltiplicano i processi di estrazione
+_process_pools = {}
+_process_pools_lock = threading.Lock()
+
+
+def _get_process_pool(workers: int) -> ProcessPoolExecutor:
+    with _process_pools_lock:
+        pool = _process_pools.get(workers)
+        if pool is None:
+            # Il processo (Flask o worker dei lavori) ha più thread: con fork i figli
+            # potrebbero ereditare lock acquisiti da altri thread, quindi si usa spawn
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _process_pools[workers] = pool
+        return pool
+
+
+# Funzioni di lunghezza selezionabili con PDF_LENGTH_FUNCTION (modalità a caratteri):
+# "len" conta i caratteri, "tokens" i token dell'encoding PDF_TOKENIZER
+_LENGTH_FUNCTIONS = {
+    "len": lambda: len,
+    "tokens": lambda: TokenLength(os.getenv("PDF_TOKENIZER", "cl100k_base")),
+}
+
+# Limite di token in ingresso dei modelli di embedding di OpenAI
+EMBEDDING_MAX_TOKENS = 8191
+
+
+class TokenLength(object):
+    """
+    Conta i token di un testo con un encoding tiktoken, caricato una sola volta per
+    processo (vedi tokens.get_encoding). Si usa come length_function degli splitter.
+    """
+
+    def __init__(self, encoding: str = "cl100k_base") -> None:
+        self.encoding = get_encoding(encoding)
+
+    def __call__(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def split(self, text: str, size: int) -> List[str]:
+        """
+        Divide il testo in pezzi di al più size token, tagliando ai confini dei token.
+        """
+        tokens = self.encoding.encode(text, disallowed_special=())
+        return [self.encoding.decode(tokens[start:start + size]) for start in range(0, len(tokens), size)]
+
+
+class PageExtractionError(Exception):
+    """
+    Sollevata da Pdf2Chunks.iterChunks, dopo l'ultimo chunk, se il testo di alcune
+    pagine non è stato estratto: il documento non è stato letto per intero.
+    """
+
+    def __init__(self, pdf_path: str, pages: List["PageText"]) -> None:
+        self.pdf_path = pdf_path
+        self.pages = pages
+        numbers = ", ".join(str(page.page + 1) for page in pages)
+        super().__init__(f"Testo non estratto dalle pagine {numbers} di {pdf_path}")
+
 
 class Pdf2Chunks(object):
 
+    @staticmethod
+    def getSplitter() -> "StreamingTextSplitter":
+        """
+        Crea lo splitter configurato dalle variabili d'ambiente.
+
+        Con PDF_SPLITTER=character (predefinito) i chunk sono misurati con
+        PDF_LENGTH_FUNCTION ("len" o "tokens") e dimensionati da PDF_CHUNK_SIZE e
+        PDF_CHUNK_OVERLAP.
+        Con PDF_SPLITTER=token sono misurati in token dell'encoding PDF_TOKENIZER
+        (nome di un encoding o di un modello, predefinito cl100k_base) e dimensionati
+        da PDF_CHUNK_TOKENS e PDF_CHUNK_OVERLAP_TOKENS: nessun chunk supera
+        PDF_CHUNK_TOKENS, quindi RETRIEVAL_TOP_K chunk occupano al più
+        RETRIEVAL_TOP_K * PDF_CHUNK_TOKENS token del prompt.
+
+        Returns:
+        - StreamingTextSplitter: Lo splitter, da usare per un solo documento.
+        """
+        load_dotenv()
+        separator = os.getenv("PDF_SEPARATOR", "\n")
+        mode = os.getenv("PDF_SPLITTER", "character").lower()
+        if mode == "token":
+            chunk_size = int(os.getenv("PDF_CHUNK_TOKENS", 256))
+            if chunk_size > EMBEDDING_MAX_TOKENS:
+                print(f"PDF_CHUNK_TOKENS supera il limite del modello di embedding, uso {EMBEDDING_MAX_TOKENS}")
+                chunk_size = EMBEDDING_MAX_TOKENS
+            return TokenTextSplitter(
+                separator=separator,
+                chunk_size=chunk_size,
+                chunk_overlap=int(os.getenv("PDF_CHUNK_OVERLAP_TOKENS", 32)),
+                encoding=os.getenv("PDF_TOKENIZER", "cl100k_base")
+            )
+        if mode != "character":
+            print(f"PDF_SPLITTER non valido: {mode}, uso la suddivisione a caratteri")
+        length_function = os.getenv("PDF_LENGTH_FUNCTION", "len").lower()
+        if length_function not in _LENGTH_FUNCTIONS:
+            raise ValueError(
+                f"PDF_LENGTH_FUNCTION non valido: {length_function} "
+                f"(valori ammessi: {', '.join(_LENGTH_FUNCTIONS)})"
+            )
+        return StreamingTextSplitter(
+            separator=separator,
+            chunk_size=int(os.getenv("PDF_CHUNK_SIZE", 1000)),
+            chunk_overlap=int(os.getenv("PDF_CHUNK_OVERLAP", 200)),
+            length_function=_LENGTH_FUNCTIONS[length_function]()
+        )
+
     @staticmethod
     def getText(url: str) -> str:
         p = PDFTextExtractor(url)
         return p.extract_text()
 
     @staticmethod
-    def getChunks(url: str) -> str:
+    def getChunks(url: str) -> List[str]:
         """
         Estrae e restituisce il testo suddiviso in chunk da un documento PDF.
+        Separatore, dimensione e sovrapposizione dei chunk sono quelli di getSplitter.
 
         Parameters:
         - url (str): L'URL del documento PDF.
-        - separator (str, optional): Il separatore utilizzato per dividere il testo in chunk (predefinito: "\n").
-        - chunk_size (int, optional): La dimensione dei chunk (predefinito: 1000).
-        - chunk_overlap (int, optional): La sovrapposizione tra i chunk (predefinito: 200).
-        - length_function (callable, optional): Una funzione che calcola la lunghezza del testo (predefinito: len).
 
         Returns:
-        - chunks (str): Il testo suddiviso in chunk.
+        - chunks (List[str]): Il testo suddiviso in chunk.
         """
-        
-        load_dotenv()
-        pdf_separator = os.getenv("PDF_SEPARATOR", "\n")
-        pdf_chunk_size = int(os.getenv("PDF_CHUNK_SIZE", 1000))
-        pdf_chunk_overlap = int(os.getenv("PDF_CHUNK_OVERLAP", 200))
-        pdf_length_function = os.getenv("PDF_LENGTH_FUNCTION", "len")
-        
-        text_splitter = CharacterTextSplitter(
-            separator=pdf_separator,
-            chunk_size=pdf_chunk_size,
-            chunk_overlap=pdf_chunk_overlap,
-            length_function=pdf_length_function
-        )
-        chunks = text_splitter.split_text(Pdf2Chunks.getText(url))
-        return chunks
+        text_splitter = Pdf2Chunks.getSplitter()
+        chunks = list(text_splitter.feed(Pdf2Chunks.getText(url), 1))
+        chunks.extend(text_splitter.flush())
+        return [chunk.page_content for chunk in chunks]
+
+    @staticmethod
+    def iterChunks(url: str) -> Iterator[Document]:
+        """
+        Versione in streaming di getChunks: i chunk vengono prodotti man mano che le
+        pagine sono estratte, così embedding e caricamento possono partire dalle prime
+        pagine mentre le successive sono ancora in elaborazione, con memoria limitata.
+
+        La sovrapposizione tra chunk prosegue anche a cavallo tra due pagine. Ogni
+        chunk riporta nei metadata le pagine (numerate da 1) da cui proviene.
+
+        Parameters:
+        - url (str): L'URL del documento PDF.
+
+        Returns:
+        - Iterator[Document]: I chunk, con metadata 'page_start' e 'page_end'.
+
+        Raises:
+        - PageExtractionError: Dopo l'ultimo chunk, se alcune pagine non sono state estratte.
+        """
+        text_splitter = Pdf2Chunks.getSplitter()
+        # I tempi di estrazione e suddivisione sono sommati pagina per pagina e registrati
+        # una volta per file, anche se chi consuma i chunk si interrompe prima della fine
+        parse_time = split_time = 0.0
+        extractor = PDFTextExtractor(url)
+        pages = extractor.iter_pages()
+        try:
+            while True:
+                start = time.perf_counter()
+                page = next(pages, None)
+                parse_time += time.perf_counter() - start
+                if page is None:
+                    break
+                metrics.count("pdf_pages")
+                start = time.perf_counter()
+                chunks = list(text_splitter.feed(page.text, page.page + 1))
+                split_time += time.perf_counter() - start
+                metrics.count("chunks", len(chunks))
+                yield from chunks
+            chunks = list(text_splitter.flush())
+            metrics.count("chunks", len(chunks))
+            yield from chunks
+            if extractor.failed_pages:
+                raise PageExtractionError(url, extractor.failed_pages)
+        finally:
+            metrics.observe("pdf_parse", parse_time)
+            metrics.observe("pdf_split", split_time)
+
+
+class StreamingTextSplitter(object):
+    """
+    Splitter incrementale con la stessa logica di unione di CharacterTextSplitter:
+    il testo arriva a pezzi (una pagina alla volta) e i chunk completi vengono
+    restituiti subito, tenendo in memoria solo la parte necessaria alla sovrapposizione.
+    """
 
+    def __init__(self, separator: str, chunk_size: int, chunk_overlap: int, length_function: Callable[[str], int] = len):
+        self._separator = separator
+        self._chunk_size = chunk_size
+        self._chunk_overlap = chunk_overlap
+        self._length_function = length_function
+        self._separator_len = length_function(separator)
+        # Terne (testo, pagina, lunghezza) del chunk in costruzione: la lunghezza viene
+        # calcolata una sola volta per pezzo, anche se resta nella sovrapposizione
+        self._current = []
+        self._total = 0
+
+    def _pieces(self, text: str) -> List[Tuple[str, int]]:
+        splits = text.split(self._separator) if self._separator else list(text)
+        return [(piece, self._length_function(piece)) for piece in splits]
+
+    def _join(self) -> Optional[Document]:
+        text = self._separator.join(piece for piece, _, _ in self._current).strip()
+        if not text:
+            return None
+        pages = [page for _, page, _ in self._current]
+        return Document(page_content=text, metadata={"page_start": min(pages), "page_end": max(pages)})
+
+    def _emit(self) -> Iterator[Document]:
+        doc = self._join()
+        if doc is not None:
+            yield doc
+
+    def feed(self, text: str, page: int) -> Iterator[Document]:
+        """
+        Aggiunge il testo di una pagina e restituisce i chunk completati.
+        """
+        for piece, length in self._pieces(text):
+            separator_len = self._separator_len if self._current else 0
+            if self._total + length + separator_len > self._chunk_size and self._current:
+                yield from self._emit()
+                # Mantiene in coda solo quanto serve per la sovrapposizione
+                while self._total > self._chunk_overlap or (
+                    self._total + length + (self._separator_len if self._current else 0) > self._chunk_size
+                    and self._total > 0
+                ):
+                    _, _, first_length = self._current.pop(0)
+                    self._total -= first_length + (self._separator_len if self._current else 0)
+            self._current.append((piece, page, length))
+            self._total += length + (self._separator_len if len(self._current) > 1 else 0)
+
+    def flush(self) -> Iterator[Document]:
+        """
+        Restituisce l'ultimo chunk ancora in costruzione.
+        """
+        if self._current:
+            yield from self._emit()
+        self._current = []
+        self._total = 0
+
+
+class TokenTextSplitter(StreamingTextSplitter):
+    """
+    StreamingTextSplitter che misura i chunk in token di un encoding tiktoken.
+
+    A differenza della versione a caratteri, chunk_size è un limite rigido: i pezzi
+    più lunghi di un chunk (ad esempio paragrafi senza separatore) vengono divisi ai
+    confini dei token e ogni chunk viene ricontato prima di essere restituito, perché
+    unendo i pezzi il numero di token può cambiare.
+    """
+
+    def __init__(self, separator: str, chunk_size: int, chunk_overlap: int, encoding: str = "cl100k_base"):
+        self._tokens = TokenLength(encoding)
+        super().__init__(separator, chunk_size, chunk_overlap, self._tokens)
+
+    def _pieces(self, text: str) -> List[Tuple[str, int]]:
+        pieces = []
+        for piece, length in super()._pieces(text):
+            if length <= self._chunk_size:
+                pieces.append((piece, length))
+            else:
+                pieces.extend((part, self._tokens(part)) for part in self._tokens.split(piece, self._chunk_size))
+        return pieces
+
+    def _emit(self) -> Iterator[Document]:
+        doc = self._join()
+        if doc is None:
+            return
+        if self._tokens(doc.page_content) <= self._chunk_size:
+            yield doc
+            return
+        for part in self._tokens.split(doc.page_content, self._chunk_size):
+            yield Document(page_content=part, metadata=dict(doc.metadata))
+
+
+
+@dataclass
+class PageText:
+    """
+    Testo estratto da una pagina del PDF (numerata da 0), con l'eventuale errore.
+    """
+    page: int
+    text: str = ""
+    error: Optional[str] = None
+
+
+def _extract_page_range(pdf_path: str, start: int, end: int) -> List[PageText]:
+    """
+    Estrae il testo delle pagine [start, end). È una funzione di modulo perché
+    viene eseguita nei processi del pool: ogni processo apre il file per conto proprio.
+    """
+    pages = []
+    with open(pdf_path, "rb") as pdf_file:
+        pdf_reader = PyPDF2.PdfReader(pdf_file)
+        for number in range(start, end):
+            try:
+                pages.append(PageText(number, pdf_reader.pages[number].extract_text() or ""))
+            except Exception as e:
+                pages.append(PageText(number, error=str(e)))
+    return pages
 
 
 class PDFTextExtractor(object):
-    def __init__(self, pdf_path):
+    def __init__(self, pdf_path, workers: int = None):
+        """
+        Parameters:
+        - pdf_path (str): Percorso del PDF.
+        - workers (int, optional): Numero di processi usati per l'estrazione
+          (predefinito: PDF_EXTRACT_WORKERS oppure il numero di CPU).
+        """
+        load_dotenv()
         self.pdf_path = pdf_path
+        self.workers = workers or int(os.getenv("PDF_EXTRACT_WORKERS", os.cpu_count() or 1))
+        self.parallel_min_pages = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 32))
+        self.failed_pages = []
 
-    def extract_text(self):
-        text = ""
-        try:
-            # Apre il file PDF in modalità di lettura binaria
-            with open(self.pdf_path, "rb") as pdf_file:
-                # Crea un oggetto PdfFileReader
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
+    def _page_ranges(self, num_pages: int) -> List[Tuple[int, int]]:
+        # Più intervalli che processi, così le pagine lente non bloccano un solo worker
+        size = max(1, -(-num_pages // (self.workers * 4)))
+        return [(start, min(start + size, num_pages)) for start in range(0, num_pages, size)]
+
+    def iter_pages(self) -> Iterator[PageText]:
+        """
+        Estrae il testo pagina per pagina, restituendo le pagine in ordine man mano
+        che sono pronte. I documenti con almeno PDF_PARALLEL_MIN_PAGES pagine vengono
+        suddivisi in intervalli ed elaborati da un pool di processi condiviso, con al
+        più due intervalli in coda per processo.
+
+        Returns:
+        - Iterator[PageText]: Le pagine in ordine, con l'errore per quelle non estratte.
+        """
+        self.failed_pages = []
+        with open(self.pdf_path, "rb") as pdf_file:
+            num_pages = len(PyPDF2.PdfReader(pdf_file).pages)
+
+        if self.workers <= 1 or num_pages < self.parallel_min_pages:
+            batches = iter([_extract_page_range(self.pdf_path, 0, num_pages)])
+            yield from self._report(batches)
+            return
+
+        ranges = self._page_ranges(num_pages)
+        executor = _get_process_pool(self.workers)
+        pending = []
 
-                # Itera tra le pagine del PDF
-                for page in pdf_reader.pages:
-                    text += page.extract_text()
+        def batches():
+            try:
+                for start, end in ranges:
+                    pending.append(executor.submit(_extract_page_range, self.pdf_path, start, end))
+                    if len(pending) >= self.workers * 2:
+                        yield pending.pop(0).result()
+                while pending:
+                    yield pending.pop(0).result()
+            finally:
+                for future in pending:
+                    future.cancel()
 
+        yield from self._report(batches())
+
+    def _report(self, batches: Iterator[List[PageText]]) -> Iterator[PageText]:
+        for pages in batches:
+            for page in pages:
+                if page.error is not None:
+                    self.failed_pages.append(page)
+                    print(f"Errore durante l'estrazione del testo della pagina {page.page + 1}: {page.error}")
+                yield page
+
+    def extract_pages(self) -> List[PageText]:
+        """
+        Estrae il testo di tutte le pagine.
+
+        Returns:
+        - List[PageText]: Le pagine in ordine, con l'errore per quelle non estratte.
+        """
+        return list(self.iter_pages())
+
+    def extract_text(self):
+        try:
+            pages = self.extract_pages()
         except Exception as e:
-            # Gestisce eventuali errori durante l'estrazione del testo
+            # Gestisce eventuali errori durante l'apertura del file
             print(f"Errore durante l'estrazione del testo: {str(e)}")
             print("Assicurarsi di aver caricato un PDF")
+            return ""
 
-        return text
-
+        return "".join(page.text for page in pages)
@@ -0,0 +1,6 @@
+import contextvars
+
+
+# Sorgenti a cui limitare la ricerca nella richiesta in corso (None = tutte): viene
+# impostata dal Chatbot prima di ogni chiamata alla catena e letta dai retriever
+current_sources = contextvars.ContextVar("current_sources", default=None)
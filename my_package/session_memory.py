@@ -0,0 +1,200 @@
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain.schema import BaseMemory
+
+from my_package.tokens import count_tokens, get_encoding
+
+
+# Sessione della richiesta in corso: viene impostata dal Chatbot prima di ogni
+# chiamata alla catena e letta dalla memoria
+current_session = contextvars.ContextVar("current_session", default="default")
+
+
+class _Session(object):
+    def __init__(self) -> None:
+        self.summary = ""
+        self.turns = []  # Coppie (domanda, risposta)
+        self.pending = []  # Scambi usciti dalla finestra, in attesa di entrare nel riassunto
+        self.tokens = 0
+        self.last_access = time.time()
+        self.lock = threading.Lock()
+
+
+class SessionStore(object):
+    """
+    Conversazioni dei singoli utenti, indicizzate per id di sessione.
+
+    Ogni sessione tiene gli ultimi scambi entro un budget di token (misurati con
+    tiktoken). Quando il budget viene superato gli scambi più vecchi escono dalla
+    finestra e vengono riassunti da summarizer in un riassunto progressivo, a sua
+    volta limitato a summary_tokens; senza summarizer vengono semplicemente scartati.
+    Le sessioni inattive da più di ttl secondi, o oltre max_sessions, vengono eliminate.
+
+    Il riassunto è una chiamata all'LLM: viene eseguito da un thread in background,
+    così la risposta all'utente non la attende. Finché non è pronto, gli scambi
+    usciti dalla finestra restano nella cronologia così come sono.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 1000,
+        summary_tokens: int = 300,
+        ttl: float = 1800,
+        max_sessions: int = 1000,
+        encoding: str = "cl100k_base",
+        summarizer: Callable[[str, List[Tuple[str, str]]], str] = None,
+    ) -> None:
+        self._token_budget = token_budget
+        self._summary_tokens = summary_tokens
+        self._ttl = ttl
+        self._max_sessions = max_sessions
+        self._encoding = encoding
+        self._summarizer = summarizer
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        # Un solo thread: i riassunti di una sessione vengono applicati in ordine
+        self._summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-summary")
+
+    def _count(self, text: str) -> int:
+        return count_tokens(text, self._encoding)
+
+    def _turn_tokens(self, turn: Tuple[str, str]) -> int:
+        return self._count(SessionStore._format_turn(turn))
+
+    @staticmethod
+    def _format_turn(turn: Tuple[str, str]) -> str:
+        return f"Human: {turn[0]}\nAI: {turn[1]}"
+
+    def _get(self, session_id: str) -> _Session:
+        now = time.time()
+        with self._lock:
+            expired = [key for key, session in self._sessions.items() if now - session.last_access > self._ttl]
+            for key in expired:
+                del self._sessions[key]
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = _Session()
+                self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self._max_sessions:
+                self._sessions.popitem(last=False)
+            session.last_access = now
+            return session
+
+    def history(self, session_id: str) -> str:
+        """
+        Restituisce il testo della conversazione da inserire nel prompt.
+        """
+        session = self._get(session_id)
+        with session.lock:
+            parts = []
+            if session.summary:
+                parts.append(f"Riassunto della conversazione precedente: {session.summary}")
+            parts.extend(SessionStore._format_turn(turn) for turn in session.pending + session.turns)
+            return "\n".join(parts)
+
+    def has_history(self, session_id: str) -> bool:
+        """
+        Restituisce True se la sessione contiene scambi o un riassunto.
+        """
+        session = self._get(session_id)
+        with session.lock:
+            return bool(session.turns or session.summary)
+
+    def add_turn(self, session_id: str, question: str, answer: str) -> None:
+        """
+        Aggiunge uno scambio alla sessione e la compatta se supera il budget.
+        """
+        session = self._get(session_id)
+        with session.lock:
+            turn = (question, answer)
+            session.turns.append(turn)
+            session.tokens += self._turn_tokens(turn)
+            self._compact(session)
+
+    def _compact(self, session: _Session) -> None:
+        # Con il riassunto attivo, una parte del budget è riservata al riassunto
+        budget = self._token_budget
+        if self._summarizer is not None:
+            budget -= self._summary_tokens
+        if session.tokens <= budget:
+            return
+        evicted = []
+        # L'ultimo scambio resta sempre nella finestra
+        while len(session.turns) > 1 and session.tokens > budget:
+            turn = session.turns.pop(0)
+            session.tokens -= self._turn_tokens(turn)
+            evicted.append(turn)
+        if evicted and self._summarizer is not None:
+            session.pending.extend(evicted)
+            self._summary_executor.submit(self._summarize, session)
+
+    def _summarize(self, session: _Session) -> None:
+        """
+        Aggiunge al riassunto della sessione gli scambi in attesa. Viene eseguito nel
+        thread dei riassunti, senza trattenere il lock della sessione durante la
+        chiamata all'LLM.
+        """
+        with session.lock:
+            summary, turns = session.summary, list(session.pending)
+        if not turns:
+            return
+        try:
+            summary = self._truncate(self._summarizer(summary, turns).strip())
+        except Exception as e:
+            print(f"Errore durante il riassunto della conversazione: {e}")
+            summary = None
+        with session.lock:
+            if summary is not None:
+                session.summary = summary
+            # Senza riassunto gli scambi vengono scartati, come senza summarizer
+            del session.pending[:len(turns)]
+
+    def _truncate(self, text: str) -> str:
+        encoding = get_encoding(self._encoding)
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= self._summary_tokens:
+            return text
+        # Si tengono le informazioni più recenti, in fondo al riassunto
+        return encoding.decode(tokens[-self._summary_tokens:])
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+
+class SessionMemory(BaseMemory):
+    """
+    Memoria langchain che legge e scrive la conversazione della sessione corrente
+    (current_session) in un SessionStore condiviso.
+    """
+
+    store: SessionStore
+    memory_key: str = "history"
+    input_key: str = "question"
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        return {self.memory_key: self.store.history(current_session.get())}
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        answer = next(iter(outputs.values())) if outputs else ""
+        self.store.add_turn(current_session.get(), inputs[self.input_key], answer)
+
+    def clear(self) -> None:
+        self.store.clear(current_session.get())
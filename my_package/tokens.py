@@ -0,0 +1,27 @@
+from functools import lru_cache
+
+import tiktoken
+
+
+@lru_cache(maxsize=None)
+def get_encoding(name: str) -> tiktoken.Encoding:
+    """
+    Restituisce l'encoding tiktoken con il nome indicato oppure quello usato dal
+    modello con quel nome (cl100k_base se il modello non è noto). Gli encoding
+    sono costosi da caricare e vengono quindi creati una sola volta per processo.
+    """
+    try:
+        return tiktoken.get_encoding(name)
+    except ValueError:
+        pass
+    try:
+        return tiktoken.encoding_for_model(name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, encoding: str = "cl100k_base") -> int:
+    """
+    Conta i token di un testo con l'encoding indicato.
+    """
+    return len(get_encoding(encoding).encode(text, disallowed_special=()))
@@ -1,68 +1,268 @@
+import hashlib
 import os
+import threading
+import uuid
+from dataclasses import asdict, dataclass, field
 from dotenv import load_dotenv
-from typing import List, Optional, Tuple, Union, Dict
+from typing import Any, Callable, Iterable, List, Optional, Tuple, Dict, Union
 import langchain
-import numpy as np
-import pinecone
-from langchain.schema import Document
-from langchain.vectorstores import Pinecone
+from langchain.schema import BaseRetriever, Document
+from langchain.vectorstores.base import VectorStore
 from langchain.embeddings import OpenAIEmbeddings
+from langchain.embeddings.base import Embeddings
+
+from my_package import metrics
+from my_package.backends import VectorBackend, VectorBackendError, get_backend
+from my_package.context_assembly import ContextAssembler
+from my_package.deletion import BulkDeleter
+from my_package.embedding_cache import CachedEmbeddings
+from my_package.hybrid_retriever import HybridRetriever
+from my_package.ingestion import BatchResult, IngestionPipeline
+from my_package.lexical_index import LexicalIndex
+from my_package.manifest import Manifest
+from my_package.retrieval_scope import current_sources
+
+
+# Senza partizioni, una ricerca limitata ad alcune sorgenti chiede al backend
+# SOURCE_FILTER_OVERFETCH volte i risultati richiesti e poi li filtra
+SOURCE_FILTER_OVERFETCH = 4
+
+# Chunk accumulati prima di scriverli nell'indice lessicale
+LEXICAL_FLUSH_SIZE = 256
+
+# Il client degli embeddings è globale al processo: viene creato una sola
+# volta e condiviso da tutte le istanze
+_embeddings_lock = threading.Lock()
+_embeddings = None
+
+
+@dataclass
+class UploadReport:
+    """
+    Esito del caricamento di una sorgente: quanti chunk erano nuovi (embeddati e
+    caricati), quanti erano già presenti, quanti sono stati rimossi perché non
+    più presenti nella sorgente e quanti non è stato possibile caricare.
+    skipped indica che il file non era cambiato dall'ultimo caricamento, error il
+    motivo per cui la sorgente non è stata caricata affatto.
+    """
+    source: str
+    new: int = 0
+    unchanged: int = 0
+    removed: int = 0
+    failed: int = 0
+    batches: int = 0
+    skipped: bool = False
+    success: bool = True
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+@dataclass
+class DeleteReport:
+    """
+    Esito dell'eliminazione di più sorgenti: vettori eliminati per ogni sorgente,
+    sorgenti non presenti nell'indice e sorgenti per cui l'eliminazione non è
+    riuscita (con il messaggio d'errore). Una sorgente con errori può comunque
+    avere dei vettori eliminati.
+    """
+    deleted: Dict[str, int] = field(default_factory=dict)
+    not_found: List[str] = field(default_factory=list)
+    errors: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def success(self) -> List[str]:
+        return [source for source in self.deleted if source not in self.errors]
+
+    @property
+    def error(self) -> List[str]:
+        return list(self.errors)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "success": self.success,
+            "not_found": self.not_found,
+            "error": self.error,
+            "deleted": self.deleted,
+        }
+
+
+class BackendStore(VectorStore):
+    """
+    Adattatore che espone un VectorBackend come VectorStore di langchain,
+    così che possa essere usato come retriever dal chatbot.
+
+    Le ricerche possono essere limitate ad alcune sorgenti (parametro sources oppure
+    current_sources). Se namespaces è indicato l'indice è partizionato: la funzione
+    restituisce i namespace da interrogare per le sorgenti richieste (None = tutte).
+    """
+
+    def __init__(
+        self,
+        backend: VectorBackend,
+        embeddings: Embeddings,
+        text_key: str = "text",
+        namespaces: Callable[[Optional[List[str]]], List[str]] = None
+    ) -> None:
+        self._backend = backend
+        self._embeddings = embeddings
+        self._text_key = text_key
+        self._namespaces = namespaces
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if ids is None:
+            ids = [str(uuid.uuid4()) for _ in texts]
+        if metadatas is None:
+            metadatas = [{} for _ in texts]
+        values = self._embeddings.embed_documents(texts)
+        vectors = []
+        for vec_id, text, embedding, metadata in zip(ids, texts, values, metadatas):
+            metadata = dict(metadata)
+            metadata[self._text_key] = text
+            vectors.append((vec_id, embedding, metadata))
+        self._backend.upsert(vectors)
+        self._backend.flush()
+        return ids
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, sources: Optional[List[str]] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        if sources is None:
+            sources = current_sources.get()
+        with metrics.timed("embed_query"):
+            vector = self._embeddings.embed_query(query)
+        with metrics.timed("vector_query"):
+            if self._namespaces is not None:
+                results = self._backend.query_namespaces(vector, k, self._namespaces(sources))
+            elif sources:
+                results = self._backend.query(vector, k * SOURCE_FILTER_OVERFETCH)
+                results = [item for item in results if item["metadata"].get("source") in sources][:k]
+            else:
+                results = self._backend.query(vector, k)
+        docs = []
+        for item in results:
+            metadata = dict(item["metadata"])
+            text = metadata.pop(self._text_key, "")
+            docs.append((Document(page_content=text, metadata=metadata), item["score"]))
+        return docs
+
+    def similarity_search(
+        self, query: str, k: int = 4, sources: Optional[List[str]] = None, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, sources, **kwargs)]
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        index_name: Optional[str] = None,
+        **kwargs: Any,
+    ) -> "BackendStore":
+        backend = get_backend(index_name)
+        backend.create_index()
+        store = cls(backend, embedding)
+        store.add_texts(texts, metadatas)
+        return store
 
 
 class Vectorstore(object):
     def __init__(self, index_name) -> None:
         """
         Inizializza un'istanza di Vectorstore.
+        Il backend (Pinecone o FAISS locale) è scelto dalla variabile d'ambiente VECTOR_BACKEND.
+
+        Con VECTOR_PARTITION_MODE="source" ogni sorgente viene salvata in un proprio
+        namespace e, in copia, nel namespace predefinito: le ricerche limitate ad alcune
+        sorgenti interrogano solo le loro partizioni, quelle su tutto il corpus il solo
+        namespace predefinito (una richiesta, invece di una per sorgente). Il prezzo è
+        una doppia scrittura di ogni vettore e, in eliminazione, la cancellazione per id
+        delle copie oltre a quella del namespace. La modalità va scelta alla creazione
+        dell'indice: cambiarla richiede di ricaricare i documenti.
         """
         self._get_env()
-        self._pinecone_index_name = index_name
-        self._pineconeConfig()
+        self._index_name = index_name
+        self._lock = threading.RLock()
+        self._source_locks = {}
+        self._vectorstore = None
+        self.backend = get_backend(index_name)
+        self.manifest = Manifest(index_name)
+        self.lexical = LexicalIndex(index_name)
 
     def _get_env(self):
         load_dotenv()
-        self._pinecone_api_key = os.getenv("PINECONE_API_KEY")
-        self._pinecone_api_env = os.getenv("PINECONE_API_ENV")
-        # self._pinecone_index_name = os.getenv("PINECONE_INDEX_NAME")
-        self._pinecone_index_metric = os.getenv("PINECONE_INDEX_METRIC")
-        self._pinecone_index_dimension = int(os.getenv("PINECONE_INDEX_DIMENSION"))
-        self._pinecone_top_k = int(os.getenv("PINECONE_TOP_K"))
+        self._index_dimension = int(os.getenv("PINECONE_INDEX_DIMENSION"))
+        self._top_k = int(os.getenv("PINECONE_TOP_K"))
+        self._retrieval_mode = os.getenv("RETRIEVAL_MODE", "hybrid").lower()
+        self._retrieval_top_k = int(os.getenv("RETRIEVAL_TOP_K", 4))
+        self._hybrid_candidates = int(os.getenv("HYBRID_CANDIDATES", 20))
+        self._hybrid_alpha = float(os.getenv("HYBRID_ALPHA", 0.5))
+        self._partition_mode = os.getenv("VECTOR_PARTITION_MODE", "none").lower()
+        self._context_assembly = os.getenv("CONTEXT_ASSEMBLY", "true").lower() != "false"
+        self._context_candidates = int(os.getenv("CONTEXT_CANDIDATES", 2 * self._retrieval_top_k))
+        self._context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500))
+        self._context_mmr_lambda = float(os.getenv("CONTEXT_MMR_LAMBDA", 0.7))
+        self._context_duplicate_threshold = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", 0.9))
+        self._context_tokenizer = os.getenv("CONTEXT_TOKENIZER", os.getenv("OPENAI_MODEL_NAME") or "cl100k_base")
+
+    @property
+    def partitioned(self) -> bool:
+        return self._partition_mode == "source"
+
+    def _namespace(self, source: str) -> str:
+        """
+        Restituisce il namespace in cui sono salvati i vettori di una sorgente.
+        """
+        return source if self.partitioned else ""
 
-    def _pineconeConfig(self) -> Union[pinecone.Index, None]:
+    def _write_namespaces(self, source: str) -> List[str]:
         """
-        Configura Pinecone con la chiave API e l'ambiente specificati.
+        Restituisce i namespace in cui scrivere i vettori di una sorgente: con le
+        partizioni anche quello predefinito, che contiene l'intero corpus.
+        """
+        return [source, ""] if self.partitioned else [""]
 
-        Parameters:
-        - apiKey (str): Chiave API di Pinecone.
-        - env (str): Ambiente di Pinecone.
+    def _query_namespaces(self, sources: Optional[List[str]]) -> List[str]:
+        # Le ricerche su tutto il corpus interrogano la sola copia globale
+        if sources is None:
+            return [""]
+        return [self._namespace(source) for source in sources]
+
+    def warm_up(self) -> bool:
+        """
+        Prepara le risorse usate ad ogni richiesta: client degli embeddings,
+        handle dell'indice e relativa connessione.
 
         Returns:
-        - pinecone.Index or None: Oggetto Pinecone configurato o None in caso di errore.
+        - bool: True se l'indice esiste ed è stato raggiunto, altrimenti False.
         """
+        Vectorstore.getEmbeddings()
+        vectorstore, _ = self.get_index()
+        if vectorstore is None:
+            return False
         try:
-            # Inizializza Pinecone
-            return pinecone.init(
-                api_key=self._pinecone_api_key,  # Trovato su app.pinecone.io
-                environment=self._pinecone_api_env,  # Trovato accanto all'API key nella console
-            )
-        except pinecone.exceptions.PineconeAPIException as e:
-            print(f"Errore Pinecone API durante l'inizializzazione: {e}")
-            return None
-        except pinecone.exceptions.PineconeConnectionException as e:
-            print(f"Errore di connessione a Pinecone durante l'inizializzazione: {e}")
-            return None
+            self.backend.warm_up()
+            return True
+        except VectorBackendError as e:
+            print(f"Errore del backend vettoriale durante il warm up: {e}")
+            return False
 
     # TODO se l'indice esistesse di già?
     def create_index(self) -> bool:
-        if self._pinecone_index_name in pinecone.list_indexes():
-            return False
-        else:
-            settings = {
-                "name": self._pinecone_index_name,
-                "metric": self._pinecone_index_metric,
-                "dimension": self._pinecone_index_dimension,
-            }
-            pinecone.create_index(**settings)
-            return True
+        created = self.backend.create_index()
+        if created:
+            self.manifest.clear()
+            self.lexical.clear()
+        return created
 
     @staticmethod
     def genDocs(data: List[str], source: str) -> List[Document]:
@@ -86,96 +286,243 @@ class Vectorstore(object):
         return docs
 
     # TODO perchè restituisco gli embeddings?
-    def get_index(self) -> Tuple[Optional[Pinecone], langchain.embeddings.openai.OpenAIEmbeddings]:
+    def get_index(self) -> Tuple[Optional[VectorStore], langchain.embeddings.openai.OpenAIEmbeddings]:
         """
-        Recupera l'indice di Pinecone o restituisce None se non esiste.
+        Recupera l'indice o restituisce None se non esiste.
 
         Returns:
-        - vectorstore (Pinecone): Oggetto Vectorstore se l'indice esiste, altrimenti None.
+        - vectorstore (VectorStore): Oggetto Vectorstore se l'indice esiste, altrimenti None.
         - embeddings: Embeddings associati all'indice.
         """
         try:
             embeddings = Vectorstore.getEmbeddings()
-            if self._pinecone_index_name in pinecone.list_indexes():
-                index = pinecone.Index(index_name=self._pinecone_index_name)
-                vectorstore = Pinecone(index, embeddings, "text")
-            else:
-                vectorstore = None
+            with self._lock:
+                if self._vectorstore is None and self.backend.index_exists():
+                    self._vectorstore = BackendStore(
+                        self.backend,
+                        embeddings,
+                        namespaces=self._query_namespaces if self.partitioned else None
+                    )
+                vectorstore = self._vectorstore
 
             return vectorstore, embeddings
         except Exception as e:
             print(f"Errore durante il recupero dell'indice: {e}")
             return None, None
 
+    def get_retriever(self) -> Optional[BaseRetriever]:
+        """
+        Restituisce il retriever usato dal chatbot: ibrido (BM25 + vettoriale) se
+        RETRIEVAL_MODE è "hybrid", altrimenti la sola ricerca vettoriale.
+
+        Con CONTEXT_ASSEMBLY attivo (predefinito) il retriever restituisce
+        CONTEXT_CANDIDATES candidati, da cui ContextAssembler ricava al più
+        RETRIEVAL_TOP_K chunk senza duplicati, entro CONTEXT_TOKEN_BUDGET token.
+
+        Returns:
+        - BaseRetriever: Il retriever, oppure None se l'indice non esiste.
+        """
+        vectorstore, _ = self.get_index()
+        if vectorstore is None:
+            return None
+        k = max(self._context_candidates, self._retrieval_top_k) if self._context_assembly else self._retrieval_top_k
+        if self._retrieval_mode != "hybrid":
+            retriever = vectorstore.as_retriever(search_kwargs={"k": k})
+        else:
+            retriever = HybridRetriever(
+                vectorstore,
+                self.lexical,
+                k=k,
+                candidates=self._hybrid_candidates,
+                alpha=self._hybrid_alpha
+            )
+        if not self._context_assembly:
+            return retriever
+        return ContextAssembler(
+            retriever,
+            k=self._retrieval_top_k,
+            token_budget=self._context_token_budget,
+            mmr_lambda=self._context_mmr_lambda,
+            duplicate_threshold=self._context_duplicate_threshold,
+            encoding=self._context_tokenizer
+        )
+
     def delete_index(self) -> bool:
         """
-        Elimina un indice Pinecone.
+        Elimina l'indice.
 
         Returns:
         - bool: True se l'eliminazione ha avuto successo, altrimenti False.
         """
         try:
-
-            if self._pinecone_index_name not in pinecone.list_indexes():
-                print(f"Errore, l'indice specificato non è presente su Pinecone")
+            if not self.backend.delete_index():
+                print(f"Errore, l'indice specificato non è presente")
                 return False
 
-            # Elimina l'indice specificato
-            pinecone.delete_index(self._pinecone_index_name)
-
+            self.manifest.clear()
+            self.lexical.clear()
+            with self._lock:
+                self._vectorstore = None
             return True  # Indica che l'eliminazione è riuscita
-        except pinecone.exceptions.PineconeException as e:
-            print(f"Errore Pinecone API durante l'eliminazione dell'indice: {e}")
+        except VectorBackendError as e:
+            print(f"Errore del backend vettoriale durante l'eliminazione dell'indice: {e}")
             return False  # Indica che si è verificato un errore
-        except pinecone.exceptions.PineconeConnectionException as e:
-            print(
-                f"Errore di connessione a Pinecone durante l'eliminazione dell'indice: {e}"
-            )
-            return False  # Indica che si è verificato un errore di connessione
 
-    def upload_data(self, texts: [str], source: str) -> bool:
+    @staticmethod
+    def chunk_id(source: str, text: str) -> str:
+        """
+        Calcola l'id deterministico di un chunk a partire da sorgente e contenuto:
+        ricaricare lo stesso chunk sovrascrive il vettore invece di duplicarlo.
+        """
+        return hashlib.sha256(f"{source}\x00{text}".encode("utf-8")).hexdigest()
+
+    def upload_data(self, texts: [str], source: str, prune: bool = True, bump_version: bool = True) -> bool:
         """
-        Carica dati nell'indice di Pinecone. Nel caso non esistesse viene creato
+        Carica dati nell'indice. Nel caso non esistesse viene creato
 
         Parameters:
         - texts ([str]): Lista di testi da caricare nell'indice.
         - source (str): Nome del file sorgente associato ai dati.
+        - prune (bool): Se True i chunk della sorgente non più presenti in texts vengono eliminati.
+        - bump_version (bool): Se False la versione del corpus non cambia (dati di servizio come la memoria della chat).
 
         Returns:
         - bool: True se il caricamento ha avuto successo, altrimenti False.
         """
-        vectorstore, embeddings = self.get_index()
-        docs = Vectorstore.genDocs(texts, source)
-
-        if not vectorstore:
-            self.create_index()
-            # TODO da riguardare, il try except non dovrebbe servire qua
-            try:
-                vectorstore, _ = self.get_index()
-            except pinecone.exceptions.PineconeException as e:
-                print(
-                    f"Si è verificato un errore di Pinecone durante la creazione dell'indice: {e}"
-                )
-                return False
+        return self.sync_data(texts, source, prune, bump_version=bump_version).success
+
+    def sync_data(
+        self,
+        texts: Iterable[Union[str, Document]],
+        source: str,
+        prune: bool = True,
+        on_progress: Callable[[BatchResult], None] = None,
+        bump_version: bool = True
+    ) -> UploadReport:
+        """
+        Allinea l'indice con i chunk di una sorgente. Gli id dei vettori derivano dal
+        contenuto, quindi vengono embeddati e caricati solo i chunk nuovi; quelli già
+        presenti vengono saltati e, se prune è True, quelli spariti vengono eliminati.
 
+        I chunk possono arrivare da un generatore (ad esempio Pdf2Chunks.iterChunks):
+        vengono consumati man mano dalla pipeline di caricamento.
+
+        Parameters:
+        - texts (Iterable[Union[str, Document]]): Testi o Document da caricare; i metadata dei Document vengono conservati.
+        - source (str): Nome del file sorgente associato ai dati.
+        - prune (bool): Se True i chunk della sorgente non più presenti in texts vengono eliminati.
+        - on_progress (Callable[[BatchResult], None], optional): Richiamata al termine di ogni batch di caricamento.
+        - bump_version (bool): Se False la versione del corpus non cambia anche se i dati cambiano.
+
+        Returns:
+        - UploadReport: Numero di chunk nuovi, invariati, rimossi e falliti.
+        """
+        with self._source_lock(source):
+            report = self._sync_data(texts, source, prune, on_progress)
+        if bump_version and (report.new or report.removed):
+            self.manifest.bump_version()
+        return report
+
+    def _source_lock(self, source: str) -> threading.Lock:
+        """
+        Due caricamenti della stessa sorgente non possono procedere insieme: il
+        confronto con il manifest darebbe risultati incoerenti.
+        """
+        with self._lock:
+            return self._source_locks.setdefault(source, threading.Lock())
+
+    def _sync_data(
+        self,
+        texts: Iterable[Union[str, Document]],
+        source: str,
+        prune: bool,
+        on_progress: Optional[Callable[[BatchResult], None]]
+    ) -> UploadReport:
+        report = UploadReport(source)
         try:
-            # Provare a vedere soluzioni alternative
-            # TODO provare a cambiare in pinecone.Pinecone
-            vectorstore = Pinecone.from_documents(
-                docs, 
-                embeddings, 
-                index_name=self._pinecone_index_name
+            if not self.backend.index_exists():
+                self.create_index()
+            if not self._ensure_manifest():
+                report.success = False
+                report.error = "Il backend vettoriale non è raggiungibile"
+                return report
+            existing = set(self.manifest.get_ids(source))
+            seen = set()
+            source_errors = []
+            lexical_buffer = []
+
+            def new_chunks():
+                # Un errore nella lettura della sorgente interrompe lo stream ma non la
+                # pipeline: i batch già caricati vengono comunque registrati nel manifest
+                try:
+                    for item in texts:
+                        if isinstance(item, Document):
+                            text, metadata = item.page_content, dict(item.metadata)
+                        else:
+                            text, metadata = item, {}
+                        vec_id = Vectorstore.chunk_id(source, text)
+                        # Chunk identici all'interno della stessa sorgente producono lo stesso id
+                        if vec_id in seen:
+                            continue
+                        seen.add(vec_id)
+                        if vec_id in existing:
+                            report.unchanged += 1
+                            continue
+                        report.new += 1
+                        metadata["source"] = source
+                        # L'indice lessicale viene scritto a blocchi mentre i chunk scorrono,
+                        # senza trattenere in memoria l'intero documento
+                        lexical_buffer.append((vec_id, text, metadata))
+                        if len(lexical_buffer) >= LEXICAL_FLUSH_SIZE:
+                            self.lexical.add(lexical_buffer, source)
+                            lexical_buffer.clear()
+                        yield vec_id, text, metadata
+                except Exception as e:
+                    source_errors.append(e)
+
+            pipeline = IngestionPipeline(
+                self.backend, Vectorstore.getEmbeddings(), namespaces=self._write_namespaces(source)
             )
-            return True
-        except pinecone.exceptions.PineconeException as e:
+            result = pipeline.run(new_chunks(), on_progress)
+            # I vettori vengono resi persistenti prima di registrarli nel manifest
+            self.backend.flush()
+            self.lexical.add(lexical_buffer, source)
+            # Nel manifest (e nell'indice lessicale) restano solo i batch caricati davvero
+            self.manifest.add(result.uploaded_ids, source)
+            if result.failed_ids:
+                self.lexical.remove(result.failed_ids)
+            report.batches = len(result.batches)
+            report.failed = len(result.failed_ids)
+            for batch in result.batches:
+                if not batch.success:
+                    print(f"Batch {batch.batch} di {source} non caricato dopo {batch.attempts} tentativi: {batch.error}")
+            for e in source_errors:
+                print(f"Errore durante la lettura dei chunk di {source}: {e}")
+            report.success = report.failed == 0 and not source_errors
+            if source_errors:
+                report.error = str(source_errors[0])
+
+            # Se la sorgente non è stata letta per intero non si può sapere quali chunk sono spariti
+            if prune and not source_errors:
+                removed_ids = [vec_id for vec_id in existing if vec_id not in seen]
+                if removed_ids:
+                    for namespace in self._write_namespaces(source):
+                        self.backend.delete(removed_ids, namespace)
+                    self.backend.flush()
+                    self.manifest.remove(removed_ids)
+                    self.lexical.remove(removed_ids)
+                report.removed = len(removed_ids)
+        except VectorBackendError as e:
             print(
-                f"Si è verificato un errore di Pinecone durante il caricamento dei dati: {e}"
+                f"Si è verificato un errore del backend vettoriale durante il caricamento dei dati: {e}"
             )
-            return False
+            report.success = False
+            report.error = str(e)
+        return report
 
     def delete_data(self, sources: List[str]) -> ([str], [str], [str]):
         """
-        Elimina dati dall'indice di Pinecone.
+        Elimina dati dall'indice.
 
         Parameters:
         - sources (List[str]): Lista di nomi di file da cui eliminare i dati.
@@ -186,23 +533,103 @@ class Vectorstore(object):
             - La seconda lista contiene i nomi di file che non sono stati trovati nell'indice.
             - La terza lista contiene i nomi di file per i quali si è verificato un errore durante l'eliminazione.
         """
-        success, not_found, error = [], [], []
-        index = pinecone.Index(self._pinecone_index_name)
-        ids_and_source = self._get_ids_and_source_from_index(index)
-        for source in sources:
-            ids = [
-                item["id"] for item in ids_and_source if str(item["source"]) == source
-            ]
+        report = self.delete_sources(sources)
+        return report.success, report.not_found, report.error
+
+    def delete_sources(self, sources: List[str]) -> DeleteReport:
+        """
+        Elimina i dati di più sorgenti. Gli id vengono letti dal manifest in un solo
+        passaggio e cancellati in batch paralleli (vedi BulkDeleter); con l'indice
+        partizionato ogni sorgente è un unico namespace da eliminare.
+
+        Parameters:
+        - sources (List[str]): Lista di nomi di file da cui eliminare i dati.
 
-            if len(ids) <= 0:
-                not_found.append(source)
-            try:
-                index.delete(ids=ids, namespace="")
-                success.append(source)
-            except pinecone.exceptions.PineconeException:
-                error.append(source)
+        Returns:
+        - DeleteReport: Vettori eliminati per sorgente, sorgenti non trovate e sorgenti con errori.
+        """
+        report = DeleteReport()
+        if not self._ensure_manifest():
+            report.errors = {source: "Il backend vettoriale non è raggiungibile" for source in sources}
+            return report
+        ids_by_source = self.manifest.get_ids_by_source(sources)
+        for source, ids in list(ids_by_source.items()):
+            # Nessun id registrato: non c'è nulla da chiedere al backend
+            if not ids:
+                report.not_found.append(source)
+                del ids_by_source[source]
+        if not ids_by_source:
+            return report
+
+        deleter = BulkDeleter(self.backend)
+        if self.partitioned:
+            result = deleter.delete_namespaces(ids_by_source, self._namespace)
+            # Le copie nel namespace predefinito vanno eliminate per id: una sorgente
+            # risulta eliminata solo per gli id rimossi da entrambi i namespace
+            copies = deleter.delete_ids(
+                {source: ids for source, ids in ids_by_source.items() if source not in result.errors}
+            )
+            for source, error in copies.errors.items():
+                result.errors[source] = error
+                result.deleted_ids[source] = copies.deleted_ids[source]
+        else:
+            result = deleter.delete_ids(ids_by_source, self._namespace)
+        try:
+            self.backend.flush()
+        except VectorBackendError as e:
+            # Le eliminazioni restano in memoria e vengono salvate alla prossima occasione
+            print(f"Errore del backend vettoriale durante il salvataggio dell'indice: {e}")
+
+        completed = [source for source in ids_by_source if source not in result.errors]
+        self.manifest.remove_sources(completed)
+        self.lexical.remove_sources(completed)
+        for source, error in result.errors.items():
+            print(f"Errore durante l'eliminazione dei dati di {source}: {error}")
+            # Gli id eliminati prima dell'errore escono comunque dal manifest, e il file
+            # va ricaricato per intero anche se non è cambiato
+            self.manifest.remove(result.deleted_ids[source])
+            self.manifest.remove_files(source)
+            self.lexical.remove(result.deleted_ids[source])
+        report.deleted = {source: len(ids) for source, ids in result.deleted_ids.items()}
+        report.errors = dict(result.errors)
+
+        if any(report.deleted.values()):
+            self.manifest.bump_version()
+        return report
+
+    def delete_all(self) -> DeleteReport:
+        """
+        Elimina tutti i dati lasciando l'indice vuoto: invece di eliminare le sorgenti
+        una per una svuota il backend con una sola operazione per namespace.
 
-        return success, not_found, error
+        Returns:
+        - DeleteReport: Vettori eliminati per sorgente (secondo il manifest).
+        """
+        report = DeleteReport()
+        try:
+            if not self.backend.index_exists():
+                return report
+        except VectorBackendError as e:
+            print(f"Errore del backend vettoriale durante la verifica dell'indice: {e}")
+            report.errors = {source: str(e) for source in self.manifest.list_sources()}
+            return report
+        if not self._ensure_manifest():
+            report.errors = {source: "Il backend vettoriale non è raggiungibile" for source in self.manifest.list_sources()}
+            return report
+        counts = self.manifest.count_by_source()
+        try:
+            self.backend.delete_all()
+        except VectorBackendError as e:
+            print(f"Errore del backend vettoriale durante l'eliminazione di tutti i dati: {e}")
+            # Non si sa quali vettori siano stati eliminati: i file vanno ricaricati per intero
+            for source in counts:
+                self.manifest.remove_files(source)
+            report.errors = {source: str(e) for source in counts}
+            return report
+        self.manifest.clear()
+        self.lexical.clear()
+        report.deleted = counts
+        return report
 
     def get_all_source(self) -> List[str]:
         """
@@ -211,78 +638,93 @@ class Vectorstore(object):
         Returns:
         - []: restituisce una stringa in cui vengono elencati tutte le sorgenti presenti
         """
-        if self._pinecone_index_name in pinecone.list_indexes():
-            index = pinecone.Index(self._pinecone_index_name)
-        else:
+        try:
+            if not self.backend.index_exists():
+                return
+        except VectorBackendError as e:
+            print(f"Errore del backend vettoriale durante la verifica dell'indice: {e}")
+            return
+        if not self._ensure_manifest():
             return
-        ids_and_source = self._get_ids_and_source_from_index(index)
-        # Crea un insieme (set) per raccogliere le diverse sorgenti
-        unique_sources = []
+        return self.manifest.list_sources()
 
-        # Scorrere l'array e aggiungere le sorgenti uniche all'insieme
-        for item in ids_and_source:
-            if str(item["source"]) not in unique_sources:
-                unique_sources.append(str(item["source"]))
+    def corpus_version(self) -> int:
+        """
+        Restituisce la versione corrente del corpus (vedi Manifest.get_version).
+        """
+        return self.manifest.get_version()
 
-        return unique_sources
+    def _ensure_manifest(self) -> bool:
+        """
+        Se il manifest non è mai stato allineato con l'indice (ad esempio per un
+        indice creato prima della sua introduzione), lo ricostruisce una volta.
 
-    def _get_ids_and_source_from_query(self, index: pinecone.Index, input_vector: List[float]) -> List[Dict[str, str]]:
+        Returns:
+        - bool: False se il backend non è raggiungibile e il manifest non è utilizzabile.
         """
-        Ottiene oggetti con campi 'id' e 'source' dai risultati di una query in un indice Pinecone.
+        if self.manifest.is_initialized():
+            return True
+        try:
+            if not self.backend.index_exists():
+                return True
+        except VectorBackendError as e:
+            print(f"Errore del backend vettoriale durante la verifica dell'indice: {e}")
+            return False
+        return self.reconcile_manifest() >= 0
 
-        Parameters:
-        - index (pinecone.Index): Il riferimento all'indice Pinecone.
-        - input_vector (list): Il vettore di input per la query.
-        - top_k (int, optional): Il numero massimo di risultati da restituire (predefinito a 10000).
+    def reconcile_manifest(self) -> int:
+        """
+        Ricostruisce il manifest locale a partire dal contenuto dell'indice remoto.
+        È un'operazione costosa, da eseguire solo se il manifest è disallineato.
 
         Returns:
-        - results (list): Una lista di dizionari, ciascuno rappresenta un oggetto con campi 'id' e 'source'.
+        - int: Numero di vettori registrati nel manifest, -1 in caso di errore.
         """
         try:
-            results = []
-            query_results = index.query(
-                vector=input_vector,
-                top_k=self._pinecone_top_k,
-                include_values=False,
-                include_metadata=True,
+            if not self.backend.index_exists():
+                self.manifest.clear()
+                self.lexical.clear()
+                return 0
+            ids_and_source = self.backend.list_ids_and_source()
+        except VectorBackendError as e:
+            print(
+                f"Si è verificato un errore del backend vettoriale durante l'ottenimento degli ID e delle fonti: {e}"
             )
-            for item in query_results["matches"]:
-                results.append({"id": item["id"], "source": item["metadata"]["source"]})
-            return results
-        except pinecone.exceptions.PineconeException as e:
-            print(f"Si è verificato un errore di Pinecone durante la query: {e}")
-            return []
+            return -1
+        return self.manifest.replace_all(ids_and_source)
 
-    def _get_ids_and_source_from_index(self, index: pinecone.Index) -> List[Dict[str, str]]:
+    def storage_report(self) -> Optional[Dict[str, Any]]:
         """
-        Ottiene oggetti con campi 'id' e 'source' da un indice Pinecone utilizzando vettori casuali.
-
-        Parameters:
-        - index: Il riferimento all'indice Pinecone.
-        - dimension (int): Il numero di dimensioni dei vettori casuali.
+        Descrive la memorizzazione dei vettori: tipo di indice, byte per vettore e
+        rapporto di compressione rispetto ai float32.
 
         Returns:
-        - ids_and_source (list): Una lista di dizionari, ciascuno rappresenta un oggetto con campi 'id' e 'source'.
+        - Dict: Il report del backend, oppure None in caso di errore.
         """
-        dimension = self._pinecone_index_dimension
         try:
-            num_vectors = index.describe_index_stats()["total_vector_count"]
-            ids_and_source = []
-            while len(ids_and_source) < num_vectors:
-                # Creazione di un vettore casuale
-                input_vector = np.random.rand(dimension).tolist()
-                ids_and_source.extend(
-                    self._get_ids_and_source_from_query(index, input_vector)
-                )
-            return ids_and_source
-        except pinecone.exceptions.PineconeException as e:
-            print(
-                f"Si è verificato un errore di Pinecone durante l'ottenimento degli ID e delle fonti: {e}"
-            )
-            return []
+            return self.backend.storage_report()
+        except VectorBackendError as e:
+            print(f"Errore del backend vettoriale durante la lettura dello spazio occupato: {e}")
+            return None
 
     @staticmethod
     def getEmbeddings():
-        load_dotenv()
-        return OpenAIEmbeddings(_openai_api_key= os.getenv("OPENAI_API_KEY"))
-
+        """
+        Restituisce il client degli embeddings condiviso dal processo, usato sia in
+        caricamento sia dal retriever. Se EMBEDDING_CACHE_ENABLED non è "false" le
+        richieste passano da una cache persistente (EMBEDDING_CACHE_DB).
+        """
+        global _embeddings
+        with _embeddings_lock:
+            if _embeddings is None:
+                load_dotenv()
+                embeddings = OpenAIEmbeddings(_openai_api_key= os.getenv("OPENAI_API_KEY"))
+                if os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() != "false":
+                    embeddings = CachedEmbeddings(
+                        embeddings,
+                        db_path=os.getenv("EMBEDDING_CACHE_DB", "embedding_cache.sqlite3"),
+                        memory_size=int(os.getenv("EMBEDDING_CACHE_MEMORY_SIZE", 1024)),
+                        max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 100000)),
+                    )
+                _embeddings = embeddings
+            return _embeddings
@@ -4,7 +4,7 @@ import os, argparse, json
 import platform
 import shutil
 from typing import List
-from my_package.apiRoutes import ApiRoutes
+from my_package.ApiRoutes import ApiRoutes
 
 menu = """
 Benvenuto nell'App PDF Chatbot!
@@ -17,6 +17,9 @@ Scegli un'opzione:
 \t3. Rimuovi documenti dalla memoria
 \t4. Eliminare tutti i dati, compreso l'indice
 \t5. Visualizzare quali file sono salvati
+\t6. Ricostruire il manifest a partire dall'indice
+\t7. Compattare la cronologia dei caricamenti
+\t8. Interagisci con il Chatbot (risposta in streaming)
 
 Inserisci il numero corrispondente all'opzione desiderata:
 """
@@ -95,6 +98,30 @@ def chat():
     else:
         print("Non siamo riusciti ad inizializzare una conversazione con il chatbot")
 
+def chat_stream():
+    """
+    Come chat, ma stampa la risposta del chatbot token per token man mano che viene generata.
+    """
+    if app.init_ChatBot():
+        while True:
+            query = input(
+                "\nHai una domanda? Scrivi 'q' per uscire o inserisci la tua domanda: "
+            )
+
+            if query.lower() == "q":
+                break  # Esci dal ciclo se l'utente scrive 'q'
+            print()
+            for event in app.stream_chat(query):
+                if event["type"] == "token":
+                    print(event["data"], end="", flush=True)
+                elif event["type"] == "end":
+                    print("\n")
+                    print("Sorgenti: " + " ,".join(event["data"]["sources"]))
+                else:
+                    print(f"\nErrore durante la generazione della risposta: {event['data']}")
+    else:
+        print("Non siamo riusciti ad inizializzare una conversazione con il chatbot")
+
 def print_all_sources(sources: []) -> None:
     print("Sul vector store sono presenti le seguenti sorgenti:\n")
     for item in sources:
@@ -167,6 +194,17 @@ def choice_5():
     if all_sources:
         print_all_sources(all_sources)
 
+def choice_6():
+    count = app.reconcile_manifest()
+    if count >= 0:
+        print(f"Il manifest è stato ricostruito, contiene {count} vettori")
+    else:
+        print("Non è stato possibile ricostruire il manifest")
+
+def choice_7():
+    removed = app.compact_history()
+    print(f"La cronologia è stata compattata, sono stati eliminati {removed} record")
+
 
 
 
@@ -197,6 +235,15 @@ def main(debug=False) -> None:
             elif choice == 5:
                 choice_5()
 
+            elif choice == 6:
+                choice_6()
+
+            elif choice == 7:
+                choice_7()
+
+            elif choice == 8:
+                chat_stream()
+
             else:
                 print("L'opzione inserita non era presente nel menu")
 
@@ -208,6 +255,6 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
     
-    app = ApiRoutes()
+    app = ApiRoutes.get_instance()
     main(args.debug)
     clean_pycache(os.getcwd())
@@ -0,0 +1,100 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.fakes import FakeEmbeddings, InMemoryBackend, WhitespaceEncoding  # noqa: E402
+
+DIMENSION = 32
+
+
+@pytest.fixture(autouse=True)
+def app_env(tmp_path, monkeypatch):
+    """
+    Configurazione dell'applicativo: tutti i file di stato finiscono nella
+    cartella temporanea del test.
+    """
+    env = {
+        "OPENAI_API_KEY": "test",
+        "OPENAI_MODEL_NAME": "test",
+        "OPENAI_TEMPERATURE": "0",
+        "OPENAI_TOP_P": "1",
+        "OPENAI_PRESENCE_PENALTY": "0",
+        "OPENAI_FREQUENCY_PENALTY": "0",
+        "OPENAI_PROMPT_TEMPLATE": "{history}\n{context}\nDomanda: {question}\nRisposta:",
+        "PINECONE_INDEX_NAME": "test",
+        "PINECONE_INDEX_DIMENSION": str(DIMENSION),
+        "PINECONE_INDEX_METRIC": "cosine",
+        "PINECONE_TOP_K": "10",
+        "HISTORY_FILE": str(tmp_path / "history.json"),
+        "HISTORY_DB": str(tmp_path / "history.sqlite3"),
+        "MANIFEST_DB": str(tmp_path / "manifest.sqlite3"),
+        "LEXICAL_INDEX_DB": str(tmp_path / "lexical_index.sqlite3"),
+        "JOBS_DB": str(tmp_path / "jobs.sqlite3"),
+        "FAISS_INDEX_DIR": str(tmp_path / "faiss"),
+        "MMAP_INDEX_DIR": str(tmp_path / "mmap"),
+        "EMBEDDING_CACHE_ENABLED": "false",
+        "ANSWER_CACHE_ENABLED": "false",
+    }
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    return tmp_path
+
+
+@pytest.fixture
+def fakes(monkeypatch):
+    """
+    Sostituisce embedding, backend vettoriale e tokenizer con i finti di benchmarks.fakes.
+    """
+    import my_package.ApiRoutes  # noqa: F401 carica tutti i moduli che usano il tokenizer
+    import my_package.vectorstore as vectorstore_module
+    import my_package.tokens as tokens_module
+
+    embeddings = FakeEmbeddings(DIMENSION)
+    backends = {}
+    monkeypatch.setattr(vectorstore_module, "_embeddings", embeddings)
+    monkeypatch.setattr(
+        vectorstore_module, "get_backend",
+        lambda index_name: backends.setdefault(index_name, InMemoryBackend(index_name, DIMENSION))
+    )
+
+    encoding = WhitespaceEncoding()
+    original = tokens_module.get_encoding
+    for name, module in list(sys.modules.items()):
+        if name.startswith("my_package") and getattr(module, "get_encoding", None) is original:
+            monkeypatch.setattr(module, "get_encoding", lambda name: encoding)
+    return {"embeddings": embeddings, "backends": backends}
+
+
+@pytest.fixture
+def routes(fakes):
+    from my_package.ApiRoutes import ApiRoutes
+    return ApiRoutes()
+
+
+@pytest.fixture
+def chatbot(routes, monkeypatch):
+    """
+    Chatbot con un LLM finto; prompts raccoglie i prompt ricevuti dall'LLM.
+    """
+    import my_package.Chatbot as chatbot_module
+    from benchmarks.fakes import CannedLLM
+
+    prompts = []
+
+    class RecordingLLM(CannedLLM):
+        def _call(self, prompt, stop=None, run_manager=None):
+            prompts.append(prompt)
+            return super()._call(prompt, stop, run_manager)
+
+    monkeypatch.setattr(chatbot_module, "OpenAI", lambda **kwargs: RecordingLLM())
+    routes.create_index()
+    assert routes.init_ChatBot()
+    bot = routes._chatbot
+    bot.prompts = prompts
+    yield bot
+    bot.memory_writer.close()
@@ -0,0 +1,31 @@
+import importlib
+import sys
+
+
+def _import_app(monkeypatch, **env):
+    for name in ("APP_WARM_UP_ON_IMPORT", "WERKZEUG_RUN_MAIN", "FLASK_DEBUG"):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    from my_package.ApiRoutes import ApiRoutes
+
+    warmed = []
+    monkeypatch.setattr(ApiRoutes, "_instance", None)
+    monkeypatch.setattr(ApiRoutes, "warm_up", lambda self: warmed.append("routes"))
+    monkeypatch.setattr(ApiRoutes, "start_jobs", lambda self: warmed.append("jobs"))
+    monkeypatch.delitem(sys.modules, "App", raising=False)
+    importlib.import_module("App")
+    return warmed
+
+
+def test_import_warms_up_the_worker(fakes, monkeypatch):
+    assert _import_app(monkeypatch) == ["routes", "jobs"]
+
+
+def test_reloader_parent_does_not_warm_up(fakes, monkeypatch):
+    assert _import_app(monkeypatch, FLASK_DEBUG="1") == []
+    assert _import_app(monkeypatch, FLASK_DEBUG="1", WERKZEUG_RUN_MAIN="true") == ["routes", "jobs"]
+
+
+def test_gunicorn_config_defers_warm_up_to_post_worker_init(fakes, monkeypatch):
+    assert _import_app(monkeypatch, APP_WARM_UP_ON_IMPORT="false") == []
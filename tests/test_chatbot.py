@@ -0,0 +1,21 @@
+import pytest
+
+
+@pytest.fixture
+def answer_cache(monkeypatch):
+    monkeypatch.setenv("ANSWER_CACHE_ENABLED", "true")
+
+
+def test_answer_cache_is_opt_in(chatbot):
+    assert chatbot.answer_cache is None
+
+
+def test_answer_cache_is_bypassed_with_conversation_history(answer_cache, chatbot):
+    chatbot.chat("cosa dice l'articolo 5?", "a")
+    assert len(chatbot.prompts) == 1
+    # Nuova sessione senza cronologia: la risposta arriva dalla cache
+    chatbot.chat("cosa dice l'articolo 5?", "b")
+    assert len(chatbot.prompts) == 1
+    # La sessione "a" ha una conversazione in corso: la domanda va all'LLM
+    chatbot.chat("cosa dice l'articolo 5?", "a")
+    assert len(chatbot.prompts) == 2
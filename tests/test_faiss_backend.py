@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+
+from my_package.backends.faiss_backend import FaissBackend, _FaissPartition  # noqa: E402
+
+DIMENSION = 16
+
+
+def _vectors(start: int, count: int):
+    rng = np.random.default_rng(start)
+    return [
+        (f"id-{number}", rng.standard_normal(DIMENSION).tolist(), {"source": "doc.pdf", "text": str(number)})
+        for number in range(start, start + count)
+    ]
+
+
+def _backend(tmp_path, **kwargs) -> FaissBackend:
+    return FaissBackend("test", DIMENSION, "cosine", index_dir=str(tmp_path), **kwargs)
+
+
+def test_upsert_is_saved_on_flush_not_per_batch(tmp_path, monkeypatch):
+    saves = []
+    original = _FaissPartition.save
+
+    def save(partition):
+        saves.append(partition.namespace)
+        original(partition)
+
+    monkeypatch.setattr(_FaissPartition, "save", save)
+    backend = _backend(tmp_path, save_interval=3600)
+    backend.create_index()
+    saves.clear()
+    for batch in range(10):
+        backend.upsert(_vectors(batch * 8, 8))
+    assert saves == []
+    # Prima del flush su disco c'è ancora l'indice vuoto
+    assert _backend(tmp_path).query(_vectors(0, 1)[0][1], 5) == []
+
+    backend.flush()
+    assert saves == [""]
+    backend.flush()
+    assert saves == [""]
+    results = _backend(tmp_path).query(_vectors(0, 1)[0][1], 1)
+    assert results[0]["id"] == "id-0"
+
+
+def test_dirty_partition_is_saved_after_save_interval(tmp_path):
+    backend = _backend(tmp_path, save_interval=0)
+    backend.create_index()
+    backend.upsert(_vectors(0, 4))
+    assert not backend._default.dirty
+    assert len(_backend(tmp_path).list_ids_and_source()) == 4
+
+
+def test_delete_is_saved_on_flush(tmp_path):
+    backend = _backend(tmp_path, save_interval=3600)
+    backend.create_index()
+    backend.upsert(_vectors(0, 4), namespace="doc.pdf")
+    backend.flush()
+    backend.delete(["id-0", "id-1"], namespace="doc.pdf")
+    backend.flush()
+    reloaded = _backend(tmp_path)
+    assert sorted(item["id"] for item in reloaded.list_ids_and_source()) == ["id-2", "id-3"]
+
+
+def test_flush_keeps_vectors_saved_by_another_process(tmp_path):
+    first = _backend(tmp_path, save_interval=3600)
+    first.create_index()
+    second = _backend(tmp_path, save_interval=3600)
+    second.warm_up()
+
+    first.upsert(_vectors(0, 5))
+    first.flush()
+    second.upsert(_vectors(100, 1))
+    second.delete(["id-1"])
+    second.flush()
+
+    expected = ["id-0", "id-100", "id-2", "id-3", "id-4"]
+    assert sorted(item["id"] for item in _backend(tmp_path).list_ids_and_source()) == expected
+    # Il primo backend vede le modifiche del secondo senza essere ricreato
+    assert sorted(item["id"] for item in first.list_ids_and_source()) == expected
+    assert first.query(_vectors(100, 1)[0][1], 1)[0]["id"] == "id-100"
+
+
+def test_unsaved_changes_survive_a_refresh(tmp_path):
+    first = _backend(tmp_path, save_interval=3600)
+    first.create_index()
+    second = _backend(tmp_path, save_interval=3600)
+
+    first.upsert(_vectors(0, 2))
+    second.upsert(_vectors(10, 2))
+    second.flush()
+    # La query rilegge il salvataggio del secondo senza perdere i vettori non salvati
+    assert first.query(_vectors(0, 1)[0][1], 1)[0]["id"] == "id-0"
+    first.flush()
+    ids = sorted(item["id"] for item in _backend(tmp_path).list_ids_and_source())
+    assert ids == ["id-0", "id-1", "id-10", "id-11"]
+
+
+def test_rescoring_vectors_are_not_overwritten_by_another_process(tmp_path):
+    options = {"index_type": "sq8", "train_size": 4, "rescore_factor": 4, "save_interval": 3600}
+    first = _backend(tmp_path, **options)
+    first.create_index()
+    second = _backend(tmp_path, **options)
+
+    first.upsert(_vectors(0, 6))
+    second.upsert(_vectors(100, 6))
+    first.flush()
+    second.flush()
+
+    reloaded = _backend(tmp_path, **options)
+    for start in (0, 100):
+        vector = _vectors(start, 1)[0][1]
+        result = reloaded.query(vector, 1)[0]
+        assert result["id"] == f"id-{start}"
+        assert result["score"] == pytest.approx(1.0, abs=1e-5)
@@ -0,0 +1,93 @@
+import os
+import time
+
+from benchmarks.synthetic_pdf import make_pdf
+
+
+def _pdf(directory, name: str, seed: int) -> str:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(str(directory), name)
+    make_pdf(path, pages=2, lines_per_page=20, seed=seed)
+    return path
+
+
+def test_same_name_in_other_directory_is_refused(routes, tmp_path):
+    first = _pdf(tmp_path / "a", "doc.pdf", seed=1)
+    second = _pdf(tmp_path / "b", "doc.pdf", seed=2)
+
+    state, report = routes._ingest_pdf(first)
+    assert state == "success" and report.new > 0
+    indexed = set(routes.vectorstore.manifest.get_ids("doc.pdf"))
+
+    state, report = routes._ingest_pdf(second)
+    assert state == "error"
+    assert not report.success and first in report.error
+    # I chunk del primo file restano nell'indice
+    assert set(routes.vectorstore.manifest.get_ids("doc.pdf")) == indexed
+
+    uploaded, not_uploaded, wrong_path, reports = routes.ingest_pdfs([second])
+    assert not_uploaded == [second] and reports[second]["error"]
+
+
+def test_moved_file_takes_over_its_source(routes, tmp_path):
+    first = _pdf(tmp_path / "a", "doc.pdf", seed=1)
+    state, report = routes._ingest_pdf(first)
+    assert state == "success"
+
+    moved = os.path.join(str(tmp_path / "b"), "doc.pdf")
+    os.makedirs(os.path.dirname(moved))
+    os.rename(first, moved)
+    state, moved_report = routes._ingest_pdf(moved)
+    assert state == "success"
+    assert moved_report.new == 0 and moved_report.unchanged == report.new
+    assert routes.vectorstore.manifest.get_paths("doc.pdf") == [moved]
+
+
+def test_unchanged_file_is_skipped(routes, tmp_path):
+    path = _pdf(tmp_path, "doc.pdf", seed=1)
+    _, report = routes._ingest_pdf(path)
+    state, again = routes._ingest_pdf(path)
+    assert state == "success"
+    assert again.skipped and again.unchanged == report.new
+
+
+def test_file_is_reindexed_when_its_chunks_are_gone(routes, tmp_path):
+    path = _pdf(tmp_path, "doc.pdf", seed=1)
+    _, report = routes._ingest_pdf(path)
+    manifest = routes.vectorstore.manifest
+    manifest.remove(manifest.get_ids("doc.pdf"))
+
+    state, again = routes._ingest_pdf(path)
+    assert state == "success"
+    assert not again.skipped and again.new == report.new
+
+
+def test_failed_delete_forgets_the_file_fingerprint(routes, tmp_path, monkeypatch):
+    from my_package.backends import VectorBackendError
+
+    path = _pdf(tmp_path, "doc.pdf", seed=1)
+    routes._ingest_pdf(path)
+    backend = routes.vectorstore.backend
+
+    def fail(ids, namespace=""):
+        raise VectorBackendError("non raggiungibile")
+
+    monkeypatch.setattr(backend, "delete", fail)
+    report = routes.vectorstore.delete_sources(["doc.pdf"])
+    assert report.error == ["doc.pdf"]
+    assert routes.vectorstore.manifest.get_file(path) is None
+
+    monkeypatch.delattr(backend, "delete")
+    state, again = routes._ingest_pdf(path)
+    assert state == "success" and not again.skipped
+
+
+def test_enqueued_job_runs_without_a_startup_hook(routes, tmp_path):
+    path = _pdf(tmp_path, "doc.pdf", seed=1)
+    job_id = routes.enqueue_pdfs([path])
+    deadline = time.time() + 30
+    while routes.get_job(job_id)["state"] != "done":
+        assert time.time() < deadline, "timeout"
+        time.sleep(0.05)
+    routes.jobs.stop()
+    assert routes.vectorstore.manifest.get_ids("doc.pdf")
@@ -0,0 +1,67 @@
+import threading
+import time
+
+from my_package.jobs import JobQueue
+
+
+def _wait(condition, timeout: float = 10.0) -> None:
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timeout"
+        time.sleep(0.02)
+
+
+def test_running_job_is_not_taken_by_another_queue(tmp_path):
+    db_path = str(tmp_path / "jobs.sqlite3")
+    processed = []
+    lock = threading.Lock()
+
+    def handler(name):
+        def run(path, progress):
+            with lock:
+                processed.append((name, path))
+            time.sleep(0.3)
+            return {"state": "success"}
+        return run
+
+    first = JobQueue(handler("first"), db_path=db_path, workers=1, lease=1.0)
+    second = JobQueue(handler("second"), db_path=db_path, workers=1, lease=1.0)
+    first.start()
+    job_id = first.enqueue(["/a.pdf", "/b.pdf", "/c.pdf"])
+    _wait(lambda: first.get(job_id)["state"] == "running")
+
+    # Un secondo processo che si avvia non deve rimettere in coda il lavoro in corso
+    second.start()
+    _wait(lambda: first.get(job_id)["state"] == "done")
+    first.stop()
+    second.stop()
+    assert sorted(path for _, path in processed) == ["/a.pdf", "/b.pdf", "/c.pdf"]
+    assert {name for name, _ in processed} == {"first"}
+
+
+def test_enqueue_does_not_start_workers(tmp_path):
+    queue = JobQueue(lambda path, progress: {"state": "success"}, db_path=str(tmp_path / "jobs.sqlite3"))
+    job_id = queue.enqueue(["/a.pdf"])
+    time.sleep(0.1)
+    assert queue.get(job_id)["state"] == "queued"
+
+
+def test_expired_lease_is_requeued(tmp_path):
+    db_path = str(tmp_path / "jobs.sqlite3")
+    processed = []
+
+    # Il primo processo prende il lavoro e termina senza completarlo né rinnovarlo
+    crashed = JobQueue(lambda path, progress: {"state": "success"}, db_path=db_path, lease=0.2)
+    job_id = crashed.enqueue(["/a.pdf"])
+    assert crashed._claim() == job_id
+
+    def run(path, progress):
+        processed.append(path)
+        return {"state": "success"}
+
+    queue = JobQueue(run, db_path=db_path, workers=1, lease=0.2)
+    queue.POLL_INTERVAL = 0.05
+    queue.start()
+    _wait(lambda: queue.get(job_id)["state"] == "done")
+    queue.stop()
+    assert processed == ["/a.pdf"]
@@ -0,0 +1,45 @@
+import threading
+
+from my_package.memory_writer import ChatMemoryWriter
+
+
+class RecordingStore(object):
+    def __init__(self):
+        self.batches = []
+
+    def upload_data(self, texts, source, prune=True, bump_version=True):
+        self.batches.append(list(texts))
+        return True
+
+
+def test_flush_writes_pending_texts():
+    store = RecordingStore()
+    writer = ChatMemoryWriter(store, batch_size=100, flush_interval=60)
+    writer.submit("uno")
+    writer.submit("due")
+    writer.flush()
+    assert store.batches == [["uno", "due"]]
+    writer.close()
+
+
+def test_flush_returns_after_close():
+    store = RecordingStore()
+    writer = ChatMemoryWriter(store, batch_size=100, flush_interval=60)
+    writer.submit("uno")
+    writer.close()
+    assert store.batches == [["uno"]]
+
+    flushed = threading.Thread(target=writer.flush, daemon=True)
+    flushed.start()
+    flushed.join(2)
+    assert not flushed.is_alive()
+    writer.submit("due")
+    assert store.batches == [["uno"]]
+
+
+def test_delete_all_flushes_chat_memory_first(chatbot, routes):
+    chatbot.memory_writer.submit("domanda in coda")
+    routes.delete_all()
+    # Quanto fosse rimasto in coda verrebbe scritto qui, dopo l'eliminazione
+    chatbot.memory_writer.close()
+    assert routes.get_sources() == []
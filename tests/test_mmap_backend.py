@@ -0,0 +1,43 @@
+import numpy as np
+
+from my_package.backends.mmap_backend import MmapBackend
+
+DIMENSION = 16
+
+
+def _vectors(start: int, count: int):
+    rng = np.random.default_rng(start)
+    return [
+        (f"id-{number}", rng.standard_normal(DIMENSION).tolist(), {"source": "doc.pdf", "text": str(number)})
+        for number in range(start, start + count)
+    ]
+
+
+def _backend(tmp_path, **kwargs) -> MmapBackend:
+    return MmapBackend("test", DIMENSION, "cosine", index_dir=str(tmp_path), **kwargs)
+
+
+def test_writes_are_visible_to_another_instance(tmp_path):
+    writer = _backend(tmp_path, wal_max_ops=3)
+    writer.create_index()
+    vectors = _vectors(0, 10)
+    for offset in range(0, 10, 2):
+        writer.upsert(vectors[offset:offset + 2])
+    writer.delete(["id-0"])
+
+    reader = _backend(tmp_path)
+    assert len(reader.list_ids_and_source()) == 9
+    results = reader.query(vectors[5][1], 1)
+    assert results[0]["id"] == "id-5"
+    assert reader.query(vectors[0][1], 1)[0]["id"] != "id-0"
+
+
+def test_namespaces(tmp_path):
+    backend = _backend(tmp_path)
+    backend.create_index()
+    backend.upsert(_vectors(0, 3), namespace="a.pdf")
+    backend.upsert(_vectors(3, 3))
+    assert backend.list_namespaces() == ["", "a.pdf"]
+    assert {item["id"] for item in backend.query(_vectors(0, 1)[0][1], 5, "a.pdf")} == {"id-0", "id-1", "id-2"}
+    backend.delete_namespace("a.pdf")
+    assert backend.list_namespaces() == [""]
@@ -0,0 +1,75 @@
+import pytest
+
+from benchmarks.synthetic_pdf import make_pdf
+from my_package import pdf2chunks
+from my_package.pdf2chunks import PageExtractionError, PageText, Pdf2Chunks, PDFTextExtractor
+
+
+def _pdf(tmp_path, seed: int, pages: int = 3) -> str:
+    path = str(tmp_path / "doc.pdf")
+    make_pdf(path, pages=pages, lines_per_page=20, seed=seed)
+    return path
+
+
+def _fail_page(monkeypatch, failed: int) -> None:
+    original = pdf2chunks._extract_page_range
+
+    def extract(pdf_path, start, end):
+        return [
+            PageText(page.page, error="pagina illeggibile") if page.page == failed else page
+            for page in original(pdf_path, start, end)
+        ]
+
+    monkeypatch.setattr(pdf2chunks, "_extract_page_range", extract)
+
+
+def test_iter_chunks_raises_after_the_last_chunk_when_pages_fail(tmp_path, monkeypatch):
+    path = _pdf(tmp_path, seed=1)
+    _fail_page(monkeypatch, 1)
+    chunks = []
+    with pytest.raises(PageExtractionError) as error:
+        for chunk in Pdf2Chunks.iterChunks(path):
+            chunks.append(chunk)
+    assert [page.page for page in error.value.pages] == [1]
+    assert chunks and all(chunk.metadata["page_start"] != 2 for chunk in chunks)
+
+
+def test_failed_pages_keep_indexed_chunks_and_fingerprint(routes, tmp_path, monkeypatch):
+    path = _pdf(tmp_path, seed=1)
+    state, first = routes._ingest_pdf(path)
+    assert state == "success"
+    manifest = routes.vectorstore.manifest
+    fingerprint = manifest.get_file(path)
+    indexed = set(manifest.get_ids("doc.pdf"))
+
+    # Il file cambia e una pagina non viene estratta
+    make_pdf(path, pages=3, lines_per_page=20, seed=2)
+    _fail_page(monkeypatch, 1)
+    state, report = routes._ingest_pdf(path)
+    assert state == "error"
+    assert not report.success and "pagine 2" in report.error
+    assert report.removed == 0
+    assert indexed <= set(manifest.get_ids("doc.pdf"))
+    assert manifest.get_file(path) == fingerprint
+
+
+def test_parallel_extraction_uses_spawned_processes(tmp_path, monkeypatch):
+    path = _pdf(tmp_path, seed=1, pages=4)
+    sequential = PDFTextExtractor(path, workers=1).extract_text()
+    monkeypatch.setenv("PDF_PARALLEL_MIN_PAGES", "2")
+    extractor = PDFTextExtractor(path, workers=2)
+    assert extractor.extract_text() == sequential
+    assert pdf2chunks._get_process_pool(2)._mp_context.get_start_method() == "spawn"
+
+
+def test_length_function_setting(fakes, monkeypatch):
+    monkeypatch.setenv("PDF_LENGTH_FUNCTION", "tokens")
+    monkeypatch.setenv("PDF_CHUNK_SIZE", "5")
+    monkeypatch.setenv("PDF_CHUNK_OVERLAP", "0")
+    splitter = Pdf2Chunks.getSplitter()
+    chunks = list(splitter.feed("uno due tre\nquattro cinque sei\nsette otto", 1)) + list(splitter.flush())
+    assert [chunk.page_content for chunk in chunks] == ["uno due tre", "quattro cinque sei\nsette otto"]
+
+    monkeypatch.setenv("PDF_LENGTH_FUNCTION", "parole")
+    with pytest.raises(ValueError, match="PDF_LENGTH_FUNCTION"):
+        Pdf2Chunks.getSplitter()
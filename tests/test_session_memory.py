@@ -0,0 +1,46 @@
+import threading
+import time
+
+from my_package.session_memory import SessionStore
+
+
+def _wait(condition, timeout: float = 5.0) -> None:
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timeout"
+        time.sleep(0.01)
+
+
+def test_summary_runs_in_background(fakes):
+    release = threading.Event()
+    calls = []
+
+    def summarizer(summary, turns):
+        calls.append(turns)
+        release.wait(5)
+        return "riassunto " + " ".join(question for question, _ in turns)
+
+    store = SessionStore(token_budget=12, summary_tokens=5, summarizer=summarizer)
+    store.add_turn("s", "uno", "risposta uno")
+    start = time.perf_counter()
+    store.add_turn("s", "due", "risposta due")
+    # add_turn non attende il riassunto, e gli scambi usciti restano nella cronologia
+    assert time.perf_counter() - start < 1
+    _wait(lambda: calls)
+    assert "Human: uno" in store.history("s")
+
+    release.set()
+    _wait(lambda: "riassunto uno" in store.history("s"))
+    assert "Human: uno" not in store.history("s")
+    assert "Human: due" in store.history("s")
+
+
+def test_failed_summary_drops_evicted_turns(fakes):
+    def summarizer(summary, turns):
+        raise RuntimeError("LLM non raggiungibile")
+
+    store = SessionStore(token_budget=12, summary_tokens=5, summarizer=summarizer)
+    store.add_turn("s", "uno", "risposta uno")
+    store.add_turn("s", "due", "risposta due")
+    _wait(lambda: "Human: uno" not in store.history("s"))
+    assert store.history("s") == "Human: due\nAI: risposta due"
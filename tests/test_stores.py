@@ -0,0 +1,96 @@
+import time
+
+import numpy as np
+
+from benchmarks.fakes import FakeEmbeddings
+from my_package.embedding_cache import CachedEmbeddings
+from my_package.history import HistoryStore
+from my_package.lexical_index import LexicalIndex
+from my_package.manifest import Manifest
+
+
+def test_manifest_sources_and_files(tmp_path):
+    manifest = Manifest("test", str(tmp_path / "manifest.sqlite3"))
+    manifest.add(["a1", "a2"], "a.pdf")
+    manifest.add(["b1"], "b.pdf")
+    manifest.set_file("/docs/a.pdf", "a.pdf", 10, 1.0, "hash")
+    assert manifest.list_sources() == ["a.pdf", "b.pdf"]
+    assert manifest.count_by_source() == {"a.pdf": 2, "b.pdf": 1}
+    assert manifest.get_ids_by_source(["a.pdf", "c.pdf"]) == {"a.pdf": ["a1", "a2"], "c.pdf": []}
+    assert manifest.get_paths("a.pdf") == ["/docs/a.pdf"]
+
+    # Un altro indice nello stesso file non vede queste righe
+    assert Manifest("other", str(tmp_path / "manifest.sqlite3")).count() == 0
+
+    manifest.remove_sources(["a.pdf"])
+    assert manifest.get_ids("a.pdf") == []
+    assert manifest.get_file("/docs/a.pdf") is None
+    version = manifest.get_version()
+    assert manifest.replace_all([{"id": "c1", "source": "c.pdf"}]) == 1
+    assert manifest.list_sources() == ["c.pdf"]
+    assert manifest.get_version() > version
+
+
+def test_history_query_and_compact(tmp_path):
+    history = HistoryStore(str(tmp_path / "history.sqlite3"))
+    assert history.append([{"path": "/a.pdf", "state": "error"}])
+    time.sleep(0.01)
+    assert history.append([{"path": "/a.pdf", "state": "success"}, {"path": "/b.pdf", "state": "wrong"}])
+    assert [record["state"] for record in history.query(path="/a.pdf")] == ["success", "error"]
+    assert [record["path"] for record in history.query(state="wrong")] == ["/b.pdf"]
+
+    assert history.compact(keep_per_path=1) == 1
+    assert [record["state"] for record in history.query(path="/a.pdf")] == ["success"]
+
+
+def test_history_imports_the_legacy_json_once(tmp_path):
+    legacy = tmp_path / "history.json"
+    legacy.write_text('[{"path": "/a.pdf", "state": "success"}]')
+    db_path = str(tmp_path / "history.sqlite3")
+    HistoryStore(db_path, legacy_json=str(legacy))
+    history = HistoryStore(db_path, legacy_json=str(legacy))
+    assert len(history.query()) == 1
+
+
+def test_lexical_index_search_and_remove(tmp_path):
+    index = LexicalIndex("test", str(tmp_path / "lexical.sqlite3"))
+    index.add([("a1", "Art. 2112 trasferimento d'azienda", {}), ("a2", "ferie e permessi", {})], "a.pdf")
+    index.add([("b1", "Art. 2112 cessione del contratto", {})], "b.pdf")
+    results = index.search("articolo 2112", k=5)
+    assert {doc.metadata["source"] for doc, _ in results} == {"a.pdf", "b.pdf"}
+    assert [doc.metadata["source"] for doc, _ in index.search("2112", sources=["b.pdf"])] == ["b.pdf"]
+
+    index.remove_sources(["a.pdf"])
+    assert index.count() == 1
+    index.remove(["b1"])
+    assert index.search("2112") == []
+
+
+def test_lexical_scores_do_not_depend_on_other_indexes(tmp_path):
+    db_path = str(tmp_path / "lexical.sqlite3")
+    alone = LexicalIndex("alone", str(tmp_path / "alone.sqlite3"))
+    shared = LexicalIndex("shared", db_path)
+    other = LexicalIndex("other", db_path)
+    items = [("a1", "Art. 2112 trasferimento d'azienda", {}), ("a2", "ferie e permessi", {})]
+    alone.add(items, "a.pdf")
+    shared.add(items, "a.pdf")
+    other.add([(f"o{number}", f"Art. 2112 comma {number}", {}) for number in range(50)], "o.pdf")
+
+    expected = [(doc.page_content, score) for doc, score in alone.search("2112 trasferimento")]
+    assert [(doc.page_content, score) for doc, score in shared.search("2112 trasferimento")] == expected
+    assert shared.count() == 2
+
+
+def test_embedding_cache_is_shared_through_the_database(tmp_path):
+    model = FakeEmbeddings(8)
+    db_path = str(tmp_path / "embeddings.sqlite3")
+    first = CachedEmbeddings(model, db_path)
+    vectors = first.embed_documents(["uno", "due"])
+    assert model.texts == 2
+
+    # Un'altra istanza (ad esempio un altro processo) trova i vettori su disco
+    second = CachedEmbeddings(model, db_path)
+    cached = second.embed_documents(["due", "uno", "tre"])
+    assert np.allclose(cached[:2], [vectors[1], vectors[0]], atol=1e-6)
+    assert model.texts == 3
+    assert second.stats()["hits_disk"] == 2
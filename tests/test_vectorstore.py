@@ -0,0 +1,77 @@
+import pytest
+
+
+@pytest.fixture
+def partitioned(monkeypatch, fakes):
+    monkeypatch.setenv("VECTOR_PARTITION_MODE", "source")
+    from my_package.vectorstore import Vectorstore
+    vectorstore = Vectorstore("test")
+    vectorstore.create_index()
+    for source in ("a.pdf", "b.pdf", "c.pdf"):
+        texts = [f"{source} chunk {number}" for number in range(5)]
+        assert vectorstore.sync_data(texts, source).success
+    return vectorstore
+
+
+def _namespace_ids(backend, namespace):
+    return set(backend._vectors(namespace))
+
+
+def test_unscoped_query_hits_only_the_global_namespace(partitioned, monkeypatch):
+    backend = partitioned.backend
+    queried = []
+    original = backend.query
+
+    def query(vector, top_k, namespace=""):
+        queried.append(namespace)
+        return original(vector, top_k, namespace)
+
+    monkeypatch.setattr(backend, "query", query)
+    store, _ = partitioned.get_index()
+    docs = store.similarity_search("b.pdf chunk 3", k=3)
+    assert queried == [""]
+    assert docs[0].page_content == "b.pdf chunk 3"
+
+    queried.clear()
+    docs = store.similarity_search("b.pdf chunk 3", k=3, sources=["a.pdf"])
+    assert queried == ["a.pdf"]
+    assert {doc.metadata["source"] for doc in docs} == {"a.pdf"}
+
+
+def test_delete_removes_the_global_copies(partitioned):
+    backend = partitioned.backend
+    ids = set(partitioned.manifest.get_ids("b.pdf"))
+    assert ids <= _namespace_ids(backend, "")
+
+    report = partitioned.delete_sources(["b.pdf"])
+    assert report.success == ["b.pdf"]
+    assert "b.pdf" not in backend.list_namespaces()
+    assert not ids & _namespace_ids(backend, "")
+    assert len(_namespace_ids(backend, "")) == 10
+
+
+def test_prune_removes_the_global_copies(partitioned):
+    backend = partitioned.backend
+    report = partitioned.sync_data(["a.pdf chunk 0"], "a.pdf")
+    assert report.removed == 4
+    assert len(_namespace_ids(backend, "a.pdf")) == 1
+    assert len(_namespace_ids(backend, "")) == 11
+
+
+def test_unreachable_backend_is_reported_not_raised(fakes, monkeypatch):
+    from my_package.backends import VectorBackendError
+    from my_package.vectorstore import Vectorstore
+
+    vectorstore = Vectorstore("test")
+    # Indice creato fuori dall'applicativo: il manifest va ricostruito interrogando il backend
+    vectorstore.backend.create_index()
+
+    def fail():
+        raise VectorBackendError("non raggiungibile")
+
+    monkeypatch.setattr(vectorstore.backend, "index_exists", fail)
+    assert vectorstore.delete_sources(["a.pdf"]).error == ["a.pdf"]
+    assert vectorstore.delete_all().deleted == {}
+    assert vectorstore.get_all_source() is None
+    report = vectorstore.sync_data(["testo"], "a.pdf")
+    assert not report.success and report.error